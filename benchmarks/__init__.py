@@ -0,0 +1 @@
+"""Бенчмарки и нагрузочные скрипты (запуск: python -m benchmarks.<имя>)"""
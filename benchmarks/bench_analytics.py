@@ -0,0 +1,299 @@
+"""
+Бенчмарк аналитики на большом детерминированном наборе данных
+
+Для каждого размера (--sizes, по умолчанию 10k, 100k и 1M респондентов)
+генератор benchmarks.dataset заполняет файл SQLite: несколько волн,
+мультивыбор в JSON и опции в answer_options, агрегаты пересчитаны,
+статистика планировщика собрана (ANALYZE), как в рабочей базе после
+init_db.
+Файлы кэшируются в --cache-dir по (размер, seed, волны, версия схемы) —
+миллион респондентов строится несколько минут, а данные от запуска к
+запуску те же.
+
+Каждая операция выполняется один раз вхолостую и --repeat раз с
+замером, каждый раз в новой сессии читателя. Кроме методов
+SurveyAnalytics меряются пути, которыми ходят команды бота: /crosstab —
+кросс-таблица по матрице ответов, /export — потоковый iter_export_rows.
+Режимы: raw и aggregates — SurveyAnalytics без агрегатов и с ними;
+cold — матрица строится заново на каждом прогоне, warm — берётся из
+кэша и только догружает новые завершения.
+Результаты пишутся в JSON (--output); с --compare печатается
+изменение медиан относительно прошлого запуска.
+
+Запуск: python -m benchmarks.bench_analytics [--sizes N ...] [--output FILE] [--compare FILE]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import sqlalchemy
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from models import Answer, AnswerOption, Respondent
+from models.database import Base, SQLITE_PROFILES, create_engines
+from services.analytics import SurveyAnalytics
+from services.answer_matrix import get_answer_matrix, reset_answer_matrices
+from benchmarks.dataset import populate
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+# Вопросы для распределения и кросс-таблицы: оба с мультивыбором,
+# чтобы пары опций перемножались
+DISTRIBUTION_QUESTION = "Q1"
+CROSS_TAB_QUESTIONS = ("Q1", "Q2")
+
+Operation = Callable[[SurveyAnalytics, Optional[str]], Awaitable[Any]]
+
+
+async def matrix_cross_tab(analytics: SurveyAnalytics, wave: Optional[str]):
+    """Кросс-таблица, как в /crosstab"""
+    matrix = await get_answer_matrix(analytics.session, wave)
+    return matrix.cross_tab(*CROSS_TAB_QUESTIONS)
+
+
+async def stream_export(analytics: SurveyAnalytics, wave: Optional[str]) -> int:
+    """Выгрузка, как в /export: строки читаются потоком и не накапливаются"""
+    count = 0
+    async for _ in analytics.iter_export_rows(wave):
+        count += 1
+    return count
+
+
+RAW = ("raw",)
+WITH_AGGREGATES = ("raw", "aggregates")
+MATRIX = ("cold", "warm")
+
+# (имя, вызов, режимы)
+OPERATIONS: List[Tuple[str, Operation, Tuple[str, ...]]] = [
+    ("get_total_respondents", lambda a, wave: a.get_total_respondents(wave), WITH_AGGREGATES),
+    ("get_question_distribution", lambda a, wave: a.get_question_distribution(DISTRIBUTION_QUESTION, wave), WITH_AGGREGATES),
+    ("get_cross_tab", lambda a, wave: a.get_cross_tab(*CROSS_TAB_QUESTIONS, wave), RAW),
+    ("matrix_cross_tab", matrix_cross_tab, MATRIX),
+    ("generate_detailed_stats", lambda a, wave: a.generate_detailed_stats(wave), WITH_AGGREGATES),
+    ("export_to_csv_data", lambda a, wave: a.export_to_csv_data(wave), RAW),
+    ("iter_export_rows", stream_export, RAW),
+]
+
+
+# Версия набора в имени файла: кэш, собранный до изменения таблиц или
+# сборки (v3 — со статистикой планировщика, v4 — агрегаты с текстом
+# опций), не подхватывается
+DATASET_SCHEMA = 4
+
+
+def dataset_path(cache_dir: str, size: int, seed: int, waves: int) -> str:
+    return os.path.join(cache_dir, f"analytics_{size}_s{seed}_w{waves}_v{DATASET_SCHEMA}.db")
+
+
+async def build_dataset(path: str, size: int, seed: int, waves: int, profile: str):
+    """Сгенерировать БД во временный файл и переименовать — прерванная сборка не попадёт в кэш"""
+    partial = path + ".partial"
+    for leftover in (partial, partial + "-wal", partial + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    
+    writer, reader = create_engines(f"sqlite+aiosqlite:///{partial}", profile, readers=1)
+    async with writer.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await populate(conn, size, seed, waves)
+        # Без статистики пересчёт агрегатов шёл бы по планам вслепую
+        await conn.exec_driver_sql("ANALYZE")
+    
+    writer_sessions = async_sessionmaker(writer, class_=AsyncSession, expire_on_commit=False)
+    async with writer_sessions() as session:
+        await SurveyAnalytics(session).rebuild_aggregates()
+        await session.commit()
+    
+    async with writer.begin() as conn:
+        await conn.exec_driver_sql("ANALYZE")
+    
+    await writer.dispose()
+    await reader.dispose()
+    os.replace(partial, path)
+
+
+async def count_rows(sessions) -> Dict[str, int]:
+    async with sessions() as session:
+        return {
+            table.__tablename__: (await session.execute(select(func.count()).select_from(table))).scalar()
+            for table in (Respondent, Answer, AnswerOption)
+        }
+
+
+async def has_statistics(sessions) -> bool:
+    """Есть ли в базе статистика планировщика: без неё сырые запросы идут другими планами"""
+    async with sessions() as session:
+        result = await session.execute(
+            text("SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'")
+        )
+        if not result.scalar():
+            return False
+        return bool((await session.execute(text("SELECT count(*) FROM sqlite_stat1"))).scalar())
+
+
+def result_size(value: Any) -> int:
+    """Размер результата: число — как есть, коллекция или текст — длина"""
+    return value if isinstance(value, int) else len(value)
+
+
+async def time_operation(sessions, operation: Operation, mode: str, wave: Optional[str], repeat: int):
+    """Холостой прогон и repeat замеров; вернуть длительности, мс, и размер результата"""
+    durations = []
+    size = 0
+    # Матрица, оставшаяся от прошлой операции или другого размера, не должна попасть в замер
+    reset_answer_matrices()
+    for attempt in range(repeat + 1):
+        if mode == "cold":
+            reset_answer_matrices()
+        started = time.perf_counter()
+        async with sessions() as session:
+            value = await operation(SurveyAnalytics(session, use_aggregates=mode == "aggregates"), wave)
+        elapsed = (time.perf_counter() - started) * 1000
+        size = result_size(value)
+        del value
+        if attempt:
+            durations.append(elapsed)
+    return durations, size
+
+
+async def run_size(
+    size: int, args: argparse.Namespace, cache_dir: str
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    path = dataset_path(cache_dir, size, args.seed, args.waves)
+    if not os.path.exists(path):
+        print(f"Генерация {size} респондентов → {path}")
+        started = time.perf_counter()
+        await build_dataset(path, size, args.seed, args.waves, args.profile)
+        print(f"  готово за {time.perf_counter() - started:.1f} с")
+    
+    writer, reader = create_engines(f"sqlite+aiosqlite:///{path}", args.profile, readers=1)
+    sessions = async_sessionmaker(reader, class_=AsyncSession, expire_on_commit=False)
+    rows = await count_rows(sessions)
+    analyzed = await has_statistics(sessions)
+    if not analyzed:
+        print(f"  внимание: в {path} нет статистики планировщика (sqlite_stat1)")
+    
+    results = []
+    for name, operation, modes in OPERATIONS:
+        for mode in modes:
+            durations, result = await time_operation(sessions, operation, mode, args.wave, args.repeat)
+            results.append({
+                "respondents": size,
+                "operation": name,
+                "mode": mode,
+                "runs_ms": [round(d, 3) for d in durations],
+                "min_ms": round(min(durations), 3),
+                "median_ms": round(statistics.median(durations), 3),
+                "max_ms": round(max(durations), 3),
+                "result_size": result,
+                "statistics": analyzed,
+            })
+    
+    reset_answer_matrices()
+    await writer.dispose()
+    await reader.dispose()
+    return {"rows": rows, "statistics": analyzed}, results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result: Dict[str, Any]) -> Tuple[int, str, str]:
+    return result["respondents"], result["operation"], result["mode"]
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Dict[Tuple[int, str, str], Dict[str, Any]]):
+    header = f"{'респондентов':>13}  {'операция':<27}{'режим':<12}{'медиана':>12}{'min':>12}{'max':>12}"
+    if baseline:
+        header += f"{'было':>12}{'изменение':>11}"
+    print("\n" + header)
+    for r in results:
+        line = (
+            f"{r['respondents']:>13}  {r['operation']:<27}{r['mode']:<12}"
+            f"{r['median_ms']:>10.1f}мс{r['min_ms']:>10.1f}мс{r['max_ms']:>10.1f}мс"
+        )
+        old = baseline.get(result_key(r))
+        if old:
+            line += f"{old['median_ms']:>10.1f}мс{(r['median_ms'] / old['median_ms'] - 1) * 100:>+10.1f}%"
+            # Прогоны без поля statistics — из версий до ANALYZE в сборке набора
+            if old.get("statistics", False) != r["statistics"]:
+                line += "  (статистика планировщика разная — сравниваются и планы)"
+        print(line)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="числа респондентов")
+    parser.add_argument("--waves", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="замеров на операцию после холостого прогона")
+    parser.add_argument("--wave", default=None, help="мерить с фильтром по волне, например wave_1")
+    parser.add_argument("--profile", default="wal", choices=list(SQLITE_PROFILES))
+    parser.add_argument(
+        "--cache-dir", default=os.path.join(tempfile.gettempdir(), "bench_analytics"),
+        help="где хранить сгенерированные БД"
+    )
+    parser.add_argument("--output", default="bench_analytics.json", help="файл результатов JSON")
+    parser.add_argument("--compare", default=None, help="JSON прошлого запуска для сравнения медиан")
+    args = parser.parse_args()
+    
+    os.makedirs(args.cache_dir, exist_ok=True)
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = {result_key(r): r for r in json.load(f)["results"]}
+    
+    started_at = datetime.now().isoformat(timespec="seconds")
+    datasets, results = [], []
+    for size in args.sizes:
+        dataset, size_results = await run_size(size, args, args.cache_dir)
+        datasets.append({"respondents": size, **dataset})
+        results.extend(size_results)
+    
+    report = {
+        "meta": {
+            "started_at": started_at,
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "waves": args.waves,
+            "wave": args.wave,
+            "repeat": args.repeat,
+            "profile": args.profile,
+            # ru_maxrss в килобайтах на Linux
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "datasets": datasets,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    print_results(results, baseline)
+    print(f"\nРезультаты: {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
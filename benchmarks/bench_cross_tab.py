@@ -0,0 +1,133 @@
+"""
+Бенчмарк SQL-кросс-таблицы против запроса из первой оптимизации
+
+Эталон — self-join ответов с разбором JSON через json_each, каким
+get_cross_tab был до нормализации опций в answer_options. Текущий
+SurveyAnalytics.get_cross_tab должен давать те же числа и быть не
+медленнее эталона на том же наборе данных (по умолчанию 50k
+респондентов из benchmarks.bench_analytics). Если медиана хуже эталона
+больше чем на --tolerance, скрипт завершается с кодом 1.
+
+Запуск: python -m benchmarks.bench_cross_tab [--size N] [--pairs Q1:Q2 ...] [--tolerance 0.1]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, Tuple
+
+from sqlalchemy import select, and_, case, func, true
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import aliased
+
+from models import Answer, Respondent
+from models.database import SQLITE_PROFILES, create_engines
+from services.analytics import SurveyAnalytics
+from benchmarks.bench_analytics import dataset_path, build_dataset
+
+DEFAULT_PAIRS = ["Q1:Q2", "Q3:Q5"]
+
+
+def _json_options(name: str):
+    """Ответ и его опции через json_each, как в первом однозапросном get_cross_tab"""
+    answer = aliased(Answer)
+    items = case(
+        (func.json_valid(answer.answer) == 0, func.json_array(answer.answer)),
+        (func.json_type(answer.answer) == "array", answer.answer),
+        else_=func.json_array(answer.answer)
+    )
+    return answer, func.json_each(items).table_valued("value").alias(name)
+
+
+def _option_code(value):
+    return case(
+        (func.instr(value, ":") > 0, func.substr(value, 1, func.instr(value, ":") - 1)),
+        else_=value
+    )
+
+
+async def reference_cross_tab(session: AsyncSession, question1: str, question2: str) -> Dict[Tuple[str, str], int]:
+    answer1, options1 = _json_options("opt1")
+    answer2, options2 = _json_options("opt2")
+    option1 = _option_code(options1.c.value)
+    option2 = _option_code(options2.c.value)
+    
+    query = (
+        select(option1, option2, func.count(func.distinct(Respondent.id)))
+        .select_from(Respondent)
+        .join(answer1, and_(answer1.respondent_id == Respondent.id, answer1.question_code == question1))
+        .join(options1, true())
+        .join(answer2, and_(answer2.respondent_id == Respondent.id, answer2.question_code == question2))
+        .join(options2, true())
+        .where(and_(Respondent.completed == True, Respondent.archived == False))
+        .group_by(option1, option2)
+    )
+    result = await session.execute(query)
+    return {(opt1, opt2): count for opt1, opt2, count in result.all()}
+
+
+async def current_cross_tab(session: AsyncSession, question1: str, question2: str) -> Dict[Tuple[str, str], int]:
+    return await SurveyAnalytics(session).get_cross_tab(question1, question2)
+
+
+async def time_query(sessions, query, pair: Tuple[str, str], repeat: int):
+    """Холостой прогон и repeat замеров; вернуть медиану, мс, и результат"""
+    durations = []
+    for attempt in range(repeat + 1):
+        started = time.perf_counter()
+        async with sessions() as session:
+            value = await query(session, *pair)
+        if attempt:
+            durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations), value
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=50_000, help="число респондентов")
+    parser.add_argument("--waves", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pairs", nargs="+", default=DEFAULT_PAIRS, help="пары вопросов вида Q1:Q2")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="допустимое замедление относительно эталона")
+    parser.add_argument("--profile", default="wal", choices=list(SQLITE_PROFILES))
+    parser.add_argument(
+        "--cache-dir", default=os.path.join(tempfile.gettempdir(), "bench_analytics"),
+        help="где хранить сгенерированные БД"
+    )
+    args = parser.parse_args()
+    
+    os.makedirs(args.cache_dir, exist_ok=True)
+    path = dataset_path(args.cache_dir, args.size, args.seed, args.waves)
+    if not os.path.exists(path):
+        print(f"Генерация {args.size} респондентов → {path}")
+        await build_dataset(path, args.size, args.seed, args.waves, args.profile)
+    
+    writer, reader = create_engines(f"sqlite+aiosqlite:///{path}", args.profile, readers=1)
+    sessions = async_sessionmaker(reader, class_=AsyncSession, expire_on_commit=False)
+    
+    print(f"\n{'пара':<10}{'эталон':>12}{'сейчас':>12}{'изменение':>11}")
+    failed = False
+    for pair in (tuple(p.split(":")) for p in args.pairs):
+        reference_ms, expected = await time_query(sessions, reference_cross_tab, pair, args.repeat)
+        current_ms, actual = await time_query(sessions, current_cross_tab, pair, args.repeat)
+        if actual != expected:
+            print(f"{'×'.join(pair)}: результаты расходятся с эталоном")
+            failed = True
+        slower = current_ms > reference_ms * (1 + args.tolerance)
+        failed = failed or slower
+        print(
+            f"{'×'.join(pair):<10}{reference_ms:>10.1f}мс{current_ms:>10.1f}мс"
+            f"{(current_ms / reference_ms - 1) * 100:>+10.1f}%{'  медленнее эталона' if slower else ''}"
+        )
+    
+    await writer.dispose()
+    await reader.dispose()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Микро-бенчмарк навигации по анкете
+
+Сравнивает поиски, которые делает один апдейт опроса (вопрос по коду,
+опция, номер в этапе, следующий вопрос), на линейных проходах по
+спискам вопросов и на скомпилированном индексе QUESTIONNAIRE.
+
+Запуск: python -m benchmarks.bench_questions [--number N]
+"""
+import argparse
+import timeit
+
+from utils.questions import INITIAL_QUESTIONS, LINGUISTIC_QUESTIONS, QUESTIONS, QUESTIONNAIRE
+
+
+def linear_update(question_code: str, option_code: str):
+    """Поиски одного апдейта так, как их делали хендлеры до индекса"""
+    question = next(q for q in QUESTIONS if q["code"] == question_code)
+    option = next((o for o in question.get("options", []) if o["code"] == option_code), None)
+    
+    questions_list = INITIAL_QUESTIONS if question_code.startswith('Q') else LINGUISTIC_QUESTIONS
+    current_idx = next((i for i, q in enumerate(questions_list) if q["code"] == question_code), -1)
+    next_q = questions_list[current_idx + 1]["code"] if current_idx < len(questions_list) - 1 else None
+    
+    if next_q:
+        next_question = next(q for q in QUESTIONS if q["code"] == next_q)
+        question_num = next((i + 1 for i, q in enumerate(questions_list) if q["code"] == next_q), 0)
+        return option, next_question, question_num, len(questions_list)
+    return option, None, 0, 0
+
+
+def indexed_update(question_code: str, option_code: str):
+    """Те же поиски через QUESTIONNAIRE"""
+    option = QUESTIONNAIRE.option(question_code, option_code)
+    
+    next_q = QUESTIONNAIRE.next_in_stage.get(question_code)
+    if next_q:
+        next_question = QUESTIONNAIRE.question(next_q)
+        question_num, total = QUESTIONNAIRE.progress(next_q)
+        return option, next_question, question_num, total
+    return option, None, 0, 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="апдейтов на вопрос")
+    args = parser.parse_args()
+    
+    # Худший случай для линейного поиска — последние вопросы этапов
+    cases = [(q["code"], q["options"][-1]["code"]) for q in QUESTIONS if q.get("options")]
+    
+    for case in cases:
+        assert linear_update(*case) == indexed_update(*case), case
+    
+    print(f"{'вопрос':<8}{'линейно, мкс':>16}{'индекс, мкс':>16}{'ускорение':>12}")
+    total_linear = total_indexed = 0.0
+    for case in cases:
+        linear = timeit.timeit(lambda: linear_update(*case), number=args.number) / args.number * 1e6
+        indexed = timeit.timeit(lambda: indexed_update(*case), number=args.number) / args.number * 1e6
+        total_linear += linear
+        total_indexed += indexed
+        print(f"{case[0]:<8}{linear:>16.3f}{indexed:>16.3f}{linear / indexed:>11.1f}x")
+    
+    print(
+        f"{'среднее':<8}{total_linear / len(cases):>16.3f}"
+        f"{total_indexed / len(cases):>16.3f}{total_linear / total_indexed:>11.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
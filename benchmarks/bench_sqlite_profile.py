@@ -0,0 +1,112 @@
+"""
+Бенчмарк профилей SQLite: запись ответов во время тяжёлой аналитики
+
+Для каждого профиля (models.database.SQLITE_PROFILES) во временном
+файле создаётся БД с --respondents респондентами. Затем меряется
+задержка записи ответа (upsert + commit, как у бота) — сначала без
+нагрузки, потом пока читатели в цикле строят /detailed_stats без
+агрегатов. В rollback journal запись ждёт окончания чтения, в WAL — нет.
+
+Запуск: python -m benchmarks.bench_sqlite_profile [--respondents N] [--writes N]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from models import upsert_answer
+from models.database import Base, SQLITE_PROFILES, create_engines
+from services.analytics import SurveyAnalytics
+from benchmarks.dataset import populate
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def write_answers(session_maker, count: int, offset: int):
+    """Записать count ответов по одному, как клики пользователей; вернуть задержки, мс"""
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        async with session_maker() as session:
+            await upsert_answer(session, offset + i % 1000 + 1, "Q3", "Q3_OP2")
+            await session.commit()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+async def read_stats(session_maker, done: asyncio.Event):
+    """Строить детальную статистику, пока идёт запись; вернуть длительности, мс"""
+    durations = []
+    while not done.is_set():
+        started = time.perf_counter()
+        async with session_maker() as session:
+            await SurveyAnalytics(session).generate_detailed_stats()
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+async def run_profile(profile: str, respondents: int, writes: int, readers: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        writer, reader = create_engines(url, profile, readers)
+        
+        async with writer.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await populate(conn, respondents)
+        
+        writer_sessions = async_sessionmaker(writer, class_=AsyncSession, expire_on_commit=False)
+        reader_sessions = async_sessionmaker(reader, class_=AsyncSession, expire_on_commit=False)
+        
+        idle = await write_answers(writer_sessions, writes, 0)
+        
+        done = asyncio.Event()
+        reads = [asyncio.create_task(read_stats(reader_sessions, done)) for _ in range(readers)]
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        loaded = await write_answers(writer_sessions, writes, 1000)
+        elapsed = time.perf_counter() - started
+        done.set()
+        read_durations = [d for durations in await asyncio.gather(*reads) for d in durations]
+        
+        await writer.dispose()
+        await reader.dispose()
+    
+    return {
+        "profile": profile,
+        "idle_p50": statistics.median(idle),
+        "p50": statistics.median(loaded),
+        "p99": percentile(loaded, 0.99),
+        "max": max(loaded),
+        "writes_per_s": writes / elapsed,
+        "reads": len(read_durations),
+        "read_ms": statistics.mean(read_durations) if read_durations else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--respondents", type=int, default=20000)
+    parser.add_argument("--writes", type=int, default=300)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--profiles", nargs="+", default=list(SQLITE_PROFILES), choices=list(SQLITE_PROFILES))
+    args = parser.parse_args()
+    
+    print(f"{args.respondents} респондентов, {args.writes} записей, {args.readers} читателя /detailed_stats\n")
+    print(f"{'профиль':<10}{'без чтения p50':>16}{'p50':>10}{'p99':>10}{'max':>10}{'записей/с':>12}{'чтений':>9}{'чтение':>10}")
+    for profile in args.profiles:
+        r = await run_profile(profile, args.respondents, args.writes, args.readers)
+        print(
+            f"{r['profile']:<10}{r['idle_p50']:>14.2f}мс{r['p50']:>8.2f}мс{r['p99']:>8.2f}мс"
+            f"{r['max']:>8.2f}мс{r['writes_per_s']:>12.1f}{r['reads']:>9}{r['read_ms']:>8.0f}мс"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
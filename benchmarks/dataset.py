@@ -0,0 +1,99 @@
+"""Детерминированный генератор тестовых данных опроса"""
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from models import Respondent, Answer, AnswerOption
+from models.answer_option import build_option_rows
+from utils.questions import QUESTIONNAIRE, is_linguistic_bullying
+
+
+def random_answer(rng: random.Random, question: dict) -> str:
+    """Случайный ответ на вопрос в формате, в котором его сохраняет бот"""
+    options = question["options"]
+    if question["type"] == "multi":
+        chosen = rng.sample(options, rng.randint(1, min(3, len(options))))
+        return json.dumps([
+            f"{o['code']}:свой вариант" if o.get("has_input") else o["code"]
+            for o in chosen
+        ])
+    
+    option = rng.choice(options)
+    return f"{option['code']}:свой вариант" if option.get("has_input") else option["code"]
+
+
+def generate_survey(rng: random.Random) -> Dict[str, str]:
+    """
+    Ответы одного респондента по ходу опроса
+    
+    Начальные вопросы — всегда, языковые — только при языковом буллинге,
+    как их задаёт бот.
+    """
+    answers = {q["code"]: random_answer(rng, q) for q in QUESTIONNAIRE.questions
+               if QUESTIONNAIRE.stage[q["code"]] == "initial"}
+    if is_linguistic_bullying(answers):
+        answers.update({q["code"]: random_answer(rng, q) for q in QUESTIONNAIRE.questions
+                        if QUESTIONNAIRE.stage[q["code"]] == "linguistic"})
+    return answers
+
+
+def generate_rows(count: int, seed: int = 42, waves: int = 1) -> Iterator[Tuple[dict, List[dict]]]:
+    """Строки respondents и answers; одинаковый seed — одинаковые данные"""
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1)
+    answer_id = 0
+    
+    for respondent_id in range(1, count + 1):
+        created_at = started + timedelta(seconds=respondent_id * 30)
+        respondent = {
+            "id": respondent_id,
+            "user_id": 1_000_000 + respondent_id,
+            "consented": True,
+            "completed": rng.random() < 0.9,
+            "archived": False,
+            "wave_id": f"wave_{respondent_id % waves + 1}",
+            "created_at": created_at,
+        }
+        respondent["completed_at"] = created_at + timedelta(minutes=5) if respondent["completed"] else None
+        
+        answers = []
+        for question_code, value in generate_survey(rng).items():
+            answer_id += 1
+            answers.append({
+                "id": answer_id,
+                "respondent_id": respondent_id,
+                "question_code": question_code,
+                "answer": value,
+                "created_at": created_at,
+            })
+        yield respondent, answers
+
+
+async def populate(conn: AsyncConnection, count: int, seed: int = 42, waves: int = 1, chunk_size: int = 5000):
+    """Залить count респондентов с ответами и опциями ответов пачками"""
+    respondents, answers, options = [], [], []
+    
+    async def flush():
+        if respondents:
+            await conn.execute(insert(Respondent), respondents)
+        if answers:
+            await conn.execute(insert(Answer), answers)
+        if options:
+            await conn.execute(insert(AnswerOption), options)
+        respondents.clear()
+        answers.clear()
+        options.clear()
+    
+    for respondent, respondent_answers in generate_rows(count, seed, waves):
+        respondents.append(respondent)
+        answers.extend(respondent_answers)
+        for answer in respondent_answers:
+            options.extend(build_option_rows(answer["id"], answer["question_code"], answer["answer"]))
+        if len(respondents) >= chunk_size:
+            await flush()
+    
+    await flush()
@@ -0,0 +1,328 @@
+"""
+Нагрузочный тест: виртуальные респонденты проходят опрос через настоящий Dispatcher
+
+Диспетчер собирается как в bot.py (роутеры common, survey, admin и их
+middleware), база и FSM — во временном каталоге, Bot работает через
+сессию без сети, которая запоминает исходящие вызовы. Каждый виртуальный
+пользователь нажимает кнопки из последней клавиатуры, которую ему прислал
+бот: согласие, «Пройти опрос», ответы на Q1–Q6 и, если бот перешёл к
+ним, на LQ1–LQ10. Ответы — как в benchmarks.dataset: мультивыбор
+нажатиями на опции и «Готово», для вариантов «другое» — текстовый ввод.
+
+Обновления подаются через feed_raw_update, то есть с разбором JSON в
+модели aiogram, как при получении от Telegram.
+
+Запуск: python -m benchmarks.load_test [--users N] [--concurrency N] [--think S]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# Токен нужен utils.config при импорте хендлеров; запросов в Telegram нет
+os.environ.setdefault("BOT_TOKEN", "42:LOADTEST")
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup
+from sqlalchemy import event, select, func
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from bot import create_dispatcher
+from models import database, Respondent
+from services.answer_writer import answer_writer
+from services.fsm_storage import SQLiteStorage
+from services.markup_debouncer import markup_debouncer
+from middlewares import api_timer, latency_tracker, query_budget, send_limiter
+from utils.callbacks import SURVEY_CALLBACKS, TOGGLE, DONE, ANSWER, done_data, toggle_data, answer_data
+from utils.questions import QUESTIONNAIRE
+from benchmarks.bench_sqlite_profile import percentile
+from tests.fakes import RecordingSession
+
+OTHER_TEXTS = ["на перемене", "в интернете", "не знаю", "по-разному", "в спортивной секции"]
+
+
+class KeyboardSession(RecordingSession):
+    """
+    Сессия без сети из тестов, которая ещё запоминает клавиатуры сообщений
+    
+    Новым сообщениям выдаются возрастающие message_id в пределах чата;
+    правки меняют клавиатуру своего сообщения.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._last_id: Dict[int, int] = {}
+        self.keyboards: Dict[int, Dict[int, Optional[InlineKeyboardMarkup]]] = {}
+    
+    async def make_request(self, bot, method, timeout=None):
+        result = await super().make_request(bot, method, timeout)
+        name = type(method).__name__
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return result
+        
+        markup = getattr(method, "reply_markup", None)
+        if name == "SendMessage":
+            message_id = self._last_id.get(chat_id, 0) + 1
+            self._last_id[chat_id] = message_id
+            self.keyboards.setdefault(chat_id, {})[message_id] = markup
+        elif name in ("EditMessageText", "EditMessageReplyMarkup"):
+            self.keyboards.setdefault(chat_id, {})[method.message_id] = markup
+        return result
+    
+    @property
+    def calls(self) -> Counter:
+        """Число вызовов по методам"""
+        return Counter(self.names)
+    
+    def current_keyboard(self, chat_id: int):
+        """Последнее сообщение чата с клавиатурой: (message_id, клавиатура)"""
+        for message_id, markup in sorted(self.keyboards.get(chat_id, {}).items(), reverse=True):
+            if isinstance(markup, InlineKeyboardMarkup):
+                return message_id, markup
+        return None, None
+
+
+class VirtualUser:
+    """Респондент, который отвечает на то, что ему показал бот"""
+    
+    def __init__(self, user_id: int, rng: random.Random, session: KeyboardSession):
+        self.user_id = user_id
+        self.rng = rng
+        self.session = session
+        self._update_id = user_id * 1000
+        self.started = False
+        self.linguistic = False
+    
+    def _user(self) -> Dict[str, Any]:
+        return {"id": self.user_id, "is_bot": False, "first_name": f"User{self.user_id}", "language_code": "ru"}
+    
+    def _next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+    
+    def message(self, text: str) -> Dict[str, Any]:
+        update = {
+            "update_id": self._next_update_id(),
+            "message": {
+                "message_id": self._update_id,
+                "from": self._user(),
+                "chat": {"id": self.user_id, "type": "private"},
+                "date": int(time.time()),
+                "text": text,
+            },
+        }
+        if text.startswith("/"):
+            update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return update
+    
+    def callback(self, data: str, message_id: int, markup: InlineKeyboardMarkup) -> Dict[str, Any]:
+        return {
+            "update_id": self._next_update_id(),
+            "callback_query": {
+                "id": str(self._update_id),
+                "from": self._user(),
+                "chat_instance": str(self.user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "from": {"id": 42, "is_bot": True, "first_name": "Bot"},
+                    "chat": {"id": self.user_id, "type": "private"},
+                    "date": int(time.time()),
+                    "text": "…",
+                    "reply_markup": markup.model_dump(exclude_none=True),
+                },
+            },
+        }
+    
+    def answer_question(self, question_code: str, message_id: int, markup) -> List[Dict[str, Any]]:
+        """Нажатия (и ввод «другого») для ответа на вопрос, как у dataset.random_answer"""
+        question = QUESTIONNAIRE.question(question_code)
+        options = question["options"]
+        if QUESTIONNAIRE.stage[question_code] == "linguistic":
+            self.linguistic = True
+        
+        if question["type"] == "multi":
+            chosen = self.rng.sample(options, self.rng.randint(1, min(3, len(options))))
+            updates = [self.callback(toggle_data(o["code"]), message_id, markup) for o in chosen]
+            updates.append(self.callback(done_data(question_code), message_id, markup))
+        else:
+            chosen = [self.rng.choice(options)]
+            updates = [self.callback(answer_data(chosen[0]["code"]), message_id, markup)]
+        
+        # Бот спрашивает текст для первого выбранного варианта «другое»
+        if any(o.get("has_input") for o in chosen):
+            updates.append(self.message(self.rng.choice(OTHER_TEXTS)))
+        return updates
+    
+    def next_updates(self) -> List[Dict[str, Any]]:
+        """Что пользователь нажмёт, глядя на последнюю клавиатуру; пусто — опрос пройден"""
+        message_id, markup = self.session.current_keyboard(self.user_id)
+        if markup is None:
+            return [self.message("/start")] if not self.started else []
+        
+        buttons = [button.callback_data for row in markup.inline_keyboard for button in row]
+        if "consent_yes" in buttons:
+            return [self.callback("consent_yes", message_id, markup)]
+        if not self.started and ("get_help" in buttons or "start_survey" in buttons):
+            self.started = True
+            data = "start_survey" if "start_survey" in buttons else "get_help"
+            return [self.callback(data, message_id, markup)]
+        
+        for data in buttons:
+            survey_callback = SURVEY_CALLBACKS.get(data)
+            if survey_callback and survey_callback.action in (ANSWER, TOGGLE, DONE):
+                return self.answer_question(survey_callback.question_code, message_id, markup)
+        return []
+
+
+class LoadTest:
+    def __init__(self, users: int, concurrency: int, think: float, seed: int, rate_limit: bool):
+        self.users = users
+        self.concurrency = concurrency
+        self.think = think
+        self.seed = seed
+        self.rate_limit = rate_limit
+        self.latencies: List[float] = []
+        self.errors: Counter = Counter()
+        self.queries = 0
+        self.linguistic = 0
+        # Дошли до конца опроса: завершили языковой этап или получили отказ после Q1–Q6
+        self.finished = 0
+    
+    def _count_query(self, *args):
+        self.queries += 1
+    
+    async def run_user(self, dp, bot, session: KeyboardSession, user_id: int, slots: asyncio.Semaphore):
+        async with slots:
+            user = VirtualUser(user_id, random.Random(self.seed * 1_000_003 + user_id), session)
+            # Защита от зацикливания, если бот перестал показывать вопросы
+            for _ in range(200):
+                updates = user.next_updates()
+                if not updates:
+                    self.finished += user.started
+                    break
+                for update in updates:
+                    if self.think:
+                        await asyncio.sleep(random.expovariate(1 / self.think))
+                    started = time.perf_counter()
+                    try:
+                        await dp.feed_raw_update(bot, update)
+                    except Exception as e:
+                        self.errors[f"{type(e).__name__}: {str(e).splitlines()[0][:100]}"] += 1
+                    self.latencies.append(time.perf_counter() - started)
+            self.linguistic += user.linguistic
+    
+    async def run(self) -> Dict[str, Any]:
+        with tempfile.TemporaryDirectory(prefix="loadtest-") as tmp:
+            url = f"sqlite+aiosqlite:///{os.path.join(tmp, 'load.db')}"
+            # Все сессии бота (get_session, фоновый писатель) — во временную базу
+            database.engine, database.reader_engine = database.create_engines(url)
+            database.async_session_maker = async_sessionmaker(database.engine, class_=AsyncSession, expire_on_commit=False)
+            database.reader_session_maker = async_sessionmaker(database.reader_engine, class_=AsyncSession, expire_on_commit=False)
+            await database.init_db()
+            for engine in (database.engine, database.reader_engine):
+                event.listen(engine.sync_engine, "after_cursor_execute", self._count_query)
+            
+            session = KeyboardSession()
+            session.middleware(api_timer)
+            if self.rate_limit:
+                session.middleware(send_limiter)
+            bot = Bot("42:LOADTEST", session=session)
+            storage = SQLiteStorage(os.path.join(tmp, "fsm.db"))
+            dp = create_dispatcher(storage)
+            await answer_writer.start()
+            
+            slots = asyncio.Semaphore(self.concurrency)
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                self.run_user(dp, bot, session, 10_000_000 + i, slots) for i in range(self.users)
+            ))
+            # Опрос не пройден, пока ответы не записаны в базу
+            await answer_writer.stop()
+            elapsed = time.perf_counter() - started
+            queries = self.queries
+            
+            await markup_debouncer.close()
+            await storage.close()
+            async with database.async_session_maker() as db:
+                completed = await db.scalar(select(func.count()).where(Respondent.completed == True))
+            await database.engine.dispose()
+            await database.reader_engine.dispose()
+        
+        return {
+            "users": self.users,
+            "completed": completed,
+            "linguistic": self.linguistic,
+            "finished": self.finished,
+            "updates": len(self.latencies),
+            "errors": self.errors,
+            "elapsed": elapsed,
+            "latencies": self.latencies,
+            "queries": queries,
+            "calls": session.calls,
+        }
+
+
+def _ms(seconds: float) -> str:
+    # Верхняя граница корзины гистограммы; последняя — «дольше ~36 с»
+    return "∞" if seconds == float("inf") else f"≤{seconds * 1000:.1f}"
+
+
+def print_report(r: Dict[str, Any]):
+    ms = sorted(latency * 1000 for latency in r["latencies"])
+    print(
+        f"Пользователей: {r['users']}, дошли до языкового этапа: {r['linguistic']}, "
+        f"завершили опрос: {r['completed']}, дошли до конца (с отказом): {r['finished']}"
+    )
+    print(
+        f"Обновлений: {r['updates']} за {r['elapsed']:.1f} с — {r['updates'] / r['elapsed']:.0f} в секунду, "
+        f"ошибок: {sum(r['errors'].values())}"
+    )
+    for error, count in r["errors"].most_common(5):
+        print(f"  {count} × {error}")
+    print(
+        f"Задержка обновления: p50 {statistics.median(ms):.1f} мс, p95 {percentile(ms, 0.95):.1f} мс, "
+        f"p99 {percentile(ms, 0.99):.1f} мс, max {ms[-1]:.1f} мс"
+    )
+    # Запросы всех пользователей делятся на всех дошедших до конца, а не только
+    # на completed: получившие отказ после Q1–Q6 тоже прошли опрос целиком
+    per_survey = r["queries"] / r["finished"] if r["finished"] else float("nan")
+    print(
+        f"Запросов к БД: {r['queries']} ({per_survey:.1f} на пройденный опрос, "
+        f"{r['queries'] / r['users']:.1f} на пользователя, "
+        f"максимум на обновление {query_budget.max_queries}, сверх бюджета {query_budget.over_budget})"
+    )
+    print("Вызовы API: " + ", ".join(f"{name} {count}" for name, count in r["calls"].most_common()))
+    
+    print(f"\n{'обработчик':<32}{'вызовов':>9}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'запр. БД':>10}")
+    report = latency_tracker.report((60,))
+    for name, windows in sorted(report.items(), key=lambda item: -item[1][60].count):
+        s = windows[60]
+        print(f"{name:<32}{s.count:>9}{_ms(s.p50):>10}{_ms(s.p95):>10}{_ms(s.p99):>10}{s.queries:>10.1f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000, help="виртуальных респондентов")
+    parser.add_argument("--concurrency", type=int, default=500, help="одновременно проходящих опрос")
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза перед нажатием, с")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--rate-limit", action="store_true", help="включить ограничитель исходящих запросов")
+    args = parser.parse_args()
+    
+    # Лог каждого обновления от aiogram только мешает
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    
+    result = await LoadTest(args.users, args.concurrency, args.think, args.seed, args.rate_limit).run()
+    print_report(result)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,12 +1,28 @@
 """Главный файл бота"""
+import argparse
 import asyncio
 import logging
+import os
+import signal
+from multiprocessing.connection import Connection
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import TelegramMethod
 
-from utils.config import BOT_TOKEN
-from models import init_db
+from utils.config import (
+    BOT_TOKEN, FSM_DB_PATH, SESSION_TTL_HOURS, WORKERS, WORKER_BACKLOG,
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_MAX_CONCURRENT
+)
+from models import init_db, get_session
+from services.analytics import SurveyAnalytics
+from services.answer_writer import answer_writer
+from services.markup_debouncer import markup_debouncer
+from services.fsm_storage import SQLiteStorage
+from services.session_reaper import session_reaper
+from services.supervisor import Supervisor, consume, poll_updates, set_current_worker
+from services.webhook import run_webhook, serve, create_forwarding_app
 from handlers import common_router, survey_router, admin_router
+from handlers.admin import is_broadcast_update
+from middlewares import send_limiter, latency_tracker, api_timer, query_budget
 
 # Настройка логирования
 logging.basicConfig(
@@ -16,33 +32,181 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def main():
-    """Главная функция запуска бота"""
-    # Инициализация БД
+async def prepare_database():
+    """Создание таблиц, миграции и агрегаты — один раз до старта обработки"""
     logger.info("Инициализация базы данных...")
     await init_db()
     
-    # Создание бота и диспетчера
+    # Заполнение агрегатов статистики при первом запуске
+    async for session in get_session():
+        if await SurveyAnalytics(session).ensure_aggregates():
+            await session.commit()
+            logger.info("Агрегаты статистики пересчитаны")
+
+
+def create_bot() -> Bot:
     bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
+    # Время запросов к Telegram (с ожиданием лимитов) — в метрики /perf
+    bot.session.middleware(api_timer)
+    # Исходящие запросы — в пределах лимитов Telegram (общий и на чат)
+    bot.session.middleware(send_limiter)
+    return bot
+
+
+def create_dispatcher(storage: SQLiteStorage = None) -> Dispatcher:
     dp = Dispatcher(storage=storage)
     
+    # Запросы к БД на обновление: бюджет и поиск N+1
+    dp.update.outer_middleware(query_budget)
+    # Задержки обработчиков всех роутеров — для /perf
+    dp.message.middleware(latency_tracker)
+    dp.callback_query.middleware(latency_tracker)
+    
     # Регистрация роутеров
     dp.include_router(common_router)
     dp.include_router(survey_router)
     dp.include_router(admin_router)
+    return dp
+
+
+async def start_services(storage: SQLiteStorage):
+    # Фоновая запись ответов пачками
+    await answer_writer.start()
+    
+    # Уборка брошенных на середине опросов
+    session_reaper.ttl = SESSION_TTL_HOURS * 3600
+    await session_reaper.start(storage)
+
+
+async def stop_services(bot: Bot, storage: SQLiteStorage):
+    await session_reaper.stop()
+    # Дописываем очередь ответов до закрытия
+    await answer_writer.stop()
+    await markup_debouncer.close()
+    await storage.close()
+    await bot.session.close()
+
+
+async def main(args: argparse.Namespace):
+    """Главная функция запуска бота"""
+    if args.workers > 1:
+        await supervise(args)
+        return
+    
+    await prepare_database()
+    
+    # Создание бота и диспетчера
+    bot = create_bot()
+    # Состояние опроса переживает перезапуск, в памяти — только активные пользователи
+    storage = SQLiteStorage(FSM_DB_PATH)
+    dp = create_dispatcher(storage)
+    await start_services(storage)
     
     logger.info("Бот запущен и готов к работе!")
     
     try:
-        # Запуск поллинга
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if args.mode == "webhook":
+            await run_webhook(
+                dp, bot,
+                host=args.host,
+                port=args.port,
+                path=args.path,
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET or None,
+                max_concurrent=WEBHOOK_MAX_CONCURRENT
+            )
+        else:
+            # Запуск поллинга
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        await stop_services(bot, storage)
+
+
+async def supervise(args: argparse.Namespace):
+    """
+    Режим нескольких процессов
+    
+    Этот процесс только получает обновления (поллингом или вебхуком) и
+    раздаёт их обработчикам по user_id; модели aiogram, хендлеры и БД —
+    в обработчиках.
+    """
+    await prepare_database()
+    
+    # Обработчики пишут в одну базу: транзакции сразу берут блокировку записи
+    os.environ["DB_BEGIN_IMMEDIATE"] = "1"
+    supervisor = Supervisor(run_worker, args.workers, max_backlog=WORKER_BACKLOG, broadcast=is_broadcast_update)
+    supervisor.start()
+    
+    bot = Bot(token=BOT_TOKEN)
+    allowed_updates = create_dispatcher().resolve_used_update_types()
+    logger.info("Супервизор запущен, обработчиков: %d", args.workers)
+    
+    try:
+        if args.mode == "webhook":
+            await serve(
+                create_forwarding_app(args.path, supervisor.dispatch, WEBHOOK_SECRET or None),
+                bot,
+                host=args.host,
+                port=args.port,
+                path=args.path,
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=allowed_updates,
+                max_connections=100
+            )
+        else:
+            await bot.delete_webhook()
+            await poll_updates(BOT_TOKEN, supervisor.dispatch, allowed_updates)
+    finally:
+        await supervisor.stop()
         await bot.session.close()
 
 
+async def worker_main(index: int, count: int, updates: Connection):
+    """Процесс-обработчик: свои подключения к БД, своя часть пользователей"""
+    set_current_worker(index, count)
+    bot = create_bot()
+    send_limiter.share(count)
+    storage = SQLiteStorage(FSM_DB_PATH, shard=(index, count))
+    dp = create_dispatcher(storage)
+    await start_services(storage)
+    
+    async def feed(update):
+        result = await dp.feed_raw_update(bot, update)
+        if isinstance(result, TelegramMethod):
+            await dp.silent_call_request(bot, result)
+    
+    logger.info("Обработчик %d из %d готов", index, count)
+    try:
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+        await consume(updates, feed, WEBHOOK_MAX_CONCURRENT)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await stop_services(bot, storage)
+
+
+def run_worker(index: int, count: int, updates: Connection):
+    """Точка входа процесса-обработчика"""
+    # Остановку обработчику передаёт супервизор, Ctrl+C его не прерывает
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(worker_main(index, count, updates))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бот-опросник")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling",
+                        help="получение обновлений: поллинг или вебхук")
+    parser.add_argument("--host", default=WEBHOOK_HOST, help="адрес сервера вебхука")
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT, help="порт сервера вебхука")
+    parser.add_argument("--path", default=WEBHOOK_PATH, help="путь вебхука")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="число процессов-обработчиков; больше 1 — режим супервизора")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        asyncio.run(main(parse_args()))
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
@@ -2,21 +2,57 @@
 import os
 import csv
 from datetime import datetime
+from functools import wraps
 from aiogram import Router, F
 from aiogram.types import Message, FSInputFile, BufferedInputFile
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from sqlalchemy import update
 
-from models import get_session, Respondent
-from services.analytics import SurveyAnalytics
+from models import get_session, get_reader_session, Respondent
+from services.analytics import SurveyAnalytics, EXPORT_FIELDS
+from services.answer_matrix import (
+    QUESTION_SLICES, get_answer_matrix, is_answer_matrix_cached, warm_answer_matrix, reset_answer_matrices
+)
+from services.answer_cache import answer_cache
+from services.session_reaper import session_reaper
+from services.profiler import loop_profiler
+from services import supervisor
+from keyboards.cache import keyboard_cache
+from middlewares import latency_tracker, query_budget, send_limiter
 from utils.config import ADMIN_IDS
+from utils.recommendations import split_message
 
 router = Router()
 
+# Команды над состоянием процесса (кэши, метрики, уборка): в режиме
+# нескольких обработчиков супервизор отдаёт их всем, каждый отвечает за себя
+BROADCAST_COMMANDS = frozenset({"rebuild_stats", "cache_stats", "reap", "perf"})
+
+
+def is_broadcast_update(update: dict) -> bool:
+    """Админ-команда из BROADCAST_COMMANDS (для Supervisor(broadcast=...))"""
+    message = update.get("message")
+    if not isinstance(message, dict) or message.get("from", {}).get("id") not in ADMIN_IDS:
+        return False
+    text = message.get("text") or ""
+    if not text.startswith("/"):
+        return False
+    command = text.split(maxsplit=1)[0][1:].split("@")[0]
+    return command.lower() in BROADCAST_COMMANDS
+
+
+def _worker_title() -> str:
+    """Пометка обработчика для ответов на команды из BROADCAST_COMMANDS"""
+    if supervisor.current_worker is None:
+        return ""
+    index, count = supervisor.current_worker
+    return f" · обработчик {index + 1} из {count}"
+
 
 def admin_only(func):
     """Декоратор для проверки прав администратора"""
+    @wraps(func)
     async def wrapper(message: Message, **kwargs):
         if message.from_user.id not in ADMIN_IDS:
             await message.answer("⛔️ Эта команда доступна только администраторам.")
@@ -29,8 +65,8 @@ def admin_only(func):
 @admin_only
 async def cmd_stats(message: Message):
     """Команда /stats - статистика"""
-    async for session in get_session():
-        analytics = SurveyAnalytics(session)
+    async for session in get_reader_session():
+        analytics = SurveyAnalytics(session, use_aggregates=True)
         stats_text = await analytics.generate_stats_text()
         await message.answer(stats_text, parse_mode="Markdown")
 
@@ -41,8 +77,8 @@ async def cmd_detailed_stats(message: Message):
     """Команда /detailed_stats - детальная статистика по всем вопросам"""
     await message.answer("⏳ Генерирую детальную статистику...")
     
-    async for session in get_session():
-        analytics = SurveyAnalytics(session)
+    async for session in get_reader_session():
+        analytics = SurveyAnalytics(session, use_aggregates=True)
         detailed_stats = await analytics.generate_detailed_stats()
         
         # Отправляем статистику (может быть длинной, разбиваем если нужно)
@@ -55,50 +91,218 @@ async def cmd_detailed_stats(message: Message):
             await message.answer(detailed_stats, parse_mode="Markdown")
 
 
-@router.message(Command("export"))
+@router.message(Command("crosstab"))
 @admin_only
-async def cmd_export(message: Message):
-    """Команда /export - экспорт в CSV"""
-    await message.answer("⏳ Подготавливаю экспорт...")
+async def cmd_crosstab(message: Message):
+    """Команда /crosstab Q1 Q2 [wave_id] - кросс-таблица двух вопросов"""
+    args = message.text.split()[1:]
+    if len(args) < 2:
+        await message.answer("Использование: /crosstab Q1 Q2 [wave_id]")
+        return
     
-    async for session in get_session():
+    question1, question2 = args[0].upper(), args[1].upper()
+    wave_id = args[2] if len(args) > 2 else None
+    
+    if question1 not in QUESTION_SLICES or question2 not in QUESTION_SLICES:
+        await message.answer("Неизвестный код вопроса.")
+        return
+    
+    async for session in get_reader_session():
         analytics = SurveyAnalytics(session)
-        data = await analytics.export_to_csv_data()
+        if is_answer_matrix_cached(wave_id):
+            matrix = await get_answer_matrix(session, wave_id)
+            cross_tab = matrix.cross_tab(question1, question2)
+        else:
+            # Холодная матрица строится дольше SQL: ответить запросом, матрицу — в фоне
+            cross_tab = await analytics.get_cross_tab(question1, question2, wave_id)
+            warm_answer_matrix(wave_id)
         
-        if not data:
-            await message.answer("Нет данных для экспорта.")
+        if not cross_tab:
+            await message.answer("Нет данных для кросс-таблицы.")
             return
         
-        # Создаём директорию exports если её нет
-        os.makedirs("exports", exist_ok=True)
+        text = f"📊 Кросс-таблица {question1} × {question2}\n\n"
+        for (opt1, opt2), count in sorted(cross_tab.items(), key=lambda x: x[1], reverse=True):
+            label1 = analytics._get_option_label(opt1)
+            label2 = analytics._get_option_label(opt2)
+            text += f"  • {label1} × {label2}: {count}\n"
         
-        # Формируем имя файла
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"exports/responses_{timestamp}.csv"
-        
-        # Формируем заголовки для CSV
-        # Начальные вопросы Q1-Q6
-        fieldnames = ["user_id", "wave_id", "completed_at"]
-        fieldnames += [f"Q{i}" for i in range(1, 7)]
-        # Языковые вопросы LQ1-LQ10
-        fieldnames += [f"LQ{i}" for i in range(1, 11)]
+        parts = [text[i:i+4096] for i in range(0, len(text), 4096)]
+        for part in parts:
+            await message.answer(part)
+
+
+@router.message(Command("export"))
+@admin_only
+async def cmd_export(message: Message):
+    """Команда /export - экспорт в CSV"""
+    await message.answer("⏳ Подготавливаю экспорт...")
+    
+    # Создаём директорию exports если её нет
+    os.makedirs("exports", exist_ok=True)
+    
+    # Формируем имя файла
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"exports/responses_{timestamp}.csv"
+    
+    async for session in get_reader_session():
+        analytics = SurveyAnalytics(session)
         
-        # Записываем CSV
+        # Пишем CSV построчно, по мере чтения из БД
+        count = 0
         with open(filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer = csv.DictWriter(csvfile, fieldnames=EXPORT_FIELDS)
             writer.writeheader()
-            writer.writerows(data)
+            async for row in analytics.iter_export_rows():
+                writer.writerow(row)
+                count += 1
+        
+        if not count:
+            os.remove(filename)
+            await message.answer("Нет данных для экспорта.")
+            return
         
         # Отправляем файл
         document = FSInputFile(filename)
         await message.answer_document(
             document=document,
-            caption=f"📊 Экспорт данных ({len(data)} респондентов)\n"
+            caption=f"📊 Экспорт данных ({count} респондентов)\n"
                    f"Начальные вопросы: Q1-Q6\n"
                    f"Языковые вопросы: LQ1-LQ10"
         )
 
 
+@router.message(Command("rebuild_stats"))
+@admin_only
+async def cmd_rebuild_stats(message: Message):
+    """Команда /rebuild_stats - пересчитать агрегаты статистики по ответам"""
+    if not supervisor.owns_user(message.from_user.id):
+        # Агрегаты в БД пересчитывает обработчик администратора, остальные
+        # только сбрасывают свои матрицы ответов
+        reset_answer_matrices()
+        return
+    
+    await message.answer("⏳ Пересчитываю агрегаты...")
+    
+    async for session in get_session():
+        analytics = SurveyAnalytics(session)
+        await analytics.rebuild_aggregates()
+        await session.commit()
+        reset_answer_matrices()
+        
+        total = await analytics.get_total_respondents()
+    
+    await message.answer(f"✅ Агрегаты пересчитаны ({total} респондентов)")
+
+
+def _hit_rate(hits: int, misses: int) -> str:
+    total = hits + misses
+    return f"{hits / total * 100:.1f}%" if total else "—"
+
+
+@router.message(Command("cache_stats"))
+@admin_only
+async def cmd_cache_stats(message: Message):
+    """Команда /cache_stats - попадания в кэши хода опроса"""
+    lines = [f"🗃 Кэши{_worker_title()}\n"]
+    for name, cache in (("Клавиатуры", keyboard_cache), ("Ответы", answer_cache)):
+        lines.append(
+            f"{name}: {len(cache)} записей, "
+            f"попаданий {cache.hits}, промахов {cache.misses} "
+            f"({_hit_rate(cache.hits, cache.misses)})"
+        )
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("reap"))
+@admin_only
+async def cmd_reap(message: Message):
+    """Команда /reap - убрать брошенные сессии сейчас"""
+    report = await session_reaper.run_once()
+    total = session_reaper.total
+    await message.answer(
+        f"🧹 Уборка брошенных сессий (TTL {session_reaper.ttl / 3600:.0f} ч){_worker_title()}\n\n"
+        f"FSM-записей: {report.fsm_records} ({report.fsm_bytes / 1024:.1f} КиБ)\n"
+        f"Ответов выгружено из кэша: {report.cached_answers}\n"
+        f"Респондентов помечено брошенными: {report.respondents}\n\n"
+        f"Всего с запуска: {total.fsm_records} FSM-записей "
+        f"({total.fsm_bytes / 1024:.1f} КиБ), {total.respondents} респондентов"
+    )
+
+
+def _ms(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "∞"
+    return f"{seconds * 1000:.0f}"
+
+
+@router.message(Command("perf"))
+@admin_only
+async def cmd_perf(message: Message):
+    """Команда /perf - задержки обработчиков за 1, 5 и 60 минут"""
+    report = latency_tracker.report((1, 5, 60))
+    lines = [f"⏱ Задержки обработчиков, мс (p50 / p95 / p99){_worker_title()}"]
+    
+    by_load = sorted(report.items(), key=lambda item: item[1][60].count, reverse=True)
+    for name, windows in by_load:
+        lines.append(f"\n{name}")
+        for minutes, stats in windows.items():
+            if not stats.count:
+                lines.append(f"  {minutes:>2} мин: —")
+                continue
+            lines.append(
+                f"  {minutes:>2} мин: {_ms(stats.p50)} / {_ms(stats.p95)} / {_ms(stats.p99)}"
+                f" · {stats.count} ({stats.count / minutes:.1f}/мин), ошибок {stats.errors}"
+                f" · БД {_ms(stats.db)} ({stats.queries:.1f} запр.), API {_ms(stats.api)}"
+            )
+    if not report:
+        lines.append("\nЗа последний час обработчики не вызывались")
+    
+    lines.append(
+        f"\n🗄 Запросов к БД на обновление: максимум {query_budget.max_queries}, "
+        f"сверх бюджета ({query_budget.budget}) — {query_budget.over_budget} из {query_budget.updates}"
+    )
+    
+    limiter = send_limiter.stats()
+    lines.append(
+        f"\n📤 Исходящие: {limiter['requests']} запросов, ждали {limiter['delayed']} "
+        f"(в среднем {_ms(limiter['avg_wait'])} мс, максимум {_ms(limiter['max_wait'])} мс), "
+        f"в очереди {limiter['waiting']}, повторов {limiter['retries']}"
+    )
+    
+    for part in split_message("\n".join(lines)):
+        await message.answer(part)
+
+
+@router.message(Command("profile"), flags={"latency": False})
+@admin_only
+async def cmd_profile(message: Message):
+    """Команда /profile [секунды] - профиль цикла событий за окно"""
+    args = message.text.split()[1:]
+    try:
+        seconds = float(args[0]) if args else 10.0
+    except ValueError:
+        seconds = 0.0
+    if not 1 <= seconds <= loop_profiler.max_seconds:
+        await message.answer(f"Использование: /profile [секунды], от 1 до {loop_profiler.max_seconds:.0f}")
+        return
+    
+    if loop_profiler.running:
+        await message.answer("⏳ Профилирование уже идёт, дождитесь результата.")
+        return
+    
+    async def send_profile(summary: str):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        await message.answer_document(
+            document=BufferedInputFile(summary.encode("utf-8"), filename=f"profile_{timestamp}.txt"),
+            caption=f"🔬 Профиль за {seconds:g} с (pstats, топ-{loop_profiler.limit})"
+        )
+    
+    # Окно идёт в фоне: обработчик не держит обновление до конца профиля
+    loop_profiler.start(seconds, send_profile)
+    await message.answer(f"🔬 Профилирую {seconds:g} с, пришлю файл по готовности.")
+
+
 @router.message(Command("reset_wave"))
 @admin_only
 async def cmd_reset_wave(message: Message):
@@ -123,7 +327,13 @@ async def cmd_admin_help(message: Message):
 
 📊 `/stats` — краткая статистика по опросу
 📈 `/detailed_stats` — детальная статистика по всем вопросам
+🔀 `/crosstab Q1 Q2 [wave_id]` — кросс-таблица двух вопросов
 💾 `/export` — экспорт данных в CSV
+♻️ `/rebuild_stats` — пересчитать агрегаты статистики
+🗃 `/cache_stats` — попадания в кэши клавиатур и ответов
+🧹 `/reap` — убрать брошенные сессии сейчас
+⏱ `/perf` — задержки обработчиков за 1, 5 и 60 минут
+🔬 `/profile [секунды]` — профиль бота за окно (pstats файлом)
 🔄 `/reset_wave` — начать новую волну опроса
 
 Структура опроса:
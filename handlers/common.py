@@ -14,12 +14,51 @@ from keyboards import (
     get_restart_keyboard,
     get_back_to_menu_keyboard
 )
+from services.analytics import SurveyAnalytics
+from services.answer_cache import answer_cache
+from services.answer_writer import answer_writer
 from utils.i18n import get_text
 from utils.config import ADMIN_IDS
 
 router = Router()
 
 
+async def restore_session(user_id: int, state: FSMContext):
+    """
+    Восстановить данные FSM по респонденту из БД
+    
+    FSM-запись брошенного опроса удаляется уборщиком сессий
+    (services.session_reaper), а респондент остаётся. Вернувшийся
+    пользователь продолжает с того же респондента, отметка abandoned
+    снимается. Возвращает респондента или None.
+    """
+    async for session in get_session():
+        result = await session.execute(
+            select(Respondent).where(
+                and_(
+                    Respondent.user_id == user_id,
+                    Respondent.archived == False,
+                    Respondent.consented == True
+                )
+            )
+        )
+        respondent = result.scalar_one_or_none()
+        
+        if respondent and respondent.abandoned:
+            respondent.abandoned = False
+            await session.commit()
+    
+    if not respondent:
+        return None
+    
+    await state.update_data(
+        respondent_id=respondent.id,
+        lang=respondent.language_code or "ru",
+        consented=True
+    )
+    return respondent
+
+
 @router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
     """Команда /start"""
@@ -65,13 +104,18 @@ async def consent_yes(callback: CallbackQuery, state: FSMContext):
             )
             session.add(respondent)
             await session.commit()
-            await session.refresh(respondent)
+            # У нового респондента ответов нет — кэш можно заполнить сразу
+            answer_cache.put(respondent.id, {})
         else:
+            # Вернувшийся после уборки брошенных сессий продолжает опрос
             respondent.language_code = lang
             respondent.consented = True
+            respondent.abandoned = False
             await session.commit()
-        
-        await state.update_data(respondent_id=respondent.id)
+    
+    # id выставлен при flush, а expire_on_commit выключен — refresh не нужен,
+    # и подключение писателя не держится лишний круг
+    await state.update_data(respondent_id=respondent.id)
     
     # Переходим сразу к главному меню
     await callback.message.edit_text(
@@ -155,8 +199,15 @@ async def cmd_status(message: Message, state: FSMContext):
     respondent_id = user_data.get("respondent_id")
     
     if not respondent_id:
-        await message.answer("Начните с команды /start")
-        return
+        # Сессию могли убрать как брошенную — респондент остался в БД
+        respondent = await restore_session(message.from_user.id, state)
+        if not respondent:
+            await message.answer("Начните с команды /start")
+            return
+        respondent_id = respondent.id
+        lang = respondent.language_code or lang
+    
+    await answer_writer.wait_for(respondent_id)
     
     async for session in get_session():
         result = await session.execute(
@@ -165,23 +216,24 @@ async def cmd_status(message: Message, state: FSMContext):
         answers = result.scalars().all()
         
         # Подсчитываем ответы на начальные и языковые вопросы
-        from utils.questions import INITIAL_QUESTIONS, LINGUISTIC_QUESTIONS
-        total = len(INITIAL_QUESTIONS)
+        from utils.questions import QUESTIONNAIRE
+        initial_total = QUESTIONNAIRE.stage_totals["initial"]
+        total = initial_total
         
         # Проверяем, перешли ли к языковому опросу
-        initial_answers = {a.question_code: a.answer for a in answers if a.question_code.startswith('Q')}
-        if len(initial_answers) >= len(INITIAL_QUESTIONS):
-            total += len(LINGUISTIC_QUESTIONS)
+        initial_answers = {a.question_code: a.answer for a in answers if QUESTIONNAIRE.stage.get(a.question_code) == "initial"}
+        if len(initial_answers) >= initial_total:
+            total += QUESTIONNAIRE.stage_totals["linguistic"]
         
         answered = len(set(a.question_code for a in answers))
         remaining = total - answered
-        
-        await message.answer(
-            get_text(lang, "status_info", 
-                    answered=answered, 
-                    total=total, 
-                    remaining=remaining)
-        )
+    
+    await message.answer(
+        get_text(lang, "status_info", 
+                answered=answered, 
+                total=total, 
+                remaining=remaining)
+    )
 
 
 @router.message(Command("restart"))
@@ -204,7 +256,10 @@ async def restart_confirm(callback: CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
     lang = user_data.get("lang", "ru")
     
-    # Архивируем старую сессию
+    # Архивируем старую сессию (после записи её ответов из очереди)
+    if user_data.get("respondent_id"):
+        await answer_writer.wait_for(user_data["respondent_id"])
+    
     async for session in get_session():
         result = await session.execute(
             select(Respondent).where(
@@ -218,6 +273,10 @@ async def restart_confirm(callback: CallbackQuery, state: FSMContext):
         
         if old_respondent:
             old_respondent.archived = True
+            answer_cache.evict(old_respondent.id)
+            if old_respondent.completed:
+                # Архивный респондент больше не учитывается в статистике
+                await SurveyAnalytics(session).record_completion(old_respondent.id, delta=-1)
             await session.commit()
         
         # Создаем новую сессию
@@ -230,6 +289,7 @@ async def restart_confirm(callback: CallbackQuery, state: FSMContext):
         session.add(new_respondent)
         await session.commit()
         await session.refresh(new_respondent)
+        answer_cache.put(new_respondent.id, {})
         
         await state.clear()
         await state.update_data(
@@ -263,8 +323,15 @@ async def cmd_status(message: Message, state: FSMContext):
     respondent_id = user_data.get("respondent_id")
     
     if not respondent_id:
-        await message.answer("Начните опрос командой /start")
-        return
+        # Сессию могли убрать как брошенную — респондент остался в БД
+        respondent = await restore_session(message.from_user.id, state)
+        if not respondent:
+            await message.answer("Начните опрос командой /start")
+            return
+        respondent_id = respondent.id
+        lang = respondent.language_code or lang
+    
+    await answer_writer.wait_for(respondent_id)
     
     async for session in get_session():
         result = await session.execute(
@@ -275,13 +342,13 @@ async def cmd_status(message: Message, state: FSMContext):
         total = 16
         answered = len(set(a.question_code for a in answers))
         remaining = total - answered
-        
-        await message.answer(
-            get_text(lang, "status_info", 
-                    answered=answered, 
-                    total=total, 
-                    remaining=remaining)
-        )
+    
+    await message.answer(
+        get_text(lang, "status_info", 
+                answered=answered, 
+                total=total, 
+                remaining=remaining)
+    )
 
 
 @router.message(Command("restart"))
@@ -304,7 +371,10 @@ async def restart_confirm(callback: CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
     lang = user_data.get("lang", "ru")
     
-    # Архивируем старую сессию
+    # Архивируем старую сессию (после записи её ответов из очереди)
+    if user_data.get("respondent_id"):
+        await answer_writer.wait_for(user_data["respondent_id"])
+    
     async for session in get_session():
         result = await session.execute(
             select(Respondent).where(
@@ -318,6 +388,10 @@ async def restart_confirm(callback: CallbackQuery, state: FSMContext):
         
         if old_respondent:
             old_respondent.archived = True
+            answer_cache.evict(old_respondent.id)
+            if old_respondent.completed:
+                # Архивный респондент больше не учитывается в статистике
+                await SurveyAnalytics(session).record_completion(old_respondent.id, delta=-1)
             await session.commit()
         
         # Создаем новую сессию
@@ -330,6 +404,7 @@ async def restart_confirm(callback: CallbackQuery, state: FSMContext):
         session.add(new_respondent)
         await session.commit()
         await session.refresh(new_respondent)
+        answer_cache.put(new_respondent.id, {})
         
         await state.clear()
         await state.update_data(
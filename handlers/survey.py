@@ -4,64 +4,55 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import select, and_, update
-from datetime import datetime
+from sqlalchemy import select
 
-from models import get_session, Respondent, Answer
+from models import get_reader_session, Answer
 from keyboards import get_question_keyboard, get_navigation_keyboard, get_back_to_menu_keyboard
 from utils.i18n import get_text
+from utils.callbacks import SurveyCallback, SurveyCallbackFilter, ANSWER, TOGGLE, DONE, BACK, SKIP
 from utils.questions import (
-    INITIAL_QUESTIONS,
-    LINGUISTIC_QUESTIONS,
-    QUESTIONS, 
-    get_question_by_code, 
+    QUESTIONNAIRE,
     get_next_question, 
     get_previous_question,
-    get_question_number,
     is_linguistic_bullying,
     determine_aggression_type
 )
-from utils.recommendations import get_recommendation_by_type, get_rejection_message
+from utils.recommendations import get_recommendation_messages, get_rejection_message
+from services.answer_cache import answer_cache
+from services.answer_writer import answer_writer
+from services.markup_debouncer import markup_debouncer
 from .states import SurveyFSM
 
 router = Router()
 
 
 async def save_answer(respondent_id: int, question_code: str, answer_value: str):
-    """Сохранить ответ в БД"""
-    async for session in get_session():
-        # Проверяем, есть ли уже ответ
-        result = await session.execute(
-            select(Answer).where(
-                and_(
-                    Answer.respondent_id == respondent_id,
-                    Answer.question_code == question_code
-                )
-            )
-        )
-        existing = result.scalar_one_or_none()
-        
-        if existing:
-            existing.answer = answer_value
-        else:
-            answer = Answer(
-                respondent_id=respondent_id,
-                question_code=question_code,
-                answer=answer_value
-            )
-            session.add(answer)
-        
-        await session.commit()
+    """Сохранить ответ: в кэш сразу, в БД — фоновым писателем (см. services.answer_writer)"""
+    await answer_writer.save_answer(respondent_id, question_code, answer_value)
+    
+    # Write-through: кэш остаётся актуальным без перечитывания из БД
+    answer_cache.set_answer(respondent_id, question_code, answer_value)
 
 
 async def get_answers_dict(respondent_id: int) -> dict:
-    """Получить все ответы респондента в виде словаря"""
-    async for session in get_session():
+    """Получить все ответы респондента в виде словаря (из кэша, при промахе — из БД)"""
+    answers = answer_cache.get(respondent_id)
+    if answers is not None:
+        return answers
+    
+    # Читаем только после записи всех ответов респондента из очереди.
+    # Закоммиченное видно читателям (WAL), а единственное подключение
+    # писателя занято очередью upsert'ов — читаем через пул читателей
+    await answer_writer.wait_for(respondent_id)
+    
+    async for session in get_reader_session():
         result = await session.execute(
-            select(Answer).where(Answer.respondent_id == respondent_id)
+            select(Answer.question_code, Answer.answer).where(Answer.respondent_id == respondent_id)
         )
-        answers = result.scalars().all()
-        return {a.question_code: a.answer for a in answers}
+        answers = dict(result.all())
+    
+    answer_cache.put(respondent_id, answers)
+    return answers
 
 
 async def show_question(message: Message, question_code: str, state: FSMContext, edit: bool = False):
@@ -70,22 +61,13 @@ async def show_question(message: Message, question_code: str, state: FSMContext,
     lang = user_data.get("lang", "ru")
     respondent_id = user_data.get("respondent_id")
     
-    question = get_question_by_code(question_code)
+    question = QUESTIONNAIRE.question(question_code)
     if not question:
         await message.answer("Ошибка: вопрос не найден")
         return
     
-    # Определяем этап опроса
-    if question_code.startswith('Q'):
-        # Начальный опрос
-        questions_list = INITIAL_QUESTIONS
-        question_num = next((i + 1 for i, q in enumerate(questions_list) if q["code"] == question_code), 0)
-        total = len(questions_list)
-    else:
-        # Языковой опрос
-        questions_list = LINGUISTIC_QUESTIONS
-        question_num = next((i + 1 for i, q in enumerate(questions_list) if q["code"] == question_code), 0)
-        total = len(questions_list)
+    # Номер вопроса внутри этапа опроса (начальный или языковой)
+    question_num, total = QUESTIONNAIRE.progress(question_code)
     
     # Формируем текст с прогрессом
     progress_text = f"📊 {get_text(lang, 'progress', current=question_num, total=total)}\n\n"
@@ -135,6 +117,38 @@ async def show_question(message: Message, question_code: str, state: FSMContext,
         await message.answer(full_text, reply_markup=keyboard)
 
 
+async def show_next_question(message: Message, question_code: str, state: FSMContext, lang: str, edit: bool = False):
+    """Показать следующий вопрос этапа, а после последнего — завершить этап"""
+    next_q = QUESTIONNAIRE.next_in_stage.get(question_code)
+    if next_q:
+        await show_question(message, next_q, state, edit=edit)
+        return
+    
+    if QUESTIONNAIRE.stage.get(question_code) == "initial":
+        await finish_initial_stage(message, state, lang)
+    else:
+        # Завершили все вопросы - показываем рекомендации
+        await finish_survey(message, state)
+
+
+async def finish_initial_stage(message: Message, state: FSMContext, lang: str):
+    """Начальные вопросы пройдены: языковой этап или сообщение об отказе"""
+    user_data = await state.get_data()
+    answers = await get_answers_dict(user_data.get("respondent_id"))
+    
+    if is_linguistic_bullying(answers):
+        # Языковой буллинг - продолжаем уточняющими вопросами
+        await message.answer(get_text(lang, "linguistic_bullying_detected"))
+        await show_question(message, "LQ1", state)
+    else:
+        # Не языковой буллинг - показываем сообщение об отказе
+        await message.answer(
+            get_rejection_message(),
+            reply_markup=get_back_to_menu_keyboard(lang)
+        )
+        await state.set_state(SurveyFSM.showing_recommendations)
+
+
 @router.callback_query(F.data == "start_survey")
 async def start_survey(callback: CallbackQuery, state: FSMContext):
     """Начать опрос"""
@@ -165,22 +179,19 @@ async def cmd_survey(message: Message, state: FSMContext):
 
 
 # Обработка одиночного выбора
-@router.callback_query(F.data.startswith("answer_"))
-async def handle_single_answer(callback: CallbackQuery, state: FSMContext):
+async def handle_single_answer(callback: CallbackQuery, state: FSMContext, survey_callback: SurveyCallback):
     """Обработка одиночного выбора"""
     await callback.answer()
     
-    parts = callback.data.split("_")
-    question_code = parts[1]  # Q1, Q2, etc.
-    option_code = "_".join(parts[2:])  # Q1_OP1, etc.
+    question_code = survey_callback.question_code  # Q1, Q2, etc.
+    option_code = survey_callback.option_code  # Q1_OP1, etc.
     
     user_data = await state.get_data()
     respondent_id = user_data.get("respondent_id")
     lang = user_data.get("lang", "ru")
     
     # Проверяем, нужен ли дополнительный ввод
-    question = get_question_by_code(question_code)
-    option = next((o for o in question.get("options", []) if o["code"] == option_code), None)
+    option = QUESTIONNAIRE.option(question_code, option_code)
     
     if option and option.get("has_input"):
         # Запрашиваем дополнительный ввод
@@ -196,46 +207,17 @@ async def handle_single_answer(callback: CallbackQuery, state: FSMContext):
     # Сохраняем ответ
     await save_answer(respondent_id, question_code, option_code)
     
-    # Определяем следующий вопрос в зависимости от текущего этапа
-    answers = await get_answers_dict(respondent_id)
-    
-    if question_code.startswith('Q'):
-        # В начальных вопросах
-        current_idx = next((i for i, q in enumerate(INITIAL_QUESTIONS) if q["code"] == question_code), -1)
-        if current_idx < len(INITIAL_QUESTIONS) - 1:
-            next_q = INITIAL_QUESTIONS[current_idx + 1]["code"]
-            await show_question(callback.message, next_q, state, edit=True)
-        else:
-            # Завершили начальные вопросы
-            if is_linguistic_bullying(answers):
-                await callback.message.answer(get_text(lang, "linguistic_bullying_detected"))
-                await show_question(callback.message, "LQ1", state)
-            else:
-                await callback.message.answer(
-                    get_rejection_message(),
-                    reply_markup=get_back_to_menu_keyboard(lang)
-                )
-                await state.set_state(SurveyFSM.showing_recommendations)
-    else:
-        # В языковых вопросах
-        current_idx = next((i for i, q in enumerate(LINGUISTIC_QUESTIONS) if q["code"] == question_code), -1)
-        if current_idx < len(LINGUISTIC_QUESTIONS) - 1:
-            next_q = LINGUISTIC_QUESTIONS[current_idx + 1]["code"]
-            await show_question(callback.message, next_q, state, edit=True)
-        else:
-            # Завершили все вопросы
-            await finish_survey(callback.message, state)
+    # Следующий вопрос этапа или переход к следующему этапу
+    await show_next_question(callback.message, question_code, state, lang, edit=True)
 
 
 # Обработка множественного выбора (тогглы)
-@router.callback_query(F.data.startswith("toggle_"))
-async def handle_multi_toggle(callback: CallbackQuery, state: FSMContext):
+async def handle_multi_toggle(callback: CallbackQuery, state: FSMContext, survey_callback: SurveyCallback):
     """Обработка тоггла в мультивыборе"""
     await callback.answer()
     
-    parts = callback.data.split("_")
-    question_code = parts[1]
-    option_code = "_".join(parts[2:])
+    question_code = survey_callback.question_code
+    option_code = survey_callback.option_code
     
     user_data = await state.get_data()
     selected = user_data.get("selected_options", [])
@@ -249,7 +231,7 @@ async def handle_multi_toggle(callback: CallbackQuery, state: FSMContext):
     await state.update_data(selected_options=selected)
     
     # Обновляем клавиатуру
-    question = get_question_by_code(question_code)
+    question = QUESTIONNAIRE.question(question_code)
     lang = user_data.get("lang", "ru")
     
     keyboard = get_question_keyboard(
@@ -260,16 +242,22 @@ async def handle_multi_toggle(callback: CallbackQuery, state: FSMContext):
         lang=lang
     )
     
-    await callback.message.edit_reply_markup(reply_markup=keyboard)
+    # Выбор уже записан в FSM; в сообщение уйдёт только итог серии кликов
+    message = callback.message
+    markup_debouncer.schedule(
+        (message.chat.id, message.message_id),
+        keyboard,
+        lambda markup: message.edit_reply_markup(reply_markup=markup),
+        shown=message.reply_markup
+    )
 
 
 # Завершение мультивыбора
-@router.callback_query(F.data.startswith("multi_done_"))
-async def handle_multi_done(callback: CallbackQuery, state: FSMContext):
+async def handle_multi_done(callback: CallbackQuery, state: FSMContext, survey_callback: SurveyCallback):
     """Завершение мультивыбора"""
     await callback.answer()
     
-    question_code = callback.data.replace("multi_done_", "")
+    question_code = survey_callback.question_code
     
     user_data = await state.get_data()
     respondent_id = user_data.get("respondent_id")
@@ -277,9 +265,8 @@ async def handle_multi_done(callback: CallbackQuery, state: FSMContext):
     selected = user_data.get("selected_options", [])
     
     # Проверяем, есть ли опции с дополнительным вводом
-    question = get_question_by_code(question_code)
     for option_code in selected:
-        option = next((o for o in question.get("options", []) if o["code"] == option_code), None)
+        option = QUESTIONNAIRE.option(question_code, option_code)
         if option and option.get("has_input"):
             # Запрашиваем ввод для этой опции
             await state.set_state(SurveyFSM.waiting_input)
@@ -295,54 +282,12 @@ async def handle_multi_done(callback: CallbackQuery, state: FSMContext):
     # Сохраняем мультиответ
     await save_answer(respondent_id, question_code, json.dumps(selected))
     
-    # Проверяем, завершили ли мы начальные вопросы
     if question_code == "Q2":
-        # Это был последний вопрос из начальных
-        answers = await get_answers_dict(respondent_id)
-        
-        # Анализируем, является ли это языковым буллингом
-        if is_linguistic_bullying(answers):
-            # Языковой буллинг - продолжаем уточняющими вопросами
-            await callback.message.answer(get_text(lang, "linguistic_bullying_detected"))
-            await show_question(callback.message, "LQ1", state)
-        else:
-            # Не языковой буллинг - показываем сообщение об отказе
-            await callback.message.answer(
-                get_rejection_message(),
-                reply_markup=get_back_to_menu_keyboard(lang)
-            )
-            await state.set_state(SurveyFSM.showing_recommendations)
+        # Тип буллинга определяется по Q1 и Q2: после «Готово» на Q2
+        # опрос сразу переходит к проверке на языковой буллинг
+        await finish_initial_stage(callback.message, state, lang)
     else:
-        # Продолжаем опрос
-        answers = await get_answers_dict(respondent_id)
-        
-        # Определяем следующий вопрос
-        if question_code.startswith('Q'):
-            # В начальных вопросах
-            current_idx = next((i for i, q in enumerate(INITIAL_QUESTIONS) if q["code"] == question_code), -1)
-            if current_idx < len(INITIAL_QUESTIONS) - 1:
-                next_q = INITIAL_QUESTIONS[current_idx + 1]["code"]
-                await show_question(callback.message, next_q, state)
-            else:
-                # Завершили начальные вопросы, проверяем тип буллинга
-                if is_linguistic_bullying(answers):
-                    await callback.message.answer(get_text(lang, "linguistic_bullying_detected"))
-                    await show_question(callback.message, "LQ1", state)
-                else:
-                    await callback.message.answer(
-                        get_rejection_message(),
-                        reply_markup=get_back_to_menu_keyboard(lang)
-                    )
-                    await state.set_state(SurveyFSM.showing_recommendations)
-        else:
-            # В языковых вопросах
-            current_idx = next((i for i, q in enumerate(LINGUISTIC_QUESTIONS) if q["code"] == question_code), -1)
-            if current_idx < len(LINGUISTIC_QUESTIONS) - 1:
-                next_q = LINGUISTIC_QUESTIONS[current_idx + 1]["code"]
-                await show_question(callback.message, next_q, state)
-            else:
-                # Завершили все вопросы - показываем рекомендации
-                await finish_survey(callback.message, state)
+        await show_next_question(callback.message, question_code, state, lang)
 
 
 # Обработка текстового ввода
@@ -358,64 +303,12 @@ async def handle_text_input(message: Message, state: FSMContext):
     if input_type == "open":
         # Открытый вопрос (пока не используется в новой логике)
         await save_answer(respondent_id, question_code, message.text)
-        
-        answers = await get_answers_dict(respondent_id)
-        
-        # Определяем следующий вопрос
-        if question_code.startswith('Q'):
-            current_idx = next((i for i, q in enumerate(INITIAL_QUESTIONS) if q["code"] == question_code), -1)
-            if current_idx < len(INITIAL_QUESTIONS) - 1:
-                next_q = INITIAL_QUESTIONS[current_idx + 1]["code"]
-                await show_question(message, next_q, state)
-            else:
-                if is_linguistic_bullying(answers):
-                    await message.answer(get_text(lang, "linguistic_bullying_detected"))
-                    await show_question(message, "LQ1", state)
-                else:
-                    await message.answer(
-                        get_rejection_message(),
-                        reply_markup=get_back_to_menu_keyboard(lang)
-                    )
-                    await state.set_state(SurveyFSM.showing_recommendations)
-        else:
-            current_idx = next((i for i, q in enumerate(LINGUISTIC_QUESTIONS) if q["code"] == question_code), -1)
-            if current_idx < len(LINGUISTIC_QUESTIONS) - 1:
-                next_q = LINGUISTIC_QUESTIONS[current_idx + 1]["code"]
-                await show_question(message, next_q, state)
-            else:
-                await finish_survey(message, state)
     
     elif input_type == "option":
         # Дополнительный ввод для одиночного выбора
         option_code = user_data.get("pending_answer")
         combined = f"{option_code}:{message.text}"
         await save_answer(respondent_id, question_code, combined)
-        
-        answers = await get_answers_dict(respondent_id)
-        
-        # Определяем следующий вопрос
-        if question_code.startswith('Q'):
-            current_idx = next((i for i, q in enumerate(INITIAL_QUESTIONS) if q["code"] == question_code), -1)
-            if current_idx < len(INITIAL_QUESTIONS) - 1:
-                next_q = INITIAL_QUESTIONS[current_idx + 1]["code"]
-                await show_question(message, next_q, state)
-            else:
-                if is_linguistic_bullying(answers):
-                    await message.answer(get_text(lang, "linguistic_bullying_detected"))
-                    await show_question(message, "LQ1", state)
-                else:
-                    await message.answer(
-                        get_rejection_message(),
-                        reply_markup=get_back_to_menu_keyboard(lang)
-                    )
-                    await state.set_state(SurveyFSM.showing_recommendations)
-        else:
-            current_idx = next((i for i, q in enumerate(LINGUISTIC_QUESTIONS) if q["code"] == question_code), -1)
-            if current_idx < len(LINGUISTIC_QUESTIONS) - 1:
-                next_q = LINGUISTIC_QUESTIONS[current_idx + 1]["code"]
-                await show_question(message, next_q, state)
-            else:
-                await finish_survey(message, state)
     
     elif input_type == "multi_option":
         # Дополнительный ввод для мультивыбора
@@ -426,37 +319,16 @@ async def handle_text_input(message: Message, state: FSMContext):
         selected = [f"{opt}:{message.text}" if opt == option_code else opt for opt in selected]
         
         await save_answer(respondent_id, question_code, json.dumps(selected))
-        
-        answers = await get_answers_dict(respondent_id)
-        
-        # Определяем следующий вопрос
-        if question_code.startswith('Q'):
-            current_idx = next((i for i, q in enumerate(INITIAL_QUESTIONS) if q["code"] == question_code), -1)
-            if current_idx < len(INITIAL_QUESTIONS) - 1:
-                next_q = INITIAL_QUESTIONS[current_idx + 1]["code"]
-                await show_question(message, next_q, state)
-            else:
-                if is_linguistic_bullying(answers):
-                    await message.answer(get_text(lang, "linguistic_bullying_detected"))
-                    await show_question(message, "LQ1", state)
-                else:
-                    await message.answer(
-                        get_rejection_message(),
-                        reply_markup=get_back_to_menu_keyboard(lang)
-                    )
-                    await state.set_state(SurveyFSM.showing_recommendations)
-        else:
-            current_idx = next((i for i, q in enumerate(LINGUISTIC_QUESTIONS) if q["code"] == question_code), -1)
-            if current_idx < len(LINGUISTIC_QUESTIONS) - 1:
-                next_q = LINGUISTIC_QUESTIONS[current_idx + 1]["code"]
-                await show_question(message, next_q, state)
-            else:
-                await finish_survey(message, state)
+    
+    else:
+        return
+    
+    # Определяем следующий вопрос
+    await show_next_question(message, question_code, state, lang)
 
 
 # Навигация назад
-@router.callback_query(F.data.startswith("nav_back_"))
-async def handle_back(callback: CallbackQuery, state: FSMContext):
+async def handle_back(callback: CallbackQuery, state: FSMContext, survey_callback: SurveyCallback):
     """Возврат к предыдущему вопросу"""
     await callback.answer()
     
@@ -469,8 +341,7 @@ async def handle_back(callback: CallbackQuery, state: FSMContext):
 
 
 # Пропуск вопроса
-@router.callback_query(F.data.startswith("nav_skip_"))
-async def handle_skip(callback: CallbackQuery, state: FSMContext):
+async def handle_skip(callback: CallbackQuery, state: FSMContext, survey_callback: SurveyCallback):
     """Пропустить вопрос"""
     await callback.answer()
     
@@ -487,6 +358,26 @@ async def handle_skip(callback: CallbackQuery, state: FSMContext):
         await finish_survey(callback.message, state)
 
 
+CALLBACK_HANDLERS = {
+    ANSWER: handle_single_answer,
+    TOGGLE: handle_multi_toggle,
+    DONE: handle_multi_done,
+    BACK: handle_back,
+    SKIP: handle_skip,
+}
+
+
+# Все кнопки опроса: разбор callback_data и выбор хендлера — по таблицам
+@router.callback_query(SurveyCallbackFilter())
+async def handle_survey_callback(callback: CallbackQuery, state: FSMContext, survey_callback: SurveyCallback):
+    """Передать callback опроса хендлеру его действия"""
+    if survey_callback.action != TOGGLE and callback.message:
+        # Ответ, «Готово», назад и пропуск правят это же сообщение —
+        # отложенная правка тогглов не должна прийти после них
+        await markup_debouncer.cancel((callback.message.chat.id, callback.message.message_id))
+    await CALLBACK_HANDLERS[survey_callback.action](callback, state, survey_callback)
+
+
 async def finish_survey(message: Message, state: FSMContext):
     """Завершение опроса и показ рекомендаций"""
     user_data = await state.get_data()
@@ -496,59 +387,31 @@ async def finish_survey(message: Message, state: FSMContext):
     # Получаем все ответы
     answers = await get_answers_dict(respondent_id)
     
-    # Помечаем опрос как завершённый
-    async for session in get_session():
-        await session.execute(
-            update(Respondent)
-            .where(Respondent.id == respondent_id)
-            .values(completed=True, completed_at=datetime.utcnow())
-        )
-        await session.commit()
+    # Помечаем опрос как завершённый (в той же транзакции обновляются агрегаты)
+    await answer_writer.complete_respondent(respondent_id)
+    
+    # Ответы завершённого опроса больше не понадобятся в ходе опроса
+    answer_cache.evict(respondent_id)
     
     await message.answer(get_text(lang, "survey_completed"))
     
     # Определяем тип агрессии
     aggression_type = determine_aggression_type(answers)
     
-    # Получаем рекомендации
-    recommendations = get_recommendation_by_type('linguistic', aggression_type)
+    # Рекомендации собраны и разбиты на сообщения заранее
+    # (Telegram имеет ограничение в 4096 символов на сообщение)
+    parts = get_recommendation_messages(aggression_type, lang)
     
-    if recommendations:
-        # Отправляем рекомендации (может быть длинным, разбиваем если нужно)
-        rec_text = get_text(lang, "recommendations_title") + recommendations
-        
-        # Telegram имеет ограничение в 4096 символов на сообщение
-        max_length = 4000
-        if len(rec_text) <= max_length:
+    for i, part in enumerate(parts):
+        if i == len(parts) - 1:
+            # Последняя часть с кнопкой
             await message.answer(
-                rec_text,
+                part,
                 reply_markup=get_back_to_menu_keyboard(lang),
                 parse_mode=None  # Отключаем парсинг, так как там могут быть спецсимволы
             )
         else:
-            # Разбиваем на части
-            parts = []
-            current_part = ""
-            for line in rec_text.split('\n'):
-                if len(current_part) + len(line) + 1 < max_length:
-                    current_part += line + '\n'
-                else:
-                    parts.append(current_part)
-                    current_part = line + '\n'
-            if current_part:
-                parts.append(current_part)
-            
-            # Отправляем части
-            for i, part in enumerate(parts):
-                if i == len(parts) - 1:
-                    # Последняя часть с кнопкой
-                    await message.answer(
-                        part,
-                        reply_markup=get_back_to_menu_keyboard(lang),
-                        parse_mode=None
-                    )
-                else:
-                    await message.answer(part, parse_mode=None)
+            await message.answer(part, parse_mode=None)
     
     await state.set_state(SurveyFSM.showing_recommendations)
     await state.clear()
@@ -0,0 +1,58 @@
+"""Кэш готовых клавиатур"""
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Hashable
+
+from aiogram.types import InlineKeyboardMarkup
+
+
+class KeyboardCache:
+    """
+    LRU-кэш собранных InlineKeyboardMarkup
+    
+    Клавиатура зависит только от ключа (код вопроса, выбранные опции,
+    язык), поэтому повторные клики по тем же тогглам отдают готовый
+    объект вместо сборки pydantic-моделей заново. Возвращаемые
+    клавиатуры общие — изменять их нельзя.
+    """
+    
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, InlineKeyboardMarkup]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get_or_build(self, key: Hashable, build: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+        """Клавиатура из кэша или собранная build() и положенная в кэш"""
+        keyboard = self._entries.get(key)
+        if keyboard is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return keyboard
+        
+        self.misses += 1
+        keyboard = build()
+        self._entries[key] = keyboard
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return keyboard
+    
+    def clear(self):
+        """Очистить кэш и счётчики"""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+keyboard_cache = KeyboardCache()
+
+
+def cached_keyboard(func: Callable[..., InlineKeyboardMarkup]):
+    """Кэшировать статическую клавиатуру, зависящую только от языка"""
+    @wraps(func)
+    def wrapper(lang: str = "ru") -> InlineKeyboardMarkup:
+        return keyboard_cache.get_or_build((func.__name__, lang), lambda: func(lang))
+    return wrapper
@@ -1,8 +1,10 @@
 """Общие клавиатуры"""
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from utils.i18n import get_text
+from .cache import cached_keyboard
 
 
+@cached_keyboard
 def get_consent_keyboard(lang: str = "ru") -> InlineKeyboardMarkup:
     """Клавиатура согласия на участие"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -17,6 +19,7 @@ def get_consent_keyboard(lang: str = "ru") -> InlineKeyboardMarkup:
     ])
 
 
+@cached_keyboard
 def get_main_menu_keyboard(lang: str = "ru") -> InlineKeyboardMarkup:
     """Главное меню"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -31,6 +34,7 @@ def get_main_menu_keyboard(lang: str = "ru") -> InlineKeyboardMarkup:
     ])
 
 
+@cached_keyboard
 def get_start_survey_keyboard(lang: str = "ru") -> InlineKeyboardMarkup:
     """Клавиатура начала опроса"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -41,6 +45,7 @@ def get_start_survey_keyboard(lang: str = "ru") -> InlineKeyboardMarkup:
     ])
 
 
+@cached_keyboard
 def get_back_to_menu_keyboard(lang: str = "ru") -> InlineKeyboardMarkup:
     """Кнопка возврата в главное меню"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -51,6 +56,7 @@ def get_back_to_menu_keyboard(lang: str = "ru") -> InlineKeyboardMarkup:
     ])
 
 
+@cached_keyboard
 def get_restart_keyboard(lang: str = "ru") -> InlineKeyboardMarkup:
     """Клавиатура подтверждения перезапуска"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -2,6 +2,8 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from typing import List, Dict
 from utils.i18n import get_text
+from utils.callbacks import answer_data, toggle_data, done_data, BACK, SKIP
+from .cache import keyboard_cache
 
 
 def get_question_keyboard(
@@ -17,8 +19,25 @@ def get_question_keyboard(
     options: список опций [{"code": "Q1_OP1", "text": "12-13"}, ...]
     multi_select: множественный выбор (с тогглами)
     selected: уже выбранные опции (для мультивыбора)
+    
+    Клавиатура берётся из кэша по (question_code, multi_select,
+    выбранные опции, lang): опции определяются кодом вопроса.
     """
-    selected = selected or []
+    key = ("question", question_code, multi_select, frozenset(selected or ()), lang)
+    return keyboard_cache.get_or_build(
+        key,
+        lambda: _build_question_keyboard(options, question_code, multi_select, selected or [], lang)
+    )
+
+
+def _build_question_keyboard(
+    options: List[Dict[str, str]],
+    question_code: str,
+    multi_select: bool,
+    selected: List[str],
+    lang: str
+) -> InlineKeyboardMarkup:
+    """Собрать клавиатуру вопроса"""
     buttons = []
     
     for option in options:
@@ -28,10 +47,10 @@ def get_question_keyboard(
         if multi_select:
             # Для мультивыбора добавляем галочку
             prefix = "✅ " if code in selected else ""
-            callback_data = f"toggle_{question_code}_{code}"
+            callback_data = toggle_data(code)
         else:
             prefix = ""
-            callback_data = f"answer_{question_code}_{code}"
+            callback_data = answer_data(code)
         
         buttons.append([InlineKeyboardButton(
             text=f"{prefix}{text}",
@@ -42,7 +61,7 @@ def get_question_keyboard(
     if multi_select and selected:
         buttons.append([InlineKeyboardButton(
             text=get_text(lang, "btn_next"),
-            callback_data=f"multi_done_{question_code}"
+            callback_data=done_data(question_code)
         )])
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -61,13 +80,13 @@ def get_navigation_keyboard(
     if current_question > 1:
         row.append(InlineKeyboardButton(
             text=get_text(lang, "btn_back"),
-            callback_data=f"nav_back_{current_question}"
+            callback_data=BACK
         ))
     
     if can_skip:
         row.append(InlineKeyboardButton(
             text=get_text(lang, "btn_skip"),
-            callback_data=f"nav_skip_{current_question}"
+            callback_data=SKIP
         ))
     
     if row:
@@ -0,0 +1,21 @@
+from .rate_limit import RateLimitMiddleware, TokenBucket, send_limiter
+from .latency import (
+    LatencyMiddleware, ApiTimer, Timings, WindowStats,
+    current_timings, latency_tracker, api_timer
+)
+from .query_budget import QueryBudgetMiddleware, query_budget
+
+__all__ = [
+    "RateLimitMiddleware",
+    "TokenBucket",
+    "send_limiter",
+    "LatencyMiddleware",
+    "ApiTimer",
+    "Timings",
+    "WindowStats",
+    "current_timings",
+    "latency_tracker",
+    "api_timer",
+    "QueryBudgetMiddleware",
+    "query_budget",
+]
@@ -0,0 +1,226 @@
+"""Задержки обработчиков: гистограммы в кольцевых буферах"""
+import time
+from array import array
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.dispatcher.flags import get_flag
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+
+from models.database import QueryLog, current_query_log
+from utils.callbacks import ACTION_NAMES
+
+# Верхние границы корзин гистограммы: от 1 мс с шагом ×1.25 до ~36 с,
+# последняя корзина — всё, что дольше
+BUCKET_BOUNDS: List[float] = [0.001 * 1.25 ** i for i in range(48)] + [float("inf")]
+
+# Кольцо из 360 интервалов по 10 секунд — последний час
+SLOT_SECONDS = 10
+SLOTS = 360
+
+
+class Timings:
+    """Время, потраченное текущим обработчиком на Telegram API"""
+    __slots__ = ("api",)
+    
+    def __init__(self):
+        self.api = 0.0
+
+
+current_timings: ContextVar[Optional[Timings]] = ContextVar("current_timings", default=None)
+
+
+class WindowStats(NamedTuple):
+    """Сводка обработчика за окно; время в секундах, db, queries и api — в среднем на вызов"""
+    count: int
+    errors: int
+    p50: float
+    p95: float
+    p99: float
+    db: float
+    queries: float
+    api: float
+
+
+class _Slot:
+    __slots__ = ("number", "buckets", "count", "errors", "db", "queries", "api")
+    
+    def __init__(self, number: int):
+        self.number = number
+        self.buckets = array("I", bytes(4 * len(BUCKET_BOUNDS)))
+        self.count = 0
+        self.errors = 0
+        self.db = 0.0
+        self.queries = 0
+        self.api = 0.0
+
+
+def _bucket(seconds: float) -> int:
+    # Двоичный поиск по границам: корзин немного, но вызов на каждое обновление
+    low, high = 0, len(BUCKET_BOUNDS) - 1
+    while low < high:
+        middle = (low + high) // 2
+        if seconds <= BUCKET_BOUNDS[middle]:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+class HandlerStats:
+    """
+    Задержки одного обработчика за последний час
+    
+    Память фиксирована: SLOTS интервалов по SLOT_SECONDS секунд, в каждом
+    гистограмма из len(BUCKET_BOUNDS) счётчиков. Интервал, в который
+    пришёл новый час, перезаписывается.
+    """
+    
+    def __init__(self):
+        self._ring: List[Optional[_Slot]] = [None] * SLOTS
+    
+    def record(self, now: float, latency: float, db: float, queries: int, api: float, error: bool):
+        number = int(now // SLOT_SECONDS)
+        slot = self._ring[number % SLOTS]
+        if slot is None or slot.number != number:
+            slot = self._ring[number % SLOTS] = _Slot(number)
+        slot.buckets[_bucket(latency)] += 1
+        slot.count += 1
+        slot.errors += error
+        slot.db += db
+        slot.queries += queries
+        slot.api += api
+    
+    def window(self, now: float, minutes: int) -> WindowStats:
+        """Сводка за последние minutes минут (включая текущий интервал)"""
+        current = int(now // SLOT_SECONDS)
+        oldest = current - minutes * 60 // SLOT_SECONDS
+        buckets = [0] * len(BUCKET_BOUNDS)
+        count = errors = queries = 0
+        db = api = 0.0
+        for slot in self._ring:
+            if slot is None or not oldest < slot.number <= current:
+                continue
+            for i, value in enumerate(slot.buckets):
+                buckets[i] += value
+            count += slot.count
+            errors += slot.errors
+            db += slot.db
+            queries += slot.queries
+            api += slot.api
+        
+        if not count:
+            return WindowStats(0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        p50, p95, p99 = (_percentile(buckets, count, q) for q in (0.5, 0.95, 0.99))
+        return WindowStats(count, errors, p50, p95, p99, db / count, queries / count, api / count)
+
+
+def _percentile(buckets: Sequence[int], count: int, q: float) -> float:
+    """Верхняя граница корзины, в которую попадает q-квантиль"""
+    rank = q * count
+    seen = 0
+    for i, value in enumerate(buckets):
+        seen += value
+        if seen >= rank:
+            return BUCKET_BOUNDS[i]
+    return BUCKET_BOUNDS[-1]
+
+
+def handler_name(data: Dict[str, Any]) -> str:
+    """
+    Имя обработчика для метрик
+    
+    Все кнопки опроса идут через одну точку входа; её вызовы делятся по
+    действию: handle_survey_callback:toggle, ...:back и т. д.
+    """
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    name = getattr(callback, "__name__", "unknown")
+    survey_callback = data.get("survey_callback")
+    if survey_callback is not None:
+        name = f"{name}:{ACTION_NAMES.get(survey_callback.action, survey_callback.action)}"
+    return name
+
+
+class LatencyMiddleware(BaseMiddleware):
+    """
+    Задержка, число вызовов и ошибки каждого обработчика
+    
+    Регистрируется на событиях диспетчера (message, callback_query) и
+    потому видит, какой обработчик выбран фильтрами. На время вызова
+    выставляет current_timings, куда ApiTimer добавляет время запросов к
+    Telegram. Запросы к БД берутся из QueryLog обновления (его ведёт
+    QueryBudgetMiddleware): обработчику достаётся прирост за время вызова.
+    
+    Обработчики с флагом latency=False (служебные вроде /profile) не
+    учитываются.
+    """
+    
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.handlers: Dict[str, HandlerStats] = {}
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not get_flag(data, "latency", default=True):
+            return await handler(event, data)
+        
+        timings = Timings()
+        token = current_timings.set(timings)
+        log = current_query_log.get()
+        log_token = None
+        if log is None:
+            log = QueryLog()
+            log_token = current_query_log.set(log)
+        queries, db = log.count, log.time
+        error = False
+        start = self._clock()
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            end = self._clock()
+            current_timings.reset(token)
+            if log_token is not None:
+                current_query_log.reset(log_token)
+            name = handler_name(data)
+            stats = self.handlers.get(name)
+            if stats is None:
+                stats = self.handlers[name] = HandlerStats()
+            stats.record(end, end - start, log.time - db, log.count - queries, timings.api, error)
+    
+    def report(self, windows: Sequence[int] = (1, 5, 60)) -> Dict[str, Dict[int, WindowStats]]:
+        """Сводки по обработчикам, вызывавшимся за самое длинное окно"""
+        now = self._clock()
+        report = {}
+        for name, stats in self.handlers.items():
+            summary = {minutes: stats.window(now, minutes) for minutes in windows}
+            if summary[max(windows)].count:
+                report[name] = summary
+        return report
+
+
+class ApiTimer(BaseRequestMiddleware):
+    """Время запросов к Telegram API, включая ожидание в ограничителе частоты"""
+    
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            timings = current_timings.get()
+            if timings is not None:
+                timings.api += time.perf_counter() - start
+
+
+latency_tracker = LatencyMiddleware()
+api_timer = ApiTimer()
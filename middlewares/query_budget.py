@@ -0,0 +1,61 @@
+"""Счётчик запросов к БД на обновление и поиск N+1"""
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from models.database import DB_QUERY_BUDGET, QueryLog, current_query_log
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetMiddleware(BaseMiddleware):
+    """
+    Внешний middleware обновления: считает его запросы к БД
+    
+    На время обработки выставляет current_query_log, куда хуки движков
+    из models.database пишут каждый запрос. Если запросов больше budget,
+    в лог пишутся отпечатки запросов с числом выполнений — повторяющийся
+    в цикле запрос (N+1) виден сразу.
+    """
+    
+    def __init__(self, budget: int = DB_QUERY_BUDGET, top: int = 10):
+        self.budget = budget
+        self.top = top
+        self.updates = 0
+        self.over_budget = 0
+        self.max_queries = 0
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        log = QueryLog()
+        token = current_query_log.set(log)
+        try:
+            return await handler(event, data)
+        finally:
+            current_query_log.reset(token)
+            self.updates += 1
+            self.max_queries = max(self.max_queries, log.count)
+            if log.count > self.budget:
+                self.over_budget += 1
+                self._report(event, log)
+    
+    def _report(self, event: TelegramObject, log: QueryLog):
+        kind = event.event_type if isinstance(event, Update) else type(event).__name__
+        lines = [
+            f"  {count:>4} × {duration * 1000:7.1f} мс  {statement}"
+            for statement, count, duration in log.fingerprints()[:self.top]
+        ]
+        logger.warning(
+            "Обновление %s (%s): %d запросов к БД за %.1f мс при бюджете %d\n%s",
+            getattr(event, "update_id", "?"), kind, log.count, log.time * 1000, self.budget,
+            "\n".join(lines)
+        )
+
+
+query_budget = QueryBudgetMiddleware()
@@ -0,0 +1,160 @@
+"""Ограничение частоты исходящих запросов к Telegram"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Токен-бакет в форме виртуального расписания (GCRA)
+    
+    Вместо счётчика токенов хранится tat — время, к которому бакет
+    снова станет полным. Запрос может пройти в момент
+    tat - (capacity - 1) / rate и сдвигает tat на 1 / rate.
+    """
+    
+    def __init__(self, rate: float, capacity: int = 1):
+        self.interval = 1 / rate
+        self.tolerance = (capacity - 1) * self.interval
+        self.tat = 0.0
+    
+    def earliest(self, now: float) -> float:
+        """Ближайший момент, когда бакет пропустит запрос"""
+        return max(now, self.tat - self.tolerance)
+    
+    def consume(self, at: float):
+        """Занять токен на момент at (не раньше earliest)"""
+        self.tat = max(self.tat, at) + self.interval
+    
+    def block_until(self, moment: float):
+        """Не пропускать запросы до moment (после RetryAfter)"""
+        self.tat = max(self.tat, moment + self.tolerance)
+    
+    def is_idle(self, now: float) -> bool:
+        return self.tat <= now
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Мидлварь сессии Bot: общий и per-chat лимиты на запросы в чаты
+    
+    Ограничиваются методы с chat_id (отправка и правка сообщений):
+    ~30 в секунду на бота и ~1 в секунду на чат (с небольшим запасом
+    на всплеск). Запрос ждёт своей очереди, а не получает RetryAfter;
+    если Telegram всё же вернул RetryAfter, чат блокируется на
+    указанное время и запрос повторяется до max_retries раз.
+    
+    Метрики: waiting — сколько запросов сейчас ждут (глубина очереди),
+    delayed/total_wait/max_wait — сколько запросов ждали и сколько.
+    """
+    
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: int = 3,
+        max_retries: int = 3,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep
+    ):
+        self.global_rate = global_rate
+        self.global_bucket = TokenBucket(global_rate, capacity=int(global_rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._clock = clock
+        self._sleep = sleep
+        self._chats: Dict[Hashable, TokenBucket] = {}
+        
+        self.requests = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.retries = 0
+    
+    def _chat_bucket(self, chat_id: Hashable, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Полные бакеты ничего не помнят — их можно выбросить
+            if len(self._chats) >= 10000:
+                self._chats = {key: b for key, b in self._chats.items() if not b.is_idle(now)}
+            bucket = TokenBucket(self.chat_rate, capacity=self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+    
+    def reserve(self, chat_id: Hashable) -> float:
+        """Занять место в расписании обоих бакетов; вернуть, сколько ждать"""
+        now = self._clock()
+        chat_bucket = self._chat_bucket(chat_id, now)
+        
+        at = self.global_bucket.earliest(chat_bucket.earliest(now))
+        chat_bucket.consume(at)
+        self.global_bucket.consume(at)
+        return at - now
+    
+    async def _wait(self, delay: float):
+        if delay <= 0:
+            return
+        
+        self.delayed += 1
+        self.total_wait += delay
+        self.max_wait = max(self.max_wait, delay)
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._sleep(delay)
+        finally:
+            self.waiting -= 1
+    
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        chat_id: Optional[Hashable] = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        
+        self.requests += 1
+        attempt = 0
+        while True:
+            await self._wait(self.reserve(chat_id))
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                logger.warning("RetryAfter %ss для чата %s, повтор %d", e.retry_after, chat_id, attempt)
+                self._chat_bucket(chat_id, self._clock()).block_until(self._clock() + e.retry_after)
+    
+    def share(self, parts: int):
+        """
+        Оставить этому процессу 1/parts общего лимита бота
+        
+        Лимиты на чат не делятся: чат обслуживается одним процессом.
+        """
+        rate = self.global_rate / parts
+        self.global_bucket = TokenBucket(rate, capacity=max(1, int(rate)))
+    
+    def stats(self) -> Dict[str, float]:
+        """Снимок метрик"""
+        return {
+            "requests": self.requests,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "delayed": self.delayed,
+            "avg_wait": self.total_wait / self.delayed if self.delayed else 0.0,
+            "max_wait": self.max_wait,
+            "retries": self.retries,
+        }
+
+
+send_limiter = RateLimitMiddleware()
@@ -1,5 +1,8 @@
-from .database import init_db, get_session
+from .database import init_db, get_session, get_reader_session
 from .respondent import Respondent
-from .answer import Answer
+from .answer import Answer, upsert_answer
+from .answer_option import AnswerOption
+from .answer_count import AnswerCount
+from .wave_total import WaveTotal
 
-__all__ = ["init_db", "get_session", "Respondent", "Answer"]
+__all__ = ["init_db", "get_session", "get_reader_session", "Respondent", "Answer", "upsert_answer", "AnswerOption", "AnswerCount", "WaveTotal"]
@@ -1,8 +1,11 @@
 """Модель ответа на вопрос"""
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, event, delete, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import relationship, attributes
 from datetime import datetime
 from .database import Base
+from .answer_option import AnswerOption, build_option_rows
 
 
 class Answer(Base):
@@ -13,13 +16,62 @@ class Answer(Base):
     question_code = Column(String(10), nullable=False)  # Q1, Q2, etc.
     answer = Column(Text, nullable=False)  # JSON для мультивыбора, текст для остальных
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Последняя правка ответа; по нему ищутся брошенные сессии
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Связь с респондентом
     respondent = relationship("Respondent", back_populates="answers")
     
     __table_args__ = (
-        Index("idx_respondent_question", "respondent_id", "question_code"),
+        Index("idx_respondent_question", "respondent_id", "question_code", unique=True),
     )
     
     def __repr__(self):
         return f"<Answer(id={self.id}, question={self.question_code})>"
+
+
+@event.listens_for(Answer, "after_insert")
+@event.listens_for(Answer, "after_update")
+def sync_answer_options(mapper, connection, target):
+    """Пересобрать answer_options при записи ответа через ORM"""
+    if not attributes.get_history(target, "answer").has_changes():
+        return
+    
+    connection.execute(delete(AnswerOption).where(AnswerOption.answer_id == target.id))
+    rows = build_option_rows(target.id, target.question_code, target.answer)
+    if rows:
+        connection.execute(insert(AnswerOption), rows)
+
+
+async def upsert_answer(session: AsyncSession, respondent_id: int, question_code: str, value: str) -> int:
+    """
+    Записать ответ одним INSERT ... ON CONFLICT DO UPDATE
+    
+    Уникальный индекс (respondent_id, question_code) не даёт параллельным
+    callback'ам создать дубликаты. Повторный ответ обновляет updated_at,
+    created_at остаётся временем первого ответа. ORM-события при
+    core-вставке не срабатывают, поэтому answer_options пересобираются
+    здесь же, в той же транзакции. Не коммитит.
+    
+    Returns:
+        id ответа
+    """
+    stmt = sqlite_insert(Answer).values(
+        respondent_id=respondent_id,
+        question_code=question_code,
+        answer=value
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Answer.respondent_id, Answer.question_code],
+        set_={"answer": stmt.excluded.answer, "updated_at": stmt.excluded.updated_at}
+    ).returning(Answer.id)
+    
+    result = await session.execute(stmt)
+    answer_id = result.scalar_one()
+    
+    await session.execute(delete(AnswerOption).where(AnswerOption.answer_id == answer_id))
+    rows = build_option_rows(answer_id, question_code, value)
+    if rows:
+        await session.execute(insert(AnswerOption), rows)
+    
+    return answer_id
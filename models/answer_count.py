@@ -0,0 +1,15 @@
+"""Агрегат: количество выборов опции по волнам"""
+from sqlalchemy import Column, Integer, String
+from .database import Base
+
+
+class AnswerCount(Base):
+    __tablename__ = "answer_counts"
+    
+    wave_id = Column(String, primary_key=True)
+    question_code = Column(String(10), primary_key=True)
+    option_code = Column(String, primary_key=True)  # Q1_OP7 или Q1_OP7:текст, как в ответе
+    count = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<AnswerCount(wave={self.wave_id}, option={self.option_code}, count={self.count})>"
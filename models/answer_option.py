@@ -0,0 +1,34 @@
+"""Модель выбранной опции ответа (нормализованный ответ)"""
+from typing import Dict, List
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Index
+from .database import Base
+from utils.questions import parse_answer
+
+
+class AnswerOption(Base):
+    __tablename__ = "answer_options"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    answer_id = Column(Integer, ForeignKey("answers.id", ondelete="CASCADE"), nullable=False)
+    # Копия answers.question_code: кросс-таблица выбирает опции вопроса
+    # по индексу, не заходя в answers за каждой строкой
+    question_code = Column(String(10), nullable=False)
+    option_code = Column(String, nullable=False)  # Q1_OP7
+    input_text = Column(Text, nullable=True)  # пользовательский текст для "Другое"
+    
+    __table_args__ = (
+        Index("idx_answer_option_answer", "answer_id", "option_code"),
+        Index("idx_answer_option_code", "option_code"),
+        Index("idx_answer_option_question", "question_code", "option_code", "answer_id"),
+    )
+    
+    def __repr__(self):
+        return f"<AnswerOption(answer_id={self.answer_id}, option={self.option_code})>"
+
+
+def build_option_rows(answer_id: int, question_code: str, value: str) -> List[Dict]:
+    """Строки answer_options для сохранённого значения ответа"""
+    return [
+        {"answer_id": answer_id, "question_code": question_code, "option_code": code, "input_text": text}
+        for code, text in parse_answer(value)
+    ]
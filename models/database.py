@@ -1,12 +1,181 @@
 """Настройка базы данных SQLAlchemy"""
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+import os
+import re
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.orm import DeclarativeBase
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
 
-DATABASE_URL = "sqlite+aiosqlite:///data.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///data.db")
 
-engine = create_async_engine(DATABASE_URL, echo=False)
+# Профили настроек SQLite, применяются PRAGMA при каждом подключении.
+# "wal": читатели не блокируют писателя и наоборот, fsync только на
+# чекпоинтах; "default" — настройки SQLite по умолчанию (rollback journal).
+SQLITE_PROFILES: Dict[str, Dict[str, object]] = {
+    "default": {},
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # в КиБ: 64 МиБ
+        "temp_store": "MEMORY",
+    },
+}
+
+DB_PROFILE = os.getenv("DB_PROFILE", "wal")
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# Пишущие транзакции сразу берут блокировку записи (несколько процессов)
+DB_BEGIN_IMMEDIATE = os.getenv("DB_BEGIN_IMMEDIATE", "0") == "1"
+# Больше запросов на одно обновление — в лог с отпечатками запросов
+DB_QUERY_BUDGET = int(os.getenv("DB_QUERY_BUDGET", "20"))
+
+
+class QueryLog:
+    """
+    Запросы к БД в рамках одного обновления
+    
+    statements — текст запроса -> [число выполнений, время]. SQLAlchemy
+    передаёт параметры отдельно, так что одинаковые запросы с разными
+    значениями уже совпадают; остальное сводит fingerprint при выводе.
+    """
+    __slots__ = ("count", "time", "statements")
+    
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements: Dict[str, list] = {}
+    
+    def add(self, statement: str, duration: float):
+        self.count += 1
+        self.time += duration
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, duration]
+        else:
+            entry[0] += 1
+            entry[1] += duration
+    
+    def fingerprints(self) -> List[Tuple[str, int, float]]:
+        """Отпечатки запросов с числом выполнений и временем, самые частые первыми"""
+        merged: Dict[str, list] = {}
+        for statement, (count, duration) in self.statements.items():
+            entry = merged.setdefault(fingerprint(statement), [0, 0.0])
+            entry[0] += count
+            entry[1] += duration
+        return sorted(
+            ((key, count, duration) for key, (count, duration) in merged.items()),
+            key=lambda item: (-item[1], -item[2])
+        )
+
+
+current_query_log: ContextVar[Optional[QueryLog]] = ContextVar("current_query_log", default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Запрос без значений: литералы и списки IN (?, ?, ...) заменены"""
+    statement = _SPACES.sub(" ", statement).strip()
+    statement = _LITERALS.sub("?", statement)
+    return _IN_LISTS.sub("(...)", statement)
+
+
+def _set_pragmas(engine: AsyncEngine, pragmas: Dict[str, object]):
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    log = current_query_log.get()
+    if log is not None:
+        log.add(statement, time.perf_counter() - context._query_start)
+
+
+def _track_queries(engine: AsyncEngine):
+    """Записывать запросы движка в QueryLog текущего обновления"""
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _begin_immediate(engine: AsyncEngine):
+    """
+    Открывать транзакции через BEGIN IMMEDIATE
+    
+    Обычная (DEFERRED) транзакция, начавшаяся с чтения, при первой записи
+    поднимает блокировку; если другой процесс успел записать, SQLite сразу
+    возвращает SQLITE_BUSY, не дожидаясь busy_timeout. IMMEDIATE берёт
+    блокировку записи в начале, и конкурирующие писатели ждут друг друга.
+    """
+    @event.listens_for(engine.sync_engine, "connect")
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine.sync_engine, "begin")
+    def begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def create_engines(
+    url: str = DATABASE_URL,
+    profile: str = DB_PROFILE,
+    readers: int = DB_READERS,
+    immediate: bool = DB_BEGIN_IMMEDIATE
+) -> Tuple[AsyncEngine, AsyncEngine]:
+    """
+    Движок для записи и движок для чтения аналитики
+    
+    У писателя одно подключение: SQLite всё равно пропускает одну
+    пишущую транзакцию за раз, а с несколькими подключениями они
+    упираются друг в друга блокировкой файла (SQLITE_BUSY при поднятии
+    DEFERRED-транзакции до записи). С одним подключением сессии ждут
+    своей очереди в пуле. Поэтому внутри сессии писателя не стоит ждать
+    Telegram API.
+    
+    Читающие подключения открываются с query_only: аналитика не может
+    ничего записать и в режиме WAL не мешает записи ответов. Подключения
+    держатся в пуле, а не открываются на каждую сессию: PRAGMA и кэш
+    страниц живут вместе с подключением.
+    
+    immediate включается, когда в базу пишут несколько процессов.
+    """
+    pragmas = SQLITE_PROFILES[profile]
+    
+    if ":memory:" in url:
+        writer_pool = reader_pool = {}
+    else:
+        writer_pool = {"poolclass": AsyncAdaptedQueuePool, "pool_size": 1, "max_overflow": 0, "pool_timeout": 60}
+        reader_pool = {"poolclass": AsyncAdaptedQueuePool, "pool_size": readers, "max_overflow": 0}
+    
+    writer = create_async_engine(url, echo=False, **writer_pool)
+    _set_pragmas(writer, pragmas)
+    _track_queries(writer)
+    if immediate:
+        _begin_immediate(writer)
+    
+    reader = create_async_engine(url, echo=False, **reader_pool)
+    _set_pragmas(reader, {**pragmas, "query_only": "ON"})
+    _track_queries(reader)
+    
+    return writer, reader
+
+
+engine, reader_engine = create_engines()
 async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+reader_session_maker = async_sessionmaker(reader_engine, class_=AsyncSession, expire_on_commit=False)
 
 
 class Base(DeclarativeBase):
@@ -15,11 +184,25 @@ class Base(DeclarativeBase):
 
 async def init_db():
     """Инициализация базы данных"""
+    from .migrations import run_migrations
+    
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+        # Собрать статистику для планировщика (sqlite_stat1). PRAGMA optimize
+        # на свежем подключении анализирует только таблицы, которые оно уже
+        # читало, а без статистики SQLite выбирает для аналитики полные проходы.
+        # На 50k респондентов ANALYZE занимает около 0,4 с.
+        await conn.exec_driver_sql("ANALYZE")
 
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     """Получить сессию БД"""
     async with async_session_maker() as session:
         yield session
+
+
+async def get_reader_session() -> AsyncGenerator[AsyncSession, None]:
+    """Получить сессию только для чтения (аналитика, выгрузки)"""
+    async with reader_session_maker() as session:
+        yield session
@@ -0,0 +1,196 @@
+"""Миграции данных, выполняемые при запуске"""
+from sqlalchemy import select, insert, update, delete, exists, and_, func, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .answer import Answer
+from .answer_count import AnswerCount
+from .answer_option import AnswerOption, build_option_rows
+from .respondent import Respondent
+from .wave_total import WaveTotal
+
+
+async def backfill_answer_options(conn: AsyncConnection, chunk_size: int = 1000) -> int:
+    """
+    Заполнить answer_options для ответов, сохранённых до нормализации
+    
+    Опциям, записанным до появления answer_options.question_code,
+    проставляется код вопроса из их ответа.
+    
+    Returns:
+        количество обработанных ответов
+    """
+    await conn.execute(
+        update(AnswerOption)
+        .where(AnswerOption.question_code.is_(None))
+        .values(
+            question_code=select(Answer.question_code)
+            .where(Answer.id == AnswerOption.answer_id)
+            .scalar_subquery()
+        )
+    )
+    
+    processed = 0
+    last_id = 0
+    
+    while True:
+        result = await conn.execute(
+            select(Answer.id, Answer.question_code, Answer.answer)
+            .where(
+                and_(
+                    Answer.id > last_id,
+                    ~exists().where(AnswerOption.answer_id == Answer.id)
+                )
+            )
+            .order_by(Answer.id)
+            .limit(chunk_size)
+        )
+        answers = result.all()
+        if not answers:
+            break
+        
+        rows = []
+        for answer_id, question_code, value in answers:
+            rows.extend(build_option_rows(answer_id, question_code, value))
+        if rows:
+            await conn.execute(insert(AnswerOption), rows)
+        
+        processed += len(answers)
+        last_id = answers[-1].id
+    
+    return processed
+
+
+async def dedupe_answers(conn: AsyncConnection) -> int:
+    """
+    Сделать индекс idx_respondent_question уникальным
+    
+    Раньше индекс был обычным, и параллельные callback'и могли сохранить
+    несколько ответов на один вопрос. Остаётся последний (max id).
+    
+    Returns:
+        количество удалённых дубликатов
+    """
+    result = await conn.execute(text("PRAGMA index_list('answers')"))
+    indexes = {row.name: row.unique for row in result}
+    if indexes.get("idx_respondent_question"):
+        return 0
+    
+    latest = (
+        select(func.max(Answer.id))
+        .group_by(Answer.respondent_id, Answer.question_code)
+    )
+    result = await conn.execute(delete(Answer).where(Answer.id.not_in(latest)))
+    removed = result.rowcount
+    
+    await conn.execute(
+        delete(AnswerOption).where(AnswerOption.answer_id.not_in(select(Answer.id)))
+    )
+    
+    index = next(i for i in Answer.__table__.indexes if i.name == "idx_respondent_question")
+    await conn.execute(text("DROP INDEX IF EXISTS idx_respondent_question"))
+    await conn.run_sync(index.create)
+    
+    return removed
+
+
+async def add_abandoned_column(conn: AsyncConnection) -> bool:
+    """
+    Добавить respondents.abandoned в базы, созданные до его появления
+    
+    Returns:
+        True, если столбец был добавлен
+    """
+    result = await conn.execute(text("PRAGMA table_info('respondents')"))
+    if any(row.name == "abandoned" for row in result):
+        return False
+    
+    await conn.execute(text("ALTER TABLE respondents ADD COLUMN abandoned BOOLEAN NOT NULL DEFAULT 0"))
+    return True
+
+
+async def add_answer_updated_at_column(conn: AsyncConnection) -> bool:
+    """
+    Добавить answers.updated_at в базы, созданные до его появления
+    
+    Старые ответы получают updated_at = created_at.
+    
+    Returns:
+        True, если столбец был добавлен
+    """
+    result = await conn.execute(text("PRAGMA table_info('answers')"))
+    if any(row.name == "updated_at" for row in result):
+        return False
+    
+    await conn.execute(text("ALTER TABLE answers ADD COLUMN updated_at DATETIME"))
+    await conn.execute(text("UPDATE answers SET updated_at = created_at"))
+    return True
+
+
+async def add_option_question_code_column(conn: AsyncConnection) -> bool:
+    """
+    Добавить answer_options.question_code и его индекс в старые базы
+    
+    Значения заполняет backfill_answer_options.
+    
+    Returns:
+        True, если столбец был добавлен
+    """
+    result = await conn.execute(text("PRAGMA table_info('answer_options')"))
+    if any(row.name == "question_code" for row in result):
+        return False
+    
+    await conn.execute(text("ALTER TABLE answer_options ADD COLUMN question_code VARCHAR(10)"))
+    index = next(i for i in AnswerOption.__table__.indexes if i.name == "idx_answer_option_question")
+    await conn.run_sync(index.create, checkfirst=True)
+    return True
+
+
+async def reset_merged_option_counts(conn: AsyncConnection) -> bool:
+    """
+    Сбросить агрегаты, посчитанные до разделения опций с текстом
+    
+    Раньше answer_counts сливали Q1_OP7:текст в Q1_OP7. Если у
+    учтённого респондента есть опция с текстом без своей строки в
+    answer_counts, агрегаты очищаются, и ensure_aggregates при запуске
+    пересчитывает их заново.
+    
+    Returns:
+        True, если агрегаты были сброшены
+    """
+    counted = select(AnswerCount.option_code).where(
+        and_(
+            AnswerCount.wave_id == Respondent.wave_id,
+            AnswerCount.question_code == AnswerOption.question_code,
+            AnswerCount.option_code == AnswerOption.option_code + ":" + AnswerOption.input_text
+        )
+    )
+    result = await conn.execute(
+        select(AnswerOption.id)
+        .join(Answer, Answer.id == AnswerOption.answer_id)
+        .join(Respondent, Respondent.id == Answer.respondent_id)
+        .where(
+            and_(
+                Respondent.completed == True,
+                Respondent.archived == False,
+                AnswerOption.input_text.is_not(None),
+                ~counted.exists()
+            )
+        )
+        .limit(1)
+    )
+    if result.first() is None:
+        return False
+    
+    await conn.execute(delete(AnswerCount))
+    await conn.execute(delete(WaveTotal))
+    return True
+
+
+async def run_migrations(conn: AsyncConnection):
+    """Выполнить все миграции данных"""
+    await add_abandoned_column(conn)
+    await add_answer_updated_at_column(conn)
+    await add_option_question_code_column(conn)
+    await dedupe_answers(conn)
+    await backfill_answer_options(conn)
+    await reset_merged_option_counts(conn)
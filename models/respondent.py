@@ -15,6 +15,7 @@ class Respondent(Base):
     consented = Column(Boolean, default=False)
     completed = Column(Boolean, default=False)
     archived = Column(Boolean, default=False)  # Для перезапусков
+    abandoned = Column(Boolean, default=False)  # Брошен на середине (см. services.session_reaper)
     wave_id = Column(String, default="wave_1")
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
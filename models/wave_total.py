@@ -0,0 +1,13 @@
+"""Агрегат: количество завершённых опросов по волнам"""
+from sqlalchemy import Column, Integer, String
+from .database import Base
+
+
+class WaveTotal(Base):
+    __tablename__ = "wave_totals"
+    
+    wave_id = Column(String, primary_key=True)
+    respondents = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<WaveTotal(wave={self.wave_id}, respondents={self.respondents})>"
@@ -1,21 +1,54 @@
 """Модуль аналитики опроса"""
-import json
-from collections import Counter, defaultdict
-from typing import Dict, List, Tuple
-from sqlalchemy import select, and_, func
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Tuple
+from sqlalchemy import select, delete, and_, case, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
-from models import Respondent, Answer
+from models import Respondent, Answer, AnswerOption, AnswerCount, WaveTotal
+from utils.questions import QUESTIONS
+
+# Колонки CSV-экспорта: Q1-Q6, затем LQ1-LQ10
+EXPORT_QUESTION_CODES = [q["code"] for q in QUESTIONS]
+EXPORT_FIELDS = ["user_id", "wave_id", "completed_at"] + EXPORT_QUESTION_CODES
+
+
+def _answer_options(name: str):
+    """Алиасы ответа и его выбранных опций (answer_options) для self-join"""
+    return aliased(Answer, name=f"{name}_answer"), aliased(AnswerOption, name=name)
+
+
+def _option_value(option):
+    """Опция в исходном виде ответа: Q1_OP7 или Q1_OP7:текст"""
+    return case(
+        (option.input_text.is_not(None), option.option_code + ":" + option.input_text),
+        else_=option.option_code
+    )
 
 
 class SurveyAnalytics:
     """Класс для аналитики опроса"""
     
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, use_aggregates: bool = False):
+        """
+        use_aggregates: читать распределения и итоги из answer_counts /
+        wave_totals (O(опций)) вместо пересчёта по сырым ответам.
+        Опции с пользовательским текстом считаются отдельно (Q1_OP7:текст),
+        как и в сырых распределениях.
+        """
         self.session = session
+        self.use_aggregates = use_aggregates
     
     async def get_total_respondents(self, wave_id: str = None, completed_only: bool = True) -> int:
         """Получить общее количество респондентов"""
+        if self.use_aggregates and completed_only:
+            query = select(func.sum(WaveTotal.respondents))
+            if wave_id:
+                query = query.where(WaveTotal.wave_id == wave_id)
+            result = await self.session.execute(query)
+            return result.scalar() or 0
+        
         query = select(func.count(Respondent.id)).where(
             Respondent.archived == False
         )
@@ -31,32 +64,186 @@ class SurveyAnalytics:
     
     async def get_question_distribution(self, question_code: str, wave_id: str = None) -> Dict[str, int]:
         """Получить распределение ответов на вопрос"""
-        query = select(Answer.answer).join(Respondent).where(
-            and_(
-                Answer.question_code == question_code,
-                Respondent.completed == True,
-                Respondent.archived == False
+        distributions = await self.get_all_distributions(wave_id, [question_code])
+        return distributions.get(question_code, {})
+    
+    async def get_all_distributions(
+        self,
+        wave_id: str = None,
+        question_codes: List[str] = None
+    ) -> Dict[str, Dict[str, int]]:
+        """
+        Получить распределения ответов сразу по всем вопросам
+        
+        Один проход по answer_options с группировкой по (question_code, опция);
+        мультивыбор уже разложен на опции в самой БД.
+        
+        Returns:
+            {question_code: {option: count}}
+        """
+        if self.use_aggregates:
+            return await self._get_aggregated_distributions(wave_id, question_codes)
+        
+        answer, option = _answer_options("opt")
+        value = _option_value(option)
+        query = (
+            select(answer.question_code, value, func.count())
+            .select_from(answer)
+            .join(Respondent, Respondent.id == answer.respondent_id)
+            .join(option, option.answer_id == answer.id)
+            .where(
+                and_(
+                    Respondent.completed == True,
+                    Respondent.archived == False
+                )
             )
+            .group_by(answer.question_code, value)
+            .order_by(answer.question_code, value)
         )
         
+        if question_codes:
+            query = query.where(answer.question_code.in_(question_codes))
+        
         if wave_id:
             query = query.where(Respondent.wave_id == wave_id)
         
         result = await self.session.execute(query)
-        answers = result.scalars().all()
-        
-        # Обрабатываем ответы (включая JSON для мультивыбора)
-        processed = []
-        for ans in answers:
-            try:
-                # Пробуем распарсить как JSON (мультивыбор)
-                items = json.loads(ans)
-                processed.extend(items)
-            except:
-                # Одиночный ответ
-                processed.append(ans)
-        
-        return dict(Counter(processed))
+        
+        distributions = defaultdict(dict)
+        for question_code, option, count in result.all():
+            distributions[question_code][option] = count
+        return dict(distributions)
+    
+    async def _get_aggregated_distributions(
+        self,
+        wave_id: str = None,
+        question_codes: List[str] = None
+    ) -> Dict[str, Dict[str, int]]:
+        """Распределения из таблицы answer_counts"""
+        query = (
+            select(AnswerCount.question_code, AnswerCount.option_code, func.sum(AnswerCount.count))
+            .where(AnswerCount.count > 0)
+            .group_by(AnswerCount.question_code, AnswerCount.option_code)
+            .order_by(AnswerCount.question_code, AnswerCount.option_code)
+        )
+        
+        if question_codes:
+            query = query.where(AnswerCount.question_code.in_(question_codes))
+        
+        if wave_id:
+            query = query.where(AnswerCount.wave_id == wave_id)
+        
+        result = await self.session.execute(query)
+        
+        distributions = defaultdict(dict)
+        for question_code, option, count in result.all():
+            distributions[question_code][option] = count
+        return dict(distributions)
+    
+    async def record_completion(self, respondent_id: int, delta: int = 1):
+        """
+        Учесть ответы респондента в агрегатах
+        
+        delta=1 при завершении опроса, delta=-1 при архивации завершённого.
+        Не коммитит: вызывается в той же транзакции, что меняет статус респондента.
+        """
+        result = await self.session.execute(
+            select(Respondent.wave_id).where(Respondent.id == respondent_id)
+        )
+        wave_id = result.scalar_one()
+        
+        answer, option = _answer_options("opt")
+        result = await self.session.execute(
+            select(answer.question_code, _option_value(option))
+            .select_from(answer)
+            .join(option, option.answer_id == answer.id)
+            .where(answer.respondent_id == respondent_id)
+            .distinct()
+        )
+        rows = [
+            {"wave_id": wave_id, "question_code": question_code, "option_code": option_code, "count": delta}
+            for question_code, option_code in result.all()
+        ]
+        
+        if rows:
+            stmt = sqlite_insert(AnswerCount)
+            await self.session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[AnswerCount.wave_id, AnswerCount.question_code, AnswerCount.option_code],
+                    set_={"count": AnswerCount.count + stmt.excluded.count}
+                ),
+                rows
+            )
+        
+        stmt = sqlite_insert(WaveTotal).values(wave_id=wave_id, respondents=delta)
+        await self.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[WaveTotal.wave_id],
+                set_={"respondents": WaveTotal.respondents + stmt.excluded.respondents}
+            )
+        )
+    
+    async def rebuild_aggregates(self):
+        """
+        Пересчитать answer_counts и wave_totals по исходным ответам
+        
+        Для случаев, когда агрегаты разошлись с данными. Не коммитит.
+        """
+        await self.session.execute(delete(AnswerCount))
+        await self.session.execute(delete(WaveTotal))
+        
+        completed = and_(Respondent.completed == True, Respondent.archived == False)
+        
+        answer, option = _answer_options("opt")
+        selected = (
+            select(
+                Respondent.wave_id,
+                answer.question_code,
+                _option_value(option).label("option_code"),
+                answer.respondent_id
+            )
+            .select_from(answer)
+            .join(Respondent, Respondent.id == answer.respondent_id)
+            .join(option, option.answer_id == answer.id)
+            .where(completed)
+            .distinct()
+            .subquery()
+        )
+        await self.session.execute(
+            AnswerCount.__table__.insert().from_select(
+                ["wave_id", "question_code", "option_code", "count"],
+                select(selected.c.wave_id, selected.c.question_code, selected.c.option_code, func.count())
+                .group_by(selected.c.wave_id, selected.c.question_code, selected.c.option_code)
+            )
+        )
+        await self.session.execute(
+            WaveTotal.__table__.insert().from_select(
+                ["wave_id", "respondents"],
+                select(Respondent.wave_id, func.count(Respondent.id))
+                .where(completed)
+                .group_by(Respondent.wave_id)
+            )
+        )
+    
+    async def ensure_aggregates(self) -> bool:
+        """Заполнить пустые агрегаты (первый запуск после обновления). Не коммитит."""
+        result = await self.session.execute(select(WaveTotal.wave_id).limit(1))
+        if result.first() is not None:
+            return False
+        
+        result = await self.session.execute(
+            select(Respondent.id).where(
+                and_(
+                    Respondent.completed == True,
+                    Respondent.archived == False
+                )
+            ).limit(1)
+        )
+        if result.first() is None:
+            return False
+        
+        await self.rebuild_aggregates()
+        return True
     
     async def get_cross_tab(
         self, 
@@ -64,49 +251,43 @@ class SurveyAnalytics:
         question2: str, 
         wave_id: str = None
     ) -> Dict[Tuple[str, str], int]:
-        """Построить кросс-таблицу для двух вопросов"""
-        # Получаем всех завершённых респондентов
-        query = select(Respondent.id).where(
-            and_(
-                Respondent.completed == True,
-                Respondent.archived == False
+        """
+        Построить кросс-таблицу для двух вопросов
+        
+        Один запрос: self-join ответов по респонденту через answer_options,
+        поэтому мультивыбор считается парами опций, а не JSON-строками.
+        Опции первого вопроса берутся по индексу (question_code, option_code,
+        answer_id), дальше — поиски по ключам: ответ, респондент, ответ на
+        второй вопрос и его опции.
+        """
+        answer1, option1 = _answer_options("opt1")
+        answer2, option2 = _answer_options("opt2")
+        
+        query = (
+            select(option1.option_code, option2.option_code, func.count(func.distinct(Respondent.id)))
+            .select_from(option1)
+            .join(answer1, answer1.id == option1.answer_id)
+            .join(Respondent, Respondent.id == answer1.respondent_id)
+            .join(answer2, and_(
+                answer2.respondent_id == Respondent.id,
+                answer2.question_code == question2
+            ))
+            .join(option2, option2.answer_id == answer2.id)
+            .where(
+                and_(
+                    option1.question_code == question1,
+                    Respondent.completed == True,
+                    Respondent.archived == False
+                )
             )
+            .group_by(option1.option_code, option2.option_code)
         )
         
         if wave_id:
             query = query.where(Respondent.wave_id == wave_id)
         
         result = await self.session.execute(query)
-        respondent_ids = [r[0] for r in result.all()]
-        
-        # Получаем ответы на оба вопроса
-        cross_data = defaultdict(int)
-        
-        for resp_id in respondent_ids:
-            ans1_result = await self.session.execute(
-                select(Answer.answer).where(
-                    and_(
-                        Answer.respondent_id == resp_id,
-                        Answer.question_code == question1
-                    )
-                )
-            )
-            ans1 = ans1_result.scalar_one_or_none()
-            
-            ans2_result = await self.session.execute(
-                select(Answer.answer).where(
-                    and_(
-                        Answer.respondent_id == resp_id,
-                        Answer.question_code == question2
-                    )
-                )
-            )
-            ans2 = ans2_result.scalar_one_or_none()
-            
-            if ans1 and ans2:
-                cross_data[(ans1, ans2)] += 1
-        
-        return dict(cross_data)
+        return {(opt1, opt2): count for opt1, opt2, count in result.all()}
     
     async def get_open_answers(self, question_code: str, wave_id: str = None) -> List[str]:
         """Получить открытые ответы"""
@@ -134,8 +315,10 @@ class SurveyAnalytics:
         text = f"📊 Статистика опроса\n\n"
         text += f"👥 Всего респондентов: {total}\n\n"
         
+        distributions = await self.get_all_distributions(wave_id, ["Q1", "Q2", "Q3", "Q5"])
+        
         # Q1: Проявления буллинга
-        q1_dist = await self.get_question_distribution("Q1", wave_id)
+        q1_dist = distributions.get("Q1")
         if q1_dist:
             text += "🤔 Проявления буллинга (Q1):\n"
             sorted_q1 = sorted(q1_dist.items(), key=lambda x: x[1], reverse=True)
@@ -146,7 +329,7 @@ class SurveyAnalytics:
             text += "\n"
         
         # Q2: Причины буллинга
-        q2_dist = await self.get_question_distribution("Q2", wave_id)
+        q2_dist = distributions.get("Q2")
         if q2_dist:
             text += "🔍 Причины буллинга (Q2):\n"
             sorted_q2 = sorted(q2_dist.items(), key=lambda x: x[1], reverse=True)
@@ -157,7 +340,7 @@ class SurveyAnalytics:
             text += "\n"
         
         # Q3: Инициатор буллинга
-        q3_dist = await self.get_question_distribution("Q3", wave_id)
+        q3_dist = distributions.get("Q3")
         if q3_dist:
             text += "Инициатор буллинга (Q3):\n"
             sorted_q3 = sorted(q3_dist.items(), key=lambda x: x[1], reverse=True)
@@ -168,7 +351,7 @@ class SurveyAnalytics:
             text += "\n"
         
         # Q5: Длительность буллинга
-        q5_dist = await self.get_question_distribution("Q5", wave_id)
+        q5_dist = distributions.get("Q5")
         if q5_dist:
             text += "🕐 Длительность буллинга (Q5):\n"
             sorted_q5 = sorted(q5_dist.items(), key=lambda x: x[1], reverse=True)
@@ -218,12 +401,13 @@ class SurveyAnalytics:
                         "LQ1", "LQ2", "LQ3", "LQ4", "LQ5", 
                         "LQ6", "LQ7", "LQ8", "LQ9", "LQ10"]
         
+        distributions = await self.get_all_distributions(wave_id, all_questions)
+        
         for q_code in all_questions:
             title = question_titles.get(q_code, q_code)
             text += f"{title}\n"
             
-            # Получаем распределение ответов
-            distribution = await self.get_question_distribution(q_code, wave_id)
+            distribution = distributions.get(q_code)
             
             if not distribution:
                 text += "  (Нет ответов)\n\n"
@@ -374,47 +558,47 @@ class SurveyAnalytics:
         
         return labels.get(code, code)
     
-    async def export_to_csv_data(self, wave_id: str = None) -> List[Dict]:
-        """Подготовить данные для экспорта в CSV"""
-        query = select(Respondent).where(
-            and_(
-                Respondent.completed == True,
-                Respondent.archived == False
+    async def iter_export_rows(self, wave_id: str = None, chunk_size: int = 1000) -> AsyncIterator[Dict]:
+        """
+        Построчно выдать данные для экспорта в CSV
+        
+        Один pivot-запрос (строка на респондента, колонка на вопрос),
+        результат читается с сервера порциями по chunk_size строк,
+        поэтому память не растёт с размером волны.
+        """
+        columns = [
+            func.max(case((Answer.question_code == code, Answer.answer))).label(code)
+            for code in EXPORT_QUESTION_CODES
+        ]
+        query = (
+            select(Respondent.user_id, Respondent.wave_id, Respondent.completed_at, *columns)
+            .outerjoin(Answer, Answer.respondent_id == Respondent.id)
+            .where(
+                and_(
+                    Respondent.completed == True,
+                    Respondent.archived == False
+                )
             )
+            .group_by(Respondent.id)
+            .order_by(Respondent.id)
+            .execution_options(yield_per=chunk_size)
         )
         
         if wave_id:
             query = query.where(Respondent.wave_id == wave_id)
         
-        result = await self.session.execute(query)
-        respondents = result.scalars().all()
-        
-        csv_data = []
-        
-        for resp in respondents:
-            row = {
-                "user_id": resp.user_id,
-                "wave_id": resp.wave_id,
-                "completed_at": resp.completed_at.strftime("%Y-%m-%d %H:%M:%S") if resp.completed_at else "",
-            }
-            
-            # Получаем все ответы респондента
-            answers_result = await self.session.execute(
-                select(Answer).where(Answer.respondent_id == resp.id)
-            )
-            answers = {a.question_code: a.answer for a in answers_result.scalars().all()}
-            
-            # Добавляем ответы по начальным вопросам (Q1-Q6)
-            for i in range(1, 7):
-                q_code = f"Q{i}"
-                row[q_code] = answers.get(q_code, "")
-            
-            # Добавляем ответы по языковым вопросам (LQ1-LQ10)
-            for i in range(1, 11):
-                lq_code = f"LQ{i}"
-                row[lq_code] = answers.get(lq_code, "")
-            
-            csv_data.append(row)
-        
-        return csv_data
-
+        result = await self.session.stream(query)
+        async for partition in result.partitions():
+            for resp in partition:
+                row = {
+                    "user_id": resp.user_id,
+                    "wave_id": resp.wave_id,
+                    "completed_at": resp.completed_at.strftime("%Y-%m-%d %H:%M:%S") if resp.completed_at else "",
+                }
+                for code in EXPORT_QUESTION_CODES:
+                    row[code] = resp._mapping[code] or ""
+                yield row
+    
+    async def export_to_csv_data(self, wave_id: str = None) -> List[Dict]:
+        """Подготовить данные для экспорта в CSV"""
+        return [row async for row in self.iter_export_rows(wave_id)]
@@ -0,0 +1,76 @@
+"""Кэш ответов респондентов для хода опроса"""
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+
+class AnswerCache:
+    """
+    Ответы респондентов в памяти: {respondent_id: {question_code: answer}}
+
+    save_answer пишет в кэш вслед за БД (write-through), поэтому после
+    первой загрузки ход опроса не перечитывает ответы из БД. Размер
+    ограничен (LRU), записи без обращений дольше idle_ttl вытесняются.
+    """
+
+    def __init__(
+        self,
+        max_respondents: int = 10000,
+        idle_ttl: float = 1800,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_respondents = max_respondents
+        self.idle_ttl = idle_ttl
+        self._clock = clock
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict_idle(self, now: float):
+        """Вытеснить простаивающие записи: они в начале, т.к. порядок — по обращениям"""
+        while self._entries:
+            respondent_id, (touched, _) = next(iter(self._entries.items()))
+            if now - touched < self.idle_ttl:
+                break
+            del self._entries[respondent_id]
+
+    def _touch(self, respondent_id: int, answers: Dict[str, str]):
+        now = self._clock()
+        self._entries[respondent_id] = (now, answers)
+        self._entries.move_to_end(respondent_id)
+        self._evict_idle(now)
+        while len(self._entries) > self.max_respondents:
+            self._entries.popitem(last=False)
+
+    def get(self, respondent_id: int) -> Optional[Dict[str, str]]:
+        """Копия ответов респондента или None, если его нет в кэше"""
+        entry = self._entries.get(respondent_id)
+        if entry is None or self._clock() - entry[0] >= self.idle_ttl:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._touch(respondent_id, entry[1])
+        return dict(entry[1])
+
+    def put(self, respondent_id: int, answers: Dict[str, str]):
+        """Положить все ответы респондента (после загрузки из БД или для нового)"""
+        self._touch(respondent_id, dict(answers))
+
+    def set_answer(self, respondent_id: int, question_code: str, answer: str):
+        """Обновить один ответ, если респондент уже в кэше"""
+        entry = self._entries.get(respondent_id)
+        if entry is None:
+            return
+        entry[1][question_code] = answer
+        self._touch(respondent_id, entry[1])
+
+    def evict(self, respondent_id: int) -> bool:
+        """Убрать респондента из кэша; True, если он там был"""
+        return self._entries.pop(respondent_id, None) is not None
+
+
+answer_cache = AnswerCache()
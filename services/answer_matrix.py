@@ -0,0 +1,317 @@
+"""Аналитика волны в памяти: multi-hot матрица ответов на NumPy"""
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import select, and_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import database, Respondent, Answer, AnswerOption, WaveTotal
+from utils.questions import QUESTIONS
+
+logger = logging.getLogger(__name__)
+
+
+# Столбцы матрицы: все коды опций в порядке анкеты
+OPTION_CODES = [option["code"] for q in QUESTIONS for option in q.get("options", [])]
+OPTION_INDEX = {code: i for i, code in enumerate(OPTION_CODES)}
+
+# Коды по алфавиту и их столбцы: поиск столбцов для массива кодов через searchsorted
+_SORTED_CODES = np.array(sorted(OPTION_CODES))
+_SORTED_COLUMNS = np.array([OPTION_INDEX[code] for code in _SORTED_CODES])
+
+
+def _build_question_slices() -> Dict[str, slice]:
+    """Опции одного вопроса идут подряд, поэтому вопрос — это срез столбцов"""
+    slices = {}
+    start = 0
+    for q in QUESTIONS:
+        end = start + len(q.get("options", []))
+        slices[q["code"]] = slice(start, end)
+        start = end
+    return slices
+
+
+QUESTION_SLICES = _build_question_slices()
+
+
+class AnswerMatrix:
+    """
+    Multi-hot матрица ответов волны
+    
+    Строка — завершённый респондент, столбец — код опции из QUESTIONS.
+    Распределения, кросс-таблицы, совместная встречаемость и фильтры
+    по подгруппам считаются векторно, без обращений к БД.
+    """
+    
+    def __init__(self, wave_id: str = None, capacity: int = 1024):
+        self.wave_id = wave_id
+        self.matrix = np.zeros((capacity, len(OPTION_CODES)), dtype=np.uint8)
+        self.row_index: Dict[int, int] = {}
+        self.row_ids = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+        self.loaded_until: Optional[datetime] = None
+    
+    @property
+    def rows(self) -> np.ndarray:
+        """Заполненная часть матрицы"""
+        return self.matrix[:self.size]
+    
+    def _ensure_capacity(self, size: int):
+        if size <= len(self.matrix):
+            return
+        capacity = max(size, len(self.matrix) * 2)
+        grown = np.zeros((capacity, len(OPTION_CODES)), dtype=np.uint8)
+        grown[:self.size] = self.rows
+        self.matrix = grown
+        row_ids = np.zeros(capacity, dtype=np.int64)
+        row_ids[:self.size] = self.row_ids[:self.size]
+        self.row_ids = row_ids
+    
+    def add(self, respondent_ids: Sequence[int], options: Sequence[Optional[str]]):
+        """
+        Добавить респондентов; новые — новые строки, известные дополняются
+        
+        options[i] — коды опций respondent_ids[i] через запятую (как их
+        отдаёт group_concat), None — респондент без ответов: строка есть,
+        ячейки пустые. Коды раскладываются по столбцам одним searchsorted.
+        """
+        new_ids = [rid for rid in respondent_ids if rid not in self.row_index]
+        self._ensure_capacity(self.size + len(new_ids))
+        self.row_index.update(zip(new_ids, range(self.size, self.size + len(new_ids))))
+        self.row_ids[self.size:self.size + len(new_ids)] = new_ids
+        self.size += len(new_ids)
+        
+        lengths = [codes.count(",") + 1 if codes else 0 for codes in options]
+        if not any(lengths):
+            return
+        codes = np.array(",".join(codes for codes in options if codes).split(","))
+        rows = np.repeat([self.row_index[rid] for rid in respondent_ids], lengths)
+        
+        positions = np.minimum(np.searchsorted(_SORTED_CODES, codes), len(_SORTED_CODES) - 1)
+        known = _SORTED_CODES[positions] == codes
+        self.matrix[rows[known], _SORTED_COLUMNS[positions[known]]] = 1
+    
+    def remove(self, respondent_ids: Iterable[int]):
+        """Убрать строки респондентов: на место каждой переезжает последняя"""
+        for rid in respondent_ids:
+            row = self.row_index.pop(rid, None)
+            if row is None:
+                continue
+            last = self.size - 1
+            if row != last:
+                moved = int(self.row_ids[last])
+                self.matrix[row] = self.matrix[last]
+                self.row_ids[row] = moved
+                self.row_index[moved] = row
+            self.matrix[last] = 0
+            self.size -= 1
+    
+    def mask(self, *option_codes: str) -> np.ndarray:
+        """Подгруппа: респонденты, выбравшие все указанные опции"""
+        result = np.ones(self.size, dtype=bool)
+        for code in option_codes:
+            result &= self.rows[:, OPTION_INDEX[code]].astype(bool)
+        return result
+    
+    def _select(self, question_code: str, mask: np.ndarray = None) -> np.ndarray:
+        block = self.rows[:, QUESTION_SLICES[question_code]]
+        return block[mask] if mask is not None else block
+    
+    def distribution(self, question_code: str, mask: np.ndarray = None) -> Dict[str, int]:
+        """Распределение ответов на вопрос: {option_code: count}"""
+        counts = self._select(question_code, mask).sum(axis=0, dtype=np.int64)
+        codes = OPTION_CODES[QUESTION_SLICES[question_code]]
+        return {code: int(count) for code, count in zip(codes, counts) if count}
+    
+    def cross_tab(self, question1: str, question2: str, mask: np.ndarray = None) -> Dict[Tuple[str, str], int]:
+        """Кросс-таблица двух вопросов: {(option1, option2): count}"""
+        block1 = self._select(question1, mask).astype(np.int32)
+        block2 = self._select(question2, mask).astype(np.int32)
+        counts = block1.T @ block2
+        
+        codes1 = OPTION_CODES[QUESTION_SLICES[question1]]
+        codes2 = OPTION_CODES[QUESTION_SLICES[question2]]
+        return {
+            (codes1[i], codes2[j]): int(counts[i, j])
+            for i, j in zip(*np.nonzero(counts))
+        }
+    
+    def co_occurrence(self, question_code: str, mask: np.ndarray = None) -> Dict[Tuple[str, str], int]:
+        """Совместная встречаемость опций вопроса с мультивыбором"""
+        block = self._select(question_code, mask).astype(np.int32)
+        counts = np.triu(block.T @ block, k=1)
+        
+        codes = OPTION_CODES[QUESTION_SLICES[question_code]]
+        return {
+            (codes[i], codes[j]): int(counts[i, j])
+            for i, j in zip(*np.nonzero(counts))
+        }
+
+
+def _completed_filter(wave_id: str = None):
+    condition = and_(Respondent.completed == True, Respondent.archived == False)
+    if wave_id:
+        condition = and_(condition, Respondent.wave_id == wave_id)
+    return condition
+
+
+async def _count_completed(session: AsyncSession, wave_id: str = None) -> int:
+    """Число завершённых опросов по агрегату wave_totals"""
+    query = select(func.sum(WaveTotal.respondents))
+    if wave_id:
+        query = query.where(WaveTotal.wave_id == wave_id)
+    result = await session.execute(query)
+    return result.scalar() or 0
+
+
+# wave_id приходит из команд администратора, поэтому кэш ограничен:
+# дольше всех не запрошенные волны вытесняются
+MAX_CACHED_MATRICES = 8
+# Сколько id подставлять в один IN при догрузке пропущенных завершений
+IN_CHUNK = 500
+
+
+async def _completed_ids(session: AsyncSession, wave_id: str = None) -> Set[int]:
+    result = await session.execute(select(Respondent.id).where(_completed_filter(wave_id)))
+    return set(result.scalars().all())
+
+
+async def _load_rows(session: AsyncSession, condition):
+    """
+    Строка на респондента: id, completed_at и его опции через запятую
+    
+    group_concat собирает опции в SQL, поэтому из БД приходит по строке
+    на респондента, а не на каждую выбранную опцию.
+    """
+    result = await session.execute(
+        select(Respondent.id, Respondent.completed_at, func.group_concat(AnswerOption.option_code))
+        .outerjoin(Answer, Answer.respondent_id == Respondent.id)
+        .outerjoin(AnswerOption, AnswerOption.answer_id == Answer.id)
+        .where(condition)
+        .group_by(Respondent.id)
+    )
+    return result.all()
+
+
+async def _load_into(matrix: AnswerMatrix, session: AsyncSession, condition):
+    """Догрузить в матрицу респондентов по условию; сдвинуть loaded_until"""
+    rows = await _load_rows(session, condition)
+    matrix.add([rid for rid, _, _ in rows], [codes for _, _, codes in rows])
+    matrix.loaded_until = max(
+        (completed_at for _, completed_at, _ in rows if completed_at),
+        default=matrix.loaded_until
+    )
+
+
+async def _reconcile(matrix: AnswerMatrix, session: AsyncSession, wave_id: str = None):
+    """
+    Привести строки матрицы к текущему списку завершённых
+    
+    Перезапустивший опрос респондент архивируется — его строка убирается;
+    завершения с completed_at раньше loaded_until догружаются по id.
+    """
+    current = await _completed_ids(session, wave_id)
+    loaded = set(matrix.row_index)
+    matrix.remove(loaded - current)
+    
+    missing = sorted(current - loaded)
+    for i in range(0, len(missing), IN_CHUNK):
+        chunk = missing[i:i + IN_CHUNK]
+        await _load_into(matrix, session, Respondent.id.in_(chunk))
+
+
+_matrices: "OrderedDict[Optional[str], AnswerMatrix]" = OrderedDict()
+# Блокировка на волну: построение матрицы одной волны не держит другие.
+# Значение — (блокировка, сколько корутин её ждут или держат)
+_locks: Dict[Optional[str], Tuple[asyncio.Lock, int]] = {}
+
+
+@asynccontextmanager
+async def _wave_lock(wave_id: Optional[str]):
+    lock, users = _locks.get(wave_id) or (asyncio.Lock(), 0)
+    _locks[wave_id] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = _locks[wave_id]
+        if users == 1:
+            del _locks[wave_id]
+        else:
+            _locks[wave_id] = (lock, users - 1)
+
+
+async def get_answer_matrix(session: AsyncSession, wave_id: str = None) -> AnswerMatrix:
+    """
+    Матрица волны из кэша, дополненная новыми завершениями
+    
+    Новые респонденты догружаются по completed_at. Если число строк
+    разошлось с wave_totals (например, кто-то перезапустил опрос и
+    архивирован), матрица сверяется со списком завершённых: лишние строки
+    убираются, пропущенные догружаются, без полной перестройки. Пустые
+    матрицы (волна без завершений или опечатка в wave_id) не кэшируются.
+    """
+    async with _wave_lock(wave_id):
+        matrix = _matrices.get(wave_id)
+        
+        if matrix is not None:
+            since = matrix.loaded_until
+            condition = _completed_filter(wave_id)
+            if since is not None:
+                condition = and_(condition, Respondent.completed_at >= since)
+            await _load_into(matrix, session, condition)
+            if matrix.size != await _count_completed(session, wave_id):
+                await _reconcile(matrix, session, wave_id)
+            _matrices.move_to_end(wave_id)
+            return matrix
+        
+        matrix = AnswerMatrix(wave_id)
+        await _load_into(matrix, session, _completed_filter(wave_id))
+        if matrix.size:
+            _matrices[wave_id] = matrix
+            while len(_matrices) > MAX_CACHED_MATRICES:
+                _matrices.popitem(last=False)
+        return matrix
+
+
+def is_answer_matrix_cached(wave_id: str = None) -> bool:
+    return wave_id in _matrices
+
+
+_warming: Dict[Optional[str], asyncio.Task] = {}
+
+
+def warm_answer_matrix(wave_id: str = None):
+    """
+    Построить матрицу волны в фоне, в своей сессии читателя
+    
+    Холодная сборка дольше одного SQL-запроса, поэтому команда, не
+    заставшая матрицу в кэше, отвечает через SQL, а матрица готовится
+    к следующим запросам.
+    """
+    if wave_id in _matrices or wave_id in _warming:
+        return
+    
+    async def build():
+        async with database.reader_session_maker() as session:
+            await get_answer_matrix(session, wave_id)
+    
+    task = asyncio.create_task(build(), name="answer-matrix")
+    _warming[wave_id] = task
+    task.add_done_callback(lambda t: _warmed(wave_id, t))
+
+
+def _warmed(wave_id: Optional[str], task: asyncio.Task):
+    _warming.pop(wave_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Ошибка построения матрицы ответов волны %s: %s", wave_id, task.exception())
+
+
+def reset_answer_matrices():
+    """Сбросить кэш матриц (после пересчёта агрегатов)"""
+    _matrices.clear()
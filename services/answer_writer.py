@@ -0,0 +1,211 @@
+"""Фоновая запись ответов пачками (write-behind с group commit)"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import update, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import database, upsert_answer, Respondent
+from services.analytics import SurveyAnalytics
+from services.answer_cache import answer_cache
+
+logger = logging.getLogger(__name__)
+
+Operation = Callable[[AsyncSession], Awaitable[None]]
+
+
+class AnswerWriter:
+    """
+    Очередь записей в БД с фоновым писателем
+    
+    save_answer и complete_respondent ставят операцию в очередь и сразу
+    возвращаются; писатель собирает до max_batch операций (или сколько
+    набралось за max_delay секунд) и применяет их одной транзакцией —
+    один fsync на пачку вместо одного на клик.
+    
+    Очередь ограничена max_backlog: при переполнении постановка ждёт
+    (backpressure). Чтение своих записей: wait_for(respondent_id) ждёт,
+    пока все операции респондента будут закоммичены. Пока писатель не
+    запущен (тесты, скрипты), операции выполняются сразу.
+    
+    Ответ попадает в кэш раньше, чем в БД, поэтому при ошибке записи
+    респондент вытесняется из answer_cache и следующий шаг перечитает
+    его ответы из БД. Если задача писателя упала, ждущие её операции
+    завершаются ошибкой, а не висят.
+    """
+    
+    def __init__(
+        self,
+        session_maker=None,
+        max_batch: int = 100,
+        max_delay: float = 0.005,
+        max_backlog: int = 10000
+    ):
+        self._session_maker = session_maker
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_backlog = max_backlog
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self.batches = 0
+        self.operations = 0
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    @property
+    def backlog(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+    
+    def _new_session(self) -> AsyncSession:
+        session_maker = self._session_maker or database.async_session_maker
+        return session_maker()
+    
+    async def start(self):
+        """Запустить фоновую задачу писателя"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_backlog)
+        self._task = asyncio.create_task(self._run(), name="answer-writer")
+        self._task.add_done_callback(self._on_stopped)
+    
+    async def stop(self):
+        """Дописать всё, что уже в очереди, и остановить писателя"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+    
+    async def wait_for(self, respondent_id: int):
+        """Дождаться записи всех поставленных в очередь операций респондента"""
+        future = self._pending.get(respondent_id)
+        if future is None or future.done():
+            return
+        if not self.running:
+            # Писатель умер, операции в очереди уже не выполнятся
+            self._fail_pending(RuntimeError("Фоновый писатель ответов не запущен"))
+            return
+        # Ошибку записи уже залогировал _forget, читающему она не нужна
+        await asyncio.wait([future])
+    
+    async def save_answer(self, respondent_id: int, question_code: str, answer_value: str):
+        """Поставить в очередь запись ответа"""
+        async def operation(session: AsyncSession):
+            await upsert_answer(session, respondent_id, question_code, answer_value)
+        
+        await self._submit(respondent_id, operation)
+    
+    async def complete_respondent(self, respondent_id: int):
+        """Поставить в очередь завершение опроса вместе с обновлением агрегатов"""
+        completed_at = datetime.utcnow()
+        
+        async def operation(session: AsyncSession):
+            result = await session.execute(
+                update(Respondent)
+                .where(
+                    and_(
+                        Respondent.id == respondent_id,
+                        Respondent.completed == False
+                    )
+                )
+                .values(completed=True, completed_at=completed_at, abandoned=False)
+            )
+            if result.rowcount:
+                await SurveyAnalytics(session).record_completion(respondent_id)
+        
+        await self._submit(respondent_id, operation)
+    
+    async def _submit(self, respondent_id: int, operation: Operation):
+        if not self.running:
+            async with self._new_session() as session:
+                await operation(session)
+                await session.commit()
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending[respondent_id] = future
+        future.add_done_callback(lambda f: self._forget(respondent_id, f))
+        await self._queue.put((operation, future))
+    
+    def _forget(self, respondent_id: int, future: asyncio.Future):
+        if self._pending.get(respondent_id) is future:
+            del self._pending[respondent_id]
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Ошибка фоновой записи ответа: %s", future.exception())
+            answer_cache.evict(respondent_id)
+    
+    def _fail_pending(self, error: Exception):
+        """Завершить ошибкой все операции, которые писатель уже не выполнит"""
+        if self._queue is not None:
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None and not item[1].done():
+                    item[1].set_exception(error)
+        for future in list(self._pending.values()):
+            if not future.done():
+                future.set_exception(error)
+    
+    def _on_stopped(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Фоновый писатель ответов упал: %s", task.exception())
+        self._fail_pending(RuntimeError("Фоновый писатель ответов остановлен"))
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            await self._apply(batch)
+    
+    async def _apply(self, batch):
+        """Применить пачку одной транзакцией; при ошибке — по одной операции"""
+        try:
+            async with self._new_session() as session:
+                for operation, _ in batch:
+                    await operation(session)
+                await session.commit()
+        except Exception:
+            logger.exception("Ошибка записи пачки из %d операций, повтор по одной", len(batch))
+            for operation, future in batch:
+                try:
+                    async with self._new_session() as session:
+                        await operation(session)
+                        await session.commit()
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(None)
+        else:
+            for _, future in batch:
+                future.set_result(None)
+        
+        self.batches += 1
+        self.operations += len(batch)
+
+
+answer_writer = AnswerWriter()
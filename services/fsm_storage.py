@@ -0,0 +1,237 @@
+"""Хранилище FSM в локальном SQLite с LRU горячих ключей"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+
+def _key_string(key: StorageKey) -> str:
+    thread_id = "" if key.thread_id is None else key.thread_id
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{thread_id}:{key.destiny}"
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище: SQLite-файл + ограниченный LRU в памяти
+    
+    В памяти держатся только max_keys последних пользователей, остальные
+    читаются из файла при первом обращении. Изменения пишутся не сразу:
+    грязные ключи копятся и раз в flush_interval секунд сбрасываются одной
+    транзакцией, так что клик в опросе не ждёт записи на диск. Пустые
+    записи (нет состояния и данных) из файла удаляются.
+    
+    Ключ, вытесненный из LRU до сброса, читается из очереди грязных
+    записей или из пачки, которая сейчас пишется, поэтому данные не
+    теряются и не откатываются.
+    
+    Файл может быть общим для нескольких процессов, если каждый из них
+    обслуживает свою часть пользователей: shard=(номер, всего) — тогда
+    reap трогает только записи своих пользователей.
+    """
+    
+    def __init__(
+        self,
+        path: str = "fsm.db",
+        max_keys: int = 10000,
+        flush_interval: float = 0.5,
+        shard: Tuple[int, int] = None
+    ):
+        self.path = path
+        self.shard = shard
+        self.max_keys = max_keys
+        self.flush_interval = flush_interval
+        self._cache: "OrderedDict[str, Record]" = OrderedDict()
+        self._accessed: Dict[str, float] = {}
+        self._dirty: Dict[str, Record] = {}
+        # Пачки, отданные flush и ещё не закоммиченные
+        self._flushing: List[Dict[str, Record]] = []
+        self._db: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+    
+    async def _connection(self) -> aiosqlite.Connection:
+        if self._db is None:
+            async with self._connect_lock:
+                if self._db is None:
+                    db = await aiosqlite.connect(self.path)
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute("PRAGMA synchronous=NORMAL")
+                    await db.execute("PRAGMA busy_timeout=5000")
+                    await db.execute(
+                        "CREATE TABLE IF NOT EXISTS fsm_records ("
+                        "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+                    )
+                    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm_records (updated_at)")
+                    await db.commit()
+                    self._db = db
+        return self._db
+    
+    def _owns(self, key: str) -> bool:
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        user_id = int(key.split(":")[2])
+        return user_id % count == index
+    
+    def _remember(self, key: str, record: Record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        self._accessed[key] = time.time()
+        while len(self._cache) > self.max_keys:
+            evicted, _ = self._cache.popitem(last=False)
+            del self._accessed[evicted]
+    
+    def _unflushed(self, key: str) -> Optional[Record]:
+        """Изменение, которого ещё нет в файле: из очереди или из пишущейся пачки"""
+        record = self._dirty.get(key)
+        if record is not None:
+            return record
+        for batch in reversed(self._flushing):
+            if key in batch:
+                return batch[key]
+        return None
+    
+    async def _load(self, key: str) -> Record:
+        record = self._cache.get(key)
+        if record is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            self._accessed[key] = time.time()
+            return record
+        
+        self.misses += 1
+        record = self._unflushed(key)
+        if record is None:
+            db = await self._connection()
+            async with db.execute("SELECT state, data FROM fsm_records WHERE key = ?", (key,)) as cursor:
+                row = await cursor.fetchone()
+            record = (row[0], json.loads(row[1])) if row else (None, {})
+            # Пока шёл запрос, ключ мог быть изменён — свежая запись важнее
+            record = self._cache.get(key) or self._unflushed(key) or record
+        self._remember(key, record)
+        return record
+    
+    def _store(self, key: str, record: Record):
+        self._remember(key, record)
+        self._dirty[key] = record
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Уже залогировано в flush, изменения остались в очереди
+                continue
+            # Изменения, пришедшие во время записи, ждут следующего сброса
+            if not self._dirty:
+                return
+    
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        if not self._dirty:
+            return
+        
+        dirty, self._dirty = self._dirty, {}
+        self._flushing.append(dirty)
+        now = time.time()
+        upserts = [
+            (key, state, json.dumps(data, ensure_ascii=False), now)
+            for key, (state, data) in dirty.items()
+            if state is not None or data
+        ]
+        deletes = [(key,) for key, (state, data) in dirty.items() if state is None and not data]
+        
+        try:
+            db = await self._connection()
+            await db.executemany(
+                "INSERT INTO fsm_records (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "updated_at = excluded.updated_at",
+                upserts
+            )
+            await db.executemany("DELETE FROM fsm_records WHERE key = ?", deletes)
+            await db.commit()
+            self.flushes += 1
+        except BaseException as e:
+            if isinstance(e, Exception):
+                logger.exception("Ошибка записи FSM (%d ключей), повтор при следующем сбросе", len(dirty))
+            # Вернуть в очередь то, что не перезаписано новыми изменениями
+            for key, record in dirty.items():
+                self._dirty.setdefault(key, record)
+            raise
+        finally:
+            self._flushing = [batch for batch in self._flushing if batch is not dirty]
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key = _key_string(key)
+        _, data = await self._load(key)
+        self._store(key, (state.state if isinstance(state, State) else state, data))
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(_key_string(key))
+        return state
+    
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        key = _key_string(key)
+        state, _ = await self._load(key)
+        self._store(key, (state, data.copy()))
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(_key_string(key))
+        return data.copy()
+    
+    async def reap(self, idle_before: float) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Удалить записи пользователей, не появлявшихся с момента idle_before
+        
+        Пользователь, к чьему ключу обращались позже (даже только чтением),
+        не трогается. Returns: данные удалённых записей и их размер в байтах.
+        """
+        await self.flush()
+        db = await self._connection()
+        async with db.execute(
+            "SELECT key, data FROM fsm_records WHERE updated_at < ?", (idle_before,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        
+        reaped = [
+            (key, data) for key, data in rows
+            if self._accessed.get(key, 0) < idle_before and key not in self._dirty and self._owns(key)
+        ]
+        await db.executemany(
+            "DELETE FROM fsm_records WHERE key = ? AND updated_at < ?",
+            [(key, idle_before) for key, _ in reaped]
+        )
+        await db.commit()
+        
+        for key, _ in reaped:
+            if self._cache.pop(key, None) is not None:
+                del self._accessed[key]
+        
+        return [json.loads(data) for _, data in reaped], sum(len(data) for _, data in reaped)
+    
+    async def close(self) -> None:
+        """Сбросить изменения и закрыть файл"""
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
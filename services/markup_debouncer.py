@@ -0,0 +1,138 @@
+"""Склейка частых правок клавиатуры одного сообщения"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+EditMarkup = Callable[[InlineKeyboardMarkup], Awaitable[object]]
+
+
+class _PendingEdit:
+    def __init__(self, markup: InlineKeyboardMarkup, edit: EditMarkup, shown: Optional[InlineKeyboardMarkup]):
+        self.markup = markup
+        self.edit = edit
+        self.shown = shown
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class MarkupDebouncer:
+    """
+    Отложенная правка клавиатуры сообщения (trailing debounce)
+    
+    Каждый клик по тогглу перезапускает окно тишины delay; по его
+    истечении в Telegram уходит только последнее состояние клавиатуры,
+    а если оно совпадает с показанным — правка не отправляется вовсе.
+    Правки одного сообщения идут строго по очереди, RetryAfter
+    выжидается и повторяется уже с самой свежей клавиатурой.
+    
+    Перед любой другой правкой того же сообщения (следующий вопрос,
+    назад, пропуск) отложенную правку нужно снять через cancel — иначе
+    она через delay вернёт в сообщение клавиатуру прошлого вопроса.
+    """
+    
+    def __init__(self, delay: float = 0.4):
+        self.delay = delay
+        self._pending: Dict[Hashable, _PendingEdit] = {}
+        self.scheduled = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.unchanged = 0
+        self.cancelled = 0
+    
+    def __len__(self) -> int:
+        return len(self._pending)
+    
+    def schedule(
+        self,
+        key: Hashable,
+        markup: InlineKeyboardMarkup,
+        edit: EditMarkup,
+        shown: Optional[InlineKeyboardMarkup] = None
+    ):
+        """
+        Запланировать показ markup в сообщении key
+        
+        edit(markup) отправляет правку; shown — клавиатура, которая сейчас
+        в сообщении (для первого клика серии, дальше отслеживается здесь).
+        """
+        self.scheduled += 1
+        entry = self._pending.get(key)
+        if entry is not None:
+            self.coalesced += 1
+            entry.markup = markup
+            entry.edit = edit
+            entry.changed.set()
+            return
+        
+        entry = _PendingEdit(markup, edit, shown)
+        self._pending[key] = entry
+        entry.task = asyncio.create_task(self._run(key, entry))
+    
+    async def _wait_quiet(self, entry: _PendingEdit):
+        while True:
+            entry.changed.clear()
+            try:
+                await asyncio.wait_for(entry.changed.wait(), self.delay)
+            except asyncio.TimeoutError:
+                return
+    
+    async def _run(self, key: Hashable, entry: _PendingEdit):
+        try:
+            while True:
+                await self._wait_quiet(entry)
+                markup = entry.markup
+                
+                if markup == entry.shown:
+                    self.unchanged += 1
+                else:
+                    try:
+                        await entry.edit(markup)
+                    except TelegramRetryAfter as e:
+                        await asyncio.sleep(e.retry_after)
+                        continue
+                    except TelegramBadRequest as e:
+                        # "message is not modified" — клавиатура уже такая
+                        if "not modified" not in str(e):
+                            logger.warning("Не удалось обновить клавиатуру: %s", e)
+                    except Exception as e:
+                        logger.warning("Не удалось обновить клавиатуру: %s", e)
+                    else:
+                        self.sent += 1
+                    entry.shown = markup
+                
+                # Пока шла правка, новых кликов не было — серия закончена
+                if entry.markup is markup:
+                    return
+        finally:
+            if self._pending.get(key) is entry:
+                del self._pending[key]
+    
+    async def cancel(self, key: Hashable) -> bool:
+        """
+        Снять отложенную правку сообщения key
+        
+        Если правка уже отправляется, дождаться её окончания (отменой),
+        чтобы следующая правка сообщения ушла после неё.
+        """
+        entry = self._pending.pop(key, None)
+        if entry is None:
+            return False
+        self.cancelled += 1
+        entry.task.cancel()
+        await asyncio.gather(entry.task, return_exceptions=True)
+        return True
+    
+    async def close(self):
+        """Отменить отложенные правки (при остановке бота)"""
+        tasks = [entry.task for entry in self._pending.values() if entry.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+markup_debouncer = MarkupDebouncer()
@@ -0,0 +1,88 @@
+"""Профилирование работающего бота по команде администратора"""
+import asyncio
+import contextvars
+import cProfile
+import io
+import logging
+import pstats
+import time
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LoopProfiler:
+    """
+    cProfile на потоке цикла событий в течение заданного окна
+    
+    Хук cProfile ставится на поток, а все задачи бота (обработчики,
+    запись ответов, дебаунсер клавиатур) выполняются в потоке цикла —
+    за окно в профиль попадает всё, что цикл успел сделать. Вне окна хук
+    не установлен и накладных расходов нет: Profile создаётся на каждый
+    запуск и выбрасывается после. При нескольких воркерах профилируется
+    тот, в чей шард попала команда.
+    """
+    
+    def __init__(self, max_seconds: float = 300, limit: int = 60):
+        self.max_seconds = max_seconds
+        self.limit = limit
+        self._profile: Optional[cProfile.Profile] = None
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+    
+    @property
+    def running(self) -> bool:
+        return self._profile is not None or self._task is not None
+    
+    def start(self, seconds: float, deliver: Callable[[str], Awaitable[None]]) -> asyncio.Task:
+        """
+        Профилировать в фоне и отдать сводку в deliver
+        
+        Обработчик команды не ждёт окно (до max_seconds) и сразу
+        освобождает обновление. Задача запускается в пустом контексте,
+        чтобы её запросы не попадали в метрики вызвавшего обработчика.
+        """
+        if self.running:
+            raise RuntimeError("Профилирование уже идёт")
+        
+        async def run():
+            await deliver(await self.profile(seconds))
+        
+        self._task = asyncio.create_task(run(), name="loop-profile", context=contextvars.Context())
+        self._task.add_done_callback(self._finished)
+        return self._task
+    
+    def _finished(self, task: asyncio.Task):
+        self._task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Ошибка профилирования: %s", task.exception())
+    
+    async def profile(self, seconds: float) -> str:
+        """Профилировать цикл seconds секунд (не больше max_seconds); вернуть сводку pstats"""
+        if self._profile is not None:
+            raise RuntimeError("Профилирование уже идёт")
+        seconds = min(seconds, self.max_seconds)
+        
+        profile = self._profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            self._profile = None
+        self.runs += 1
+        return self._summary(profile, time.perf_counter() - started)
+    
+    def _summary(self, profile: cProfile.Profile, elapsed: float) -> str:
+        """Две выборки pstats: по суммарному времени с вложенными вызовами и по собственному"""
+        out = io.StringIO()
+        out.write(f"Профиль цикла событий за {elapsed:.1f} с\n\n")
+        stats = pstats.Stats(profile, stream=out).strip_dirs()
+        for key, title in ((pstats.SortKey.CUMULATIVE, "с вложенными"), (pstats.SortKey.TIME, "собственное")):
+            out.write(f"=== Топ-{self.limit} по времени ({title}) ===\n")
+            stats.sort_stats(key).print_stats(self.limit)
+        return out.getvalue()
+
+
+loop_profiler = LoopProfiler()
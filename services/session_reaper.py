@@ -0,0 +1,125 @@
+"""Уборка брошенных на середине опросов"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import update, select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import database, Respondent, Answer
+from services.answer_cache import answer_cache
+from services.fsm_storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+
+class ReapReport(NamedTuple):
+    """Итог одного прохода уборки"""
+    fsm_records: int = 0
+    fsm_bytes: int = 0
+    cached_answers: int = 0
+    respondents: int = 0
+
+
+class SessionReaper:
+    """
+    Периодическая уборка сессий, простаивающих дольше ttl секунд
+    
+    Раз в interval секунд:
+    - удаляет FSM-записи простаивающих пользователей (из файла и памяти);
+    - выгружает их ответы из кэша ответов;
+    - одним UPDATE помечает abandoned незавершённых респондентов без
+      активности (последняя запись ответа или создание) дольше ttl.
+    
+    Вернувшийся пользователь продолжает опрос с того же респондента:
+    consent_yes снимает отметку abandoned, /status находит респондента
+    по user_id.
+    """
+    
+    def __init__(self, ttl: float = 24 * 3600, interval: float = 3600, session_maker=None):
+        self.ttl = ttl
+        self.interval = interval
+        self._session_maker = session_maker
+        self._storage: Optional[SQLiteStorage] = None
+        self._task: Optional[asyncio.Task] = None
+        self.last_report = ReapReport()
+        self.total = ReapReport()
+    
+    def _new_session(self) -> AsyncSession:
+        session_maker = self._session_maker or database.async_session_maker
+        return session_maker()
+    
+    async def start(self, storage: SQLiteStorage = None):
+        """Запустить периодическую уборку"""
+        self._storage = storage
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="session-reaper")
+    
+    async def stop(self):
+        """Остановить уборку"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Ошибка уборки брошенных сессий")
+    
+    async def mark_abandoned(self, session: AsyncSession, idle_before: datetime) -> int:
+        """Пометить незавершённых респондентов без активности с idle_before; не коммитит"""
+        last_answer = (
+            select(func.max(Answer.updated_at))
+            .where(Answer.respondent_id == Respondent.id)
+            .scalar_subquery()
+        )
+        result = await session.execute(
+            update(Respondent)
+            .where(
+                and_(
+                    Respondent.completed == False,
+                    Respondent.archived == False,
+                    Respondent.abandoned == False,
+                    func.coalesce(last_answer, Respondent.created_at) < idle_before
+                )
+            )
+            .values(abandoned=True)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
+    
+    async def run_once(self, now: float = None) -> ReapReport:
+        """Один проход уборки"""
+        now = time.time() if now is None else now
+        idle_before = now - self.ttl
+        
+        fsm_records, fsm_bytes, cached_answers = 0, 0, 0
+        if self._storage is not None:
+            reaped, fsm_bytes = await self._storage.reap(idle_before)
+            fsm_records = len(reaped)
+            for data in reaped:
+                respondent_id = data.get("respondent_id")
+                if respondent_id is not None and answer_cache.evict(respondent_id):
+                    cached_answers += 1
+        
+        async with self._new_session() as session:
+            respondents = await self.mark_abandoned(session, datetime.utcfromtimestamp(idle_before))
+            await session.commit()
+        
+        report = ReapReport(fsm_records, fsm_bytes, cached_answers, respondents)
+        self.last_report = report
+        self.total = ReapReport(*(a + b for a, b in zip(self.total, report)))
+        logger.info(
+            "Уборка сессий: FSM-записей %d (%.1f КиБ), ответов из кэша %d, брошенных респондентов %d",
+            fsm_records, fsm_bytes / 1024, cached_answers, respondents
+        )
+        return report
+
+
+session_reaper = SessionReaper()
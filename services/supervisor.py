@@ -0,0 +1,326 @@
+"""Несколько процессов-обработчиков с разбиением обновлений по пользователю"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+Update = Dict[str, Any]
+
+TELEGRAM_API = "https://api.telegram.org"
+
+
+def update_user_id(update: Update) -> int:
+    """
+    Пользователь, к которому относится обновление
+    
+    Берётся from (сообщения, callback'и, inline), затем user (реакции,
+    голоса в опросах), затем чат. Обновления без пользователя и чата — 0.
+    """
+    for name, event in update.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        for field in ("from", "user"):
+            user = event.get(field)
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+        chat = event.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return 0
+
+
+def shard_of(user_id: int, count: int) -> int:
+    """Номер процесса, обслуживающего пользователя"""
+    return user_id % count
+
+
+# (номер, число) процессов-обработчиков; None — бот работает одним процессом
+current_worker: Optional[Tuple[int, int]] = None
+
+
+def set_current_worker(index: int, count: int):
+    """Запомнить, каким обработчиком из скольких является этот процесс"""
+    global current_worker
+    current_worker = (index, count)
+
+
+def owns_user(user_id: int) -> bool:
+    """Обслуживает ли этот процесс пользователя (в одном процессе — всегда)"""
+    return current_worker is None or shard_of(user_id, current_worker[1]) == current_worker[0]
+
+
+class Supervisor:
+    """
+    Запускает count процессов-обработчиков и раздаёт им обновления
+    
+    Все обновления одного пользователя попадают в один процесс, в порядке
+    поступления: его FSM-записи и кэши живут только там. Каждый процесс —
+    отдельный интерпретатор (spawn) со своими подключениями к БД.
+    
+    Обновления идут процессу через pipe: у него нет блокировки читателя,
+    которую упавший процесс унёс бы с собой (как у multiprocessing.Queue),
+    поэтому перезапущенный процесс читает тот же pipe с того же места.
+    Запись в pipe — в отдельном потоке, dispatch не блокируется, пока
+    процесс занят или перезапускается. Обновления, которые упавший
+    процесс уже прочитал, но не обработал, теряются.
+    
+    Очередь к каждому процессу ограничена max_backlog обновлениями.
+    Когда она полна (процесс не успевает или лежит), dispatch не ставит
+    обновление и возвращает False: поллинг ждёт и повторяет, вебхук
+    отвечает Telegram 503, и тот доставит обновление позже.
+    
+    Обновления, для которых broadcast(update) истинно (админ-команды над
+    состоянием процесса: кэши, метрики), получают все процессы — каждый
+    отвечает за себя.
+    
+    Если процесс падает сразу после старта, пауза перед перезапуском
+    растёт вдвое до max_restart_delay.
+    
+    target(index, count, connection) — точка входа процесса; должна
+    импортироваться по имени. Конец работы — None в pipe.
+    """
+    
+    def __init__(
+        self,
+        target: Callable[[int, int, Connection], None],
+        count: int,
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 60.0,
+        stable_after: float = 60.0,
+        max_backlog: int = 10000,
+        broadcast: Callable[[Update], bool] = None
+    ):
+        self.target = target
+        self.count = count
+        self.max_backlog = max_backlog
+        self.broadcast = broadcast
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_after = stable_after
+        self._context = multiprocessing.get_context("spawn")
+        self._pipes = [self._context.Pipe(duplex=False) for _ in range(count)]
+        self._outboxes: List["queue.Queue[Optional[Update]]"] = [queue.Queue(max_backlog) for _ in range(count)]
+        self._senders: List[threading.Thread] = []
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * count
+        self._started_at = [0.0] * count
+        self._failures = [0] * count
+        self._restart_at: Dict[int, float] = {}
+        self._watcher: Optional[asyncio.Task] = None
+        self.routed = [0] * count
+        self.rejected = [0] * count
+        self.restarts = 0
+    
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=self.target,
+            args=(index, self.count, self._pipes[index][0]),
+            name=f"bot-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info("Запущен обработчик %d (pid %s)", index, process.pid)
+    
+    def _send(self, index: int):
+        outbox, (_, writer) = self._outboxes[index], self._pipes[index]
+        while True:
+            update = outbox.get()
+            writer.send(update)
+            if update is None:
+                return
+    
+    def start(self):
+        """Запустить все процессы и слежение за ними"""
+        for index in range(self.count):
+            sender = threading.Thread(target=self._send, args=(index,), name=f"bot-worker-{index}-send", daemon=True)
+            sender.start()
+            self._senders.append(sender)
+            self._spawn(index)
+        self._watcher = asyncio.create_task(self._watch(), name="supervisor-watch")
+    
+    def dispatch(self, update: Update) -> bool:
+        """Передать обновление процессу его пользователя; False — очередь процесса полна"""
+        if self.broadcast is not None and self.broadcast(update):
+            # Хотя бы один процесс принял — повтор доставки продублировал бы команду в остальных
+            return any([self._put(index, update) for index in range(self.count)])
+        return self._put(shard_of(update_user_id(update), self.count), update)
+    
+    def _put(self, index: int, update: Update) -> bool:
+        try:
+            self._outboxes[index].put_nowait(update)
+        except queue.Full:
+            self.rejected[index] += 1
+            # Первое отклонение и дальше каждое тысячное — чтобы не залить лог
+            if self.rejected[index] % 1000 == 1:
+                logger.warning(
+                    "Очередь обработчика %d полна (%d обновлений), отклонено всего %d",
+                    index, self.max_backlog, self.rejected[index]
+                )
+            return False
+        self.routed[index] += 1
+        return True
+    
+    def check(self, now: float) -> List[int]:
+        """Перезапустить завершившиеся процессы, чья пауза истекла; вернуть их номера"""
+        restarted = []
+        for index, process in enumerate(self._processes):
+            if process is None or process.is_alive():
+                continue
+            
+            if index not in self._restart_at:
+                if now - self._started_at[index] < self.stable_after:
+                    self._failures[index] += 1
+                else:
+                    self._failures[index] = 1
+                delay = min(self.restart_delay * 2 ** (self._failures[index] - 1), self.max_restart_delay)
+                self._restart_at[index] = now + delay
+                logger.error(
+                    "Обработчик %d завершился с кодом %s, перезапуск через %.0f с",
+                    index, process.exitcode, delay
+                )
+            
+            if now >= self._restart_at[index]:
+                del self._restart_at[index]
+                self._spawn(index)
+                self.restarts += 1
+                restarted.append(index)
+        return restarted
+    
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(0.5)
+            self.check(time.monotonic())
+    
+    async def stop(self, timeout: float = 30.0):
+        """Дать процессам доработать очереди и остановить их"""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        for index, outbox in enumerate(self._outboxes):
+            try:
+                await loop.run_in_executor(None, outbox.put, None, True, max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                logger.warning("Очередь обработчика %d не разгрузилась, он будет остановлен", index)
+        
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Обработчик %d не завершился за %.0f с, останавливаем", index, timeout)
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+            self._processes[index] = None
+
+
+def _receive(connection: Connection, timeout: float):
+    if not connection.poll(timeout):
+        raise queue.Empty
+    return connection.recv()
+
+
+async def consume(
+    updates: Connection,
+    feed: Callable[[Update], Awaitable[None]],
+    max_concurrent: int = 64
+):
+    """
+    Обрабатывать обновления из pipe процесса-обработчика до None
+    
+    Обновления разных пользователей обрабатываются параллельно (не больше
+    max_concurrent), одного пользователя — строго по очереди. Если
+    супервизор исчез, обработчик тоже завершается.
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(max_concurrent)
+    tails: Dict[int, asyncio.Task] = {}
+    parent = multiprocessing.parent_process()
+    
+    async def run(user_id: int, update: Update, previous: Optional[asyncio.Task]):
+        try:
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            await feed(update)
+        except Exception:
+            logger.exception("Ошибка обработки обновления %s", update.get("update_id"))
+        finally:
+            slots.release()
+            if tails.get(user_id) is asyncio.current_task():
+                del tails[user_id]
+    
+    while True:
+        try:
+            update = await loop.run_in_executor(None, _receive, updates, 1.0)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                logger.error("Супервизор завершился, останавливаем обработчик")
+                break
+            continue
+        if update is None:
+            break
+        
+        await slots.acquire()
+        user_id = update_user_id(update)
+        tails[user_id] = asyncio.create_task(run(user_id, update, tails.get(user_id)))
+    
+    if tails:
+        await asyncio.gather(*tails.values(), return_exceptions=True)
+
+
+async def poll_updates(
+    token: str,
+    forward: Callable[[Update], Optional[bool]],
+    allowed_updates: List[str] = None,
+    timeout: int = 30
+):
+    """
+    Long polling без разбора обновлений в модели aiogram
+    
+    Супервизору нужен только user_id, поэтому ответ getUpdates разбирается
+    как обычный JSON, а модели строят процессы-обработчики. Если forward
+    вернул False (очередь обработчика полна), обновление повторяется после
+    паузы — следующие getUpdates ждут, пока очередь не разгрузится.
+    """
+    url = f"{TELEGRAM_API}/bot{token}/getUpdates"
+    params: Dict[str, Any] = {"timeout": timeout}
+    if allowed_updates is not None:
+        params["allowed_updates"] = allowed_updates
+    backoff = 1.0
+    
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout + 10)) as http:
+        while True:
+            try:
+                async with http.post(url, json=params) as response:
+                    payload = await response.json(loads=json.loads, content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning("Ошибка getUpdates: %r, повтор через %.0f с", e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            
+            if not payload.get("ok"):
+                retry_after = payload.get("parameters", {}).get("retry_after", backoff)
+                logger.warning("getUpdates: %s, повтор через %s с", payload.get("description"), retry_after)
+                await asyncio.sleep(retry_after)
+                backoff = min(backoff * 2, 60)
+                continue
+            
+            backoff = 1.0
+            for update in payload["result"]:
+                params["offset"] = update["update_id"] + 1
+                while forward(update) is False:
+                    await asyncio.sleep(0.1)
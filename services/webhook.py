@@ -0,0 +1,191 @@
+"""Приём обновлений через вебхук (встроенный aiohttp-сервер)"""
+import asyncio
+import logging
+import secrets
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука с ограничением числа одновременно обрабатываемых обновлений
+    
+    Telegram получает ответ сразу, обновление обрабатывается в фоне. Когда
+    заняты все max_concurrent слотов, ответ на новый запрос задерживается
+    до освобождения слота: Telegram не шлёт больше max_connections
+    запросов одновременно, так что очередь не растёт без предела.
+    Тело запроса, которое не JSON-объект, отклоняется с 400.
+    """
+    
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret_token: str = None,
+        max_concurrent: int = 64,
+        **data: Any
+    ):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.accepted = 0
+        self.rejected = 0
+        self.peak = 0
+    
+    @property
+    def in_flight(self) -> int:
+        """Сколько обновлений обрабатывается сейчас"""
+        return len(self._background_feed_update_tasks)
+    
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        try:
+            update: Dict[str, Any] = await request.json(loads=bot.session.json_loads)
+        except ValueError:
+            update = None
+        if not isinstance(update, dict):
+            self.rejected += 1
+            return web.Response(body="Bad Request", status=400)
+        
+        await self._slots.acquire()
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._release)
+        
+        self.accepted += 1
+        self.peak = max(self.peak, self.in_flight)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+    
+    def _release(self, task: asyncio.Task):
+        self._background_feed_update_tasks.discard(task)
+        self._slots.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Ошибка обработки обновления из вебхука", exc_info=task.exception())
+    
+    async def drain(self):
+        """Дождаться обработки уже принятых обновлений"""
+        while self._background_feed_update_tasks:
+            await asyncio.gather(*self._background_feed_update_tasks, return_exceptions=True)
+    
+    async def close(self) -> None:
+        # Сессию бота закрывает bot.py после остановки фоновых сервисов
+        await self.drain()
+
+
+WEBHOOK_HANDLER = web.AppKey("webhook_handler", BoundedRequestHandler)
+
+
+def create_webhook_app(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    path: str,
+    secret_token: str = None,
+    max_concurrent: int = 64
+) -> web.Application:
+    """aiohttp-приложение, принимающее обновления на path"""
+    app = web.Application()
+    handler = BoundedRequestHandler(
+        dispatcher, bot,
+        secret_token=secret_token,
+        max_concurrent=max_concurrent
+    )
+    handler.register(app, path=path)
+    setup_application(app, dispatcher, bot=bot)
+    app[WEBHOOK_HANDLER] = handler
+    return app
+
+
+def create_forwarding_app(
+    path: str,
+    forward: Callable[[Dict[str, Any]], Optional[bool]],
+    secret_token: str = None
+) -> web.Application:
+    """
+    aiohttp-приложение, которое только разбирает JSON и передаёт обновление в forward
+    
+    Используется супервизором: обработка идёт в процессах-обработчиках.
+    Если forward вернул False (очередь обработчика полна), ответ — 503:
+    Telegram повторит доставку позже.
+    """
+    async def handle(request: web.Request) -> web.Response:
+        if secret_token and not secrets.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret_token
+        ):
+            return web.Response(body="Unauthorized", status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            update = None
+        if not isinstance(update, dict):
+            return web.Response(body="Bad Request", status=400)
+        if forward(update) is False:
+            return web.Response(body="Service Unavailable", status=503)
+        return web.json_response({})
+    
+    app = web.Application()
+    app.router.add_post(path, handle)
+    return app
+
+
+async def serve(
+    app: web.Application,
+    bot: Bot,
+    host: str,
+    port: int,
+    path: str,
+    url: str = None,
+    secret_token: str = None,
+    allowed_updates: List[str] = None,
+    max_connections: int = 40
+):
+    """
+    Поднять сервер и работать до отмены
+    
+    Если задан url (внешний адрес сервера), вебхук регистрируется в
+    Telegram на url + path; иначе считается, что он уже настроен
+    (например, за обратным прокси).
+    """
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        logger.info("Вебхук слушает http://%s:%d%s", host, port, path)
+        
+        if url:
+            await bot.set_webhook(
+                url=url.rstrip("/") + path,
+                secret_token=secret_token,
+                allowed_updates=allowed_updates,
+                max_connections=max_connections
+            )
+            logger.info("Вебхук зарегистрирован в Telegram")
+        
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    host: str,
+    port: int,
+    path: str,
+    url: str = None,
+    secret_token: str = None,
+    max_concurrent: int = 64
+):
+    """Принимать обновления вебхуком и обрабатывать их в этом процессе"""
+    app = create_webhook_app(dispatcher, bot, path, secret_token, max_concurrent)
+    await serve(
+        app, bot, host, port, path,
+        url=url,
+        secret_token=secret_token,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+        max_connections=min(max_concurrent, 100)
+    )
@@ -0,0 +1,31 @@
+"""Общие фикстуры тестов: база в памяти со всеми таблицами"""
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+
+from models.database import Base
+
+
+@pytest.fixture
+async def test_engine():
+    """Создать тестовый движок БД в памяти со всеми таблицами"""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", echo=False)
+    
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    
+    yield engine
+    
+    await engine.dispose()
+
+
+@pytest.fixture
+def session_maker(test_engine):
+    """Фабрика сессий тестовой БД"""
+    return async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+@pytest.fixture
+async def test_session(session_maker):
+    """Сессия тестовой БД"""
+    async with session_maker() as session:
+        yield session
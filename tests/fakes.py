@@ -0,0 +1,107 @@
+"""Общие подделки для тестов и нагрузочного прогона: часы, сессия Bot API без сети, обновления"""
+import asyncio
+from typing import List, Optional, Tuple
+
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Update
+
+
+class FakeClock:
+    """
+    Управляемые часы: время двигает тест, присваивая now
+    
+    sleep не ждёт, а запоминает, когда задача бы проснулась; task_time
+    возвращает это время для текущей задачи.
+    """
+    
+    def __init__(self, now: float = 0.0):
+        self.now = now
+        self._woke = {}
+    
+    def __call__(self) -> float:
+        return self.now
+    
+    def task_time(self) -> float:
+        """Время для текущей задачи с учётом её ожиданий"""
+        return self._woke.get(asyncio.current_task(), self.now)
+    
+    async def sleep(self, delay: float):
+        self._woke[asyncio.current_task()] = self.now + delay
+        await asyncio.sleep(0)
+
+
+class RecordingSession(BaseSession):
+    """
+    Сессия без сети: запоминает запросы как (время, метод, chat_id)
+    
+    С часами каждый запрос «занимает» delay секунд и записывается со
+    временем задачи; retry_after — однократный отказ TelegramRetryAfter
+    на первый запрос.
+    """
+    
+    def __init__(self, clock: Optional[FakeClock] = None, delay: float = 0.0, retry_after: int = 0):
+        super().__init__()
+        self.clock = clock
+        self.delay = delay
+        self.retry_after = retry_after
+        self.requests: List[Tuple[Optional[float], str, Optional[int]]] = []
+    
+    async def make_request(self, bot, method, timeout=None):
+        if self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            raise TelegramRetryAfter(method=method, message="Flood control exceeded", retry_after=retry_after)
+        at = None
+        if self.clock is not None:
+            self.clock.now += self.delay
+            at = self.clock.task_time()
+        self.requests.append((at, type(method).__name__, getattr(method, "chat_id", None)))
+        return True
+    
+    @property
+    def sent(self) -> List[Tuple[str, Optional[int]]]:
+        """Вызванные методы с chat_id"""
+        return [(name, chat_id) for _, name, chat_id in self.requests]
+    
+    @property
+    def names(self) -> List[str]:
+        """Имена вызванных методов"""
+        return [name for _, name, _ in self.requests]
+    
+    @property
+    def times(self) -> List[Optional[float]]:
+        """Время отправки запросов по часам теста"""
+        return [at for at, _, _ in self.requests]
+    
+    async def close(self):
+        pass
+    
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+
+def message_update(update_id: int, text: str) -> Update:
+    """Обновление с текстовым сообщением от пользователя 1 в личном чате"""
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "from": {"id": 1, "is_bot": False, "first_name": "U"},
+            "chat": {"id": 1, "type": "private"},
+            "date": 0,
+            "text": text,
+        },
+    })
+
+
+def callback_update(update_id: int, data: str) -> Update:
+    """Обновление с нажатием кнопки пользователем 1"""
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": 1, "is_bot": False, "first_name": "U"},
+            "chat_instance": "1",
+            "data": data,
+        },
+    })
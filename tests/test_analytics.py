@@ -2,28 +2,10 @@
 import pytest
 import json
 from datetime import datetime
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from models.database import Base
 from models import Respondent, Answer
 from services.analytics import SurveyAnalytics
 
 
-# Фикстура для тестовой БД
-@pytest.fixture
-async def test_session():
-    """Создать тестовую сессию БД"""
-    engine = create_async_engine("sqlite+aiosqlite:///:memory:", echo=False)
-    async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-    
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    
-    async with async_session_maker() as session:
-        yield session
-    
-    await engine.dispose()
-
-
 @pytest.mark.asyncio
 async def test_get_total_respondents_empty(test_session):
     """Тест: пустая БД возвращает 0 респондентов"""
@@ -128,6 +110,142 @@ async def test_multi_answer_distribution(test_session):
     assert dist["Q9_OP1"] == 1
 
 
+@pytest.mark.asyncio
+async def test_all_distributions_single_scan(test_session):
+    """Тест: распределения по всем вопросам за один запрос"""
+    resp1 = Respondent(user_id=111, consented=True, completed=True, wave_id="w1")
+    resp2 = Respondent(user_id=222, consented=True, completed=True, wave_id="w1")
+    test_session.add_all([resp1, resp2])
+    await test_session.commit()
+    
+    test_session.add_all([
+        Answer(respondent_id=resp1.id, question_code="Q1", answer=json.dumps(["Q1_OP1", "Q1_OP2"])),
+        Answer(respondent_id=resp2.id, question_code="Q1", answer=json.dumps(["Q1_OP1"])),
+        Answer(respondent_id=resp1.id, question_code="Q3", answer="Q3_OP4"),
+        Answer(respondent_id=resp2.id, question_code="LQ2", answer="LQ2_OP1"),
+    ])
+    await test_session.commit()
+    
+    analytics = SurveyAnalytics(test_session)
+    distributions = await analytics.get_all_distributions()
+    
+    assert distributions == {
+        "Q1": {"Q1_OP1": 2, "Q1_OP2": 1},
+        "Q3": {"Q3_OP4": 1},
+        "LQ2": {"LQ2_OP1": 1},
+    }
+    
+    stats = await analytics.generate_detailed_stats()
+    assert "Насмешки над речью (акцент, произношение): 2 (100.0%)" in stats
+    assert "Да, часто: 1 (50.0%)" in stats
+
+
+@pytest.mark.asyncio
+async def test_aggregates_follow_completion_and_archive(test_session):
+    """Тест: агрегаты обновляются при завершении и архивации"""
+    resp1 = Respondent(user_id=111, consented=True, completed=True, wave_id="w1")
+    resp2 = Respondent(user_id=222, consented=True, completed=True, wave_id="w1")
+    test_session.add_all([resp1, resp2])
+    await test_session.commit()
+    
+    test_session.add_all([
+        Answer(respondent_id=resp1.id, question_code="Q1", answer=json.dumps(["Q1_OP1", "Q1_OP7:своё"])),
+        Answer(respondent_id=resp2.id, question_code="Q1", answer=json.dumps(["Q1_OP1"])),
+        Answer(respondent_id=resp2.id, question_code="Q3", answer="Q3_OP2"),
+    ])
+    await test_session.commit()
+    
+    analytics = SurveyAnalytics(test_session, use_aggregates=True)
+    await analytics.record_completion(resp1.id)
+    await analytics.record_completion(resp2.id)
+    await test_session.commit()
+    
+    assert await analytics.get_total_respondents() == 2
+    assert await analytics.get_total_respondents(wave_id="w1") == 2
+    assert await analytics.get_all_distributions() == {
+        "Q1": {"Q1_OP1": 2, "Q1_OP7:своё": 1},
+        "Q3": {"Q3_OP2": 1},
+    }
+    
+    # Архивация завершённого респондента
+    resp2.archived = True
+    await analytics.record_completion(resp2.id, delta=-1)
+    await test_session.commit()
+    
+    assert await analytics.get_total_respondents() == 1
+    assert await analytics.get_all_distributions() == {"Q1": {"Q1_OP1": 1, "Q1_OP7:своё": 1}}
+
+
+@pytest.mark.asyncio
+async def test_rebuild_aggregates(test_session):
+    """Тест: пересчёт агрегатов по исходным ответам"""
+    resp1 = Respondent(user_id=111, consented=True, completed=True, wave_id="w1")
+    resp2 = Respondent(user_id=222, consented=True, completed=True, wave_id="w2")
+    resp3 = Respondent(user_id=333, consented=True, completed=False, wave_id="w2")
+    test_session.add_all([resp1, resp2, resp3])
+    await test_session.commit()
+    
+    test_session.add_all([
+        Answer(respondent_id=resp1.id, question_code="Q5", answer="Q5_OP1"),
+        Answer(respondent_id=resp2.id, question_code="Q5", answer="Q5_OP1"),
+        Answer(respondent_id=resp3.id, question_code="Q5", answer="Q5_OP3"),
+    ])
+    await test_session.commit()
+    
+    analytics = SurveyAnalytics(test_session, use_aggregates=True)
+    assert await analytics.ensure_aggregates() is True
+    await test_session.commit()
+    assert await analytics.ensure_aggregates() is False
+    
+    assert await analytics.get_total_respondents() == 2
+    assert await analytics.get_all_distributions() == {"Q5": {"Q5_OP1": 2}}
+    assert await analytics.get_all_distributions(wave_id="w2") == {"Q5": {"Q5_OP1": 1}}
+    
+    # Повторный пересчёт не удваивает счётчики
+    await analytics.rebuild_aggregates()
+    await test_session.commit()
+    assert await analytics.get_question_distribution("Q5") == {"Q5_OP1": 2}
+
+
+@pytest.mark.asyncio
+async def test_aggregates_match_raw_distributions(test_session):
+    """Тест: с агрегатами и без распределения совпадают, включая опции с текстом"""
+    respondents = [
+        Respondent(user_id=111, consented=True, completed=True, wave_id="w1"),
+        Respondent(user_id=222, consented=True, completed=True, wave_id="w1"),
+        Respondent(user_id=333, consented=True, completed=True, wave_id="w2"),
+    ]
+    test_session.add_all(respondents)
+    await test_session.commit()
+    
+    answers = [
+        {"Q1": json.dumps(["Q1_OP1", "Q1_OP7:на перемене"]), "Q3": "Q3_OP7:не знаю"},
+        {"Q1": json.dumps(["Q1_OP7:в интернете"]), "Q3": "Q3_OP7:не знаю"},
+        {"Q1": json.dumps(["Q1_OP1", "Q1_OP7:на перемене"]), "Q3": "Q3_OP2"},
+    ]
+    test_session.add_all([
+        Answer(respondent_id=resp.id, question_code=code, answer=value)
+        for resp, values in zip(respondents, answers)
+        for code, value in values.items()
+    ])
+    await test_session.commit()
+    
+    raw = SurveyAnalytics(test_session)
+    aggregated = SurveyAnalytics(test_session, use_aggregates=True)
+    for resp in respondents:
+        await aggregated.record_completion(resp.id)
+    await test_session.commit()
+    
+    for wave_id in (None, "w1", "w2"):
+        assert await aggregated.get_all_distributions(wave_id) == await raw.get_all_distributions(wave_id)
+    assert (await raw.get_question_distribution("Q3"))["Q3_OP7:не знаю"] == 2
+    
+    await aggregated.rebuild_aggregates()
+    await test_session.commit()
+    for wave_id in (None, "w1", "w2"):
+        assert await aggregated.get_all_distributions(wave_id) == await raw.get_all_distributions(wave_id)
+
+
 @pytest.mark.asyncio
 async def test_export_csv_data(test_session):
     """Тест: экспорт данных в CSV формат"""
@@ -159,6 +277,89 @@ async def test_export_csv_data(test_session):
     assert csv_data[0]["Q4"] == "Q4_OP3"
 
 
+@pytest.mark.asyncio
+async def test_iter_export_rows_streams_in_chunks(test_session):
+    """Тест: потоковый экспорт pivot-запросом, порциями"""
+    respondents = [
+        Respondent(user_id=100 + i, consented=True, completed=True, wave_id="w1")
+        for i in range(3)
+    ]
+    respondents.append(Respondent(user_id=999, consented=True, completed=True, wave_id="w2"))
+    test_session.add_all(respondents)
+    await test_session.commit()
+    
+    multi_answer = json.dumps(["LQ1_OP1", "LQ1_OP6:другое"])
+    test_session.add_all([
+        Answer(respondent_id=respondents[0].id, question_code="Q1", answer="Q1_OP2"),
+        Answer(respondent_id=respondents[0].id, question_code="LQ1", answer=multi_answer),
+        Answer(respondent_id=respondents[1].id, question_code="Q3", answer="Q3_OP1"),
+    ])
+    await test_session.commit()
+    
+    analytics = SurveyAnalytics(test_session)
+    rows = [row async for row in analytics.iter_export_rows(wave_id="w1", chunk_size=1)]
+    
+    assert [row["user_id"] for row in rows] == [100, 101, 102]
+    assert rows[0]["Q1"] == "Q1_OP2"
+    assert rows[0]["LQ1"] == multi_answer
+    assert rows[1]["Q3"] == "Q3_OP1"
+    assert rows[2]["Q1"] == ""
+    assert rows[2]["completed_at"] == ""
+
+
+@pytest.mark.asyncio
+async def test_cross_tab_multi_select(test_session):
+    """Тест: кросс-таблица раскладывает мультивыбор на пары опций"""
+    resp1 = Respondent(user_id=111, consented=True, completed=True, wave_id="w1")
+    resp2 = Respondent(user_id=222, consented=True, completed=True, wave_id="w1")
+    resp3 = Respondent(user_id=333, consented=True, completed=False, wave_id="w1")
+    
+    test_session.add_all([resp1, resp2, resp3])
+    await test_session.commit()
+    
+    test_session.add_all([
+        Answer(respondent_id=resp1.id, question_code="Q1", answer=json.dumps(["Q1_OP1", "Q1_OP7:свой ответ"])),
+        Answer(respondent_id=resp1.id, question_code="Q3", answer="Q3_OP2"),
+        Answer(respondent_id=resp2.id, question_code="Q1", answer=json.dumps(["Q1_OP1"])),
+        Answer(respondent_id=resp2.id, question_code="Q3", answer="Q3_OP2"),
+        # Незавершённый респондент не учитывается
+        Answer(respondent_id=resp3.id, question_code="Q1", answer=json.dumps(["Q1_OP1"])),
+        Answer(respondent_id=resp3.id, question_code="Q3", answer="Q3_OP1"),
+    ])
+    await test_session.commit()
+    
+    analytics = SurveyAnalytics(test_session)
+    cross_tab = await analytics.get_cross_tab("Q1", "Q3")
+    
+    assert cross_tab == {
+        ("Q1_OP1", "Q3_OP2"): 2,
+        ("Q1_OP7", "Q3_OP2"): 1,
+    }
+
+
+@pytest.mark.asyncio
+async def test_cross_tab_wave_filter(test_session):
+    """Тест: кросс-таблица с фильтром по волне"""
+    resp1 = Respondent(user_id=111, consented=True, completed=True, wave_id="w1")
+    resp2 = Respondent(user_id=222, consented=True, completed=True, wave_id="w2")
+    
+    test_session.add_all([resp1, resp2])
+    await test_session.commit()
+    
+    test_session.add_all([
+        Answer(respondent_id=resp1.id, question_code="Q3", answer="Q3_OP1"),
+        Answer(respondent_id=resp1.id, question_code="Q5", answer="Q5_OP2"),
+        Answer(respondent_id=resp2.id, question_code="Q3", answer="Q3_OP4"),
+        Answer(respondent_id=resp2.id, question_code="Q5", answer="Q5_OP5"),
+    ])
+    await test_session.commit()
+    
+    analytics = SurveyAnalytics(test_session)
+    
+    assert await analytics.get_cross_tab("Q3", "Q5", wave_id="w2") == {("Q3_OP4", "Q5_OP5"): 1}
+    assert len(await analytics.get_cross_tab("Q3", "Q5")) == 2
+
+
 @pytest.mark.asyncio
 async def test_generate_stats_text_empty(test_session):
     """Тест: генерация статистики для пустой БД"""
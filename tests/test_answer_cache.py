@@ -0,0 +1,57 @@
+"""Тесты для кэша ответов"""
+import pytest
+from services.answer_cache import AnswerCache
+from tests.fakes import FakeClock
+
+
+def test_write_through_and_hits():
+    """Тест: ответы обновляются в кэше без перечитывания"""
+    cache = AnswerCache()
+    
+    assert cache.get(1) is None
+    cache.put(1, {})
+    cache.set_answer(1, "Q1", '["Q1_OP1"]')
+    cache.set_answer(1, "Q2", "Q2_OP3")
+    
+    assert cache.get(1) == {"Q1": '["Q1_OP1"]', "Q2": "Q2_OP3"}
+    assert cache.hits == 1
+    assert cache.misses == 1
+    
+    # Если респондента нет в кэше, частичная запись не создаёт неполную запись
+    cache.set_answer(2, "Q1", "Q1_OP2")
+    assert cache.get(2) is None
+
+
+def test_lru_bound():
+    """Тест: размер ограничен, вытесняется давно не использованный"""
+    cache = AnswerCache(max_respondents=2)
+    cache.put(1, {"Q1": "a"})
+    cache.put(2, {"Q1": "b"})
+    cache.get(1)
+    cache.put(3, {"Q1": "c"})
+    
+    assert len(cache) == 2
+    assert cache.get(2) is None
+    assert cache.get(1) == {"Q1": "a"}
+
+
+def test_idle_eviction():
+    """Тест: записи без обращений дольше idle_ttl вытесняются"""
+    clock = FakeClock()
+    cache = AnswerCache(idle_ttl=60, clock=clock)
+    cache.put(1, {"Q1": "a"})
+    
+    clock.now = 30
+    cache.put(2, {"Q1": "b"})
+    
+    clock.now = 70
+    assert cache.get(1) is None
+    assert cache.get(2) == {"Q1": "b"}
+    
+    clock.now = 200
+    cache.put(3, {})
+    assert len(cache) == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,154 @@
+"""Тесты для матрицы ответов"""
+import asyncio
+import pytest
+import json
+from datetime import datetime, timedelta
+from models import Respondent, Answer
+from services.analytics import SurveyAnalytics
+from services import answer_matrix
+from services.answer_matrix import get_answer_matrix
+
+
+@pytest.fixture(autouse=True)
+def reset_matrices():
+    """Матрицы общие для модуля: каждый тест начинает с пустого кэша"""
+    answer_matrix.reset_answer_matrices()
+
+
+async def add_completed(session, user_id, answers, completed_at, wave_id="w1"):
+    """Добавить завершённого респондента и учесть его в агрегатах"""
+    resp = Respondent(user_id=user_id, consented=True, completed=True, wave_id=wave_id, completed_at=completed_at)
+    session.add(resp)
+    await session.commit()
+    
+    session.add_all([
+        Answer(respondent_id=resp.id, question_code=code, answer=value)
+        for code, value in answers.items()
+    ])
+    await session.commit()
+    
+    await SurveyAnalytics(session).record_completion(resp.id)
+    await session.commit()
+    return resp
+
+
+@pytest.mark.asyncio
+async def test_matrix_matches_sql(test_session):
+    """Тест: матрица даёт те же распределения и кросс-таблицы, что и SQL"""
+    start = datetime(2025, 11, 11, 12, 0, 0)
+    await add_completed(test_session, 111, {
+        "Q1": json.dumps(["Q1_OP1", "Q1_OP2", "Q1_OP7:другое"]),
+        "Q3": "Q3_OP2",
+    }, start)
+    await add_completed(test_session, 222, {
+        "Q1": json.dumps(["Q1_OP1"]),
+        "Q3": "Q3_OP1",
+    }, start + timedelta(minutes=1))
+    await add_completed(test_session, 333, {}, start + timedelta(minutes=2))
+    
+    matrix = await get_answer_matrix(test_session)
+    analytics = SurveyAnalytics(test_session, use_aggregates=True)
+    
+    assert matrix.size == 3
+    # Столбцы матрицы — коды опций: текст «Другое» не различается
+    assert matrix.distribution("Q1") == {"Q1_OP1": 2, "Q1_OP2": 1, "Q1_OP7": 1}
+    assert matrix.cross_tab("Q1", "Q3") == await analytics.get_cross_tab("Q1", "Q3")
+    assert matrix.co_occurrence("Q1") == {
+        ("Q1_OP1", "Q1_OP2"): 1,
+        ("Q1_OP1", "Q1_OP7"): 1,
+        ("Q1_OP2", "Q1_OP7"): 1,
+    }
+    
+    # Подгруппа: выбравшие Q1_OP2
+    assert matrix.distribution("Q3", mask=matrix.mask("Q1_OP2")) == {"Q3_OP2": 1}
+
+
+@pytest.mark.asyncio
+async def test_matrix_updates_in_place(test_session):
+    """Тест: новые завершения догружаются в кэшированную матрицу"""
+    start = datetime(2025, 11, 11, 12, 0, 0)
+    await add_completed(test_session, 111, {"Q5": "Q5_OP1"}, start)
+    
+    matrix = await get_answer_matrix(test_session)
+    assert matrix.distribution("Q5") == {"Q5_OP1": 1}
+    
+    await add_completed(test_session, 222, {"Q5": "Q5_OP3"}, start + timedelta(minutes=5))
+    
+    updated = await get_answer_matrix(test_session)
+    assert updated is matrix
+    assert matrix.distribution("Q5") == {"Q5_OP1": 1, "Q5_OP3": 1}
+    
+    # Архивация меняет wave_totals — строка респондента убирается на месте
+    resp = await test_session.get(Respondent, 1)
+    resp.archived = True
+    await SurveyAnalytics(test_session).record_completion(resp.id, delta=-1)
+    await test_session.commit()
+    
+    reconciled = await get_answer_matrix(test_session)
+    assert reconciled is matrix
+    assert matrix.size == 1
+    assert matrix.distribution("Q5") == {"Q5_OP3": 1}
+    
+    # Завершение с completed_at раньше уже загруженных догружается по id
+    await add_completed(test_session, 333, {"Q5": "Q5_OP2"}, start - timedelta(days=1))
+    assert await get_answer_matrix(test_session) is matrix
+    assert matrix.distribution("Q5") == {"Q5_OP2": 1, "Q5_OP3": 1}
+    assert not answer_matrix._locks
+
+
+def test_add_and_remove_rows():
+    """Тест: опции раскладываются по столбцам, неизвестные коды пропускаются, удаление сдвигает строки"""
+    matrix = answer_matrix.AnswerMatrix(capacity=1)
+    matrix.add([10, 20, 30], ["Q1_OP1,Q1_OP3", None, "Q1_OP3,Q9_OP1"])
+    matrix.add([20], ["Q1_OP2"])
+    
+    assert matrix.size == 3
+    assert matrix.distribution("Q1") == {"Q1_OP1": 1, "Q1_OP2": 1, "Q1_OP3": 2}
+    
+    matrix.remove([10, 99])
+    assert matrix.size == 2
+    assert sorted(matrix.row_index) == [20, 30]
+    assert matrix.distribution("Q1") == {"Q1_OP2": 1, "Q1_OP3": 1}
+    assert matrix.distribution("Q1", mask=matrix.mask("Q1_OP2")) == {"Q1_OP2": 1}
+
+
+@pytest.mark.asyncio
+async def test_matrix_cache_is_bounded(test_session, monkeypatch):
+    """Тест: кэш матриц хранит не больше MAX_CACHED_MATRICES волн, пустые не кэширует"""
+    monkeypatch.setattr(answer_matrix, "MAX_CACHED_MATRICES", 2)
+    start = datetime(2025, 11, 11, 12, 0, 0)
+    for i, wave_id in enumerate(["w1", "w2", "w3"]):
+        await add_completed(test_session, 100 + i, {"Q5": "Q5_OP1"}, start, wave_id=wave_id)
+    
+    w1 = await get_answer_matrix(test_session, "w1")
+    await get_answer_matrix(test_session, "w2")
+    assert await get_answer_matrix(test_session, "w1") is w1
+    await get_answer_matrix(test_session, "w3")
+    assert list(answer_matrix._matrices) == ["w1", "w3"]
+    
+    empty = await get_answer_matrix(test_session, "no_such_wave")
+    assert empty.size == 0
+    assert list(answer_matrix._matrices) == ["w1", "w3"]
+
+
+@pytest.mark.asyncio
+async def test_wave_locks_are_independent(test_session, session_maker, monkeypatch):
+    """Тест: сборка одной волны не держит другие; фоновая сборка кладёт матрицу в кэш"""
+    start = datetime(2025, 11, 11, 12, 0, 0)
+    await add_completed(test_session, 111, {"Q5": "Q5_OP1"}, start, wave_id="w1")
+    await add_completed(test_session, 222, {"Q5": "Q5_OP2"}, start, wave_id="w2")
+    
+    async with answer_matrix._wave_lock("w1"):
+        matrix = await asyncio.wait_for(get_answer_matrix(test_session, "w2"), 1)
+        assert matrix.distribution("Q5") == {"Q5_OP2": 1}
+    
+    monkeypatch.setattr(answer_matrix.database, "reader_session_maker", session_maker)
+    assert not answer_matrix.is_answer_matrix_cached("w1")
+    answer_matrix.warm_answer_matrix("w1")
+    await asyncio.gather(*answer_matrix._warming.values())
+    assert answer_matrix.is_answer_matrix_cached("w1")
+    assert not answer_matrix._warming
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,177 @@
+"""Тесты для фоновой записи ответов"""
+import pytest
+import asyncio
+import json
+import os
+from sqlalchemy import select
+from models import Respondent, Answer, WaveTotal
+from services.answer_cache import answer_cache
+from services.answer_writer import AnswerWriter
+
+
+@pytest.fixture
+async def session_maker(session_maker):
+    """Фабрика сессий тестовой БД с двумя респондентами"""
+    async with session_maker() as session:
+        session.add_all([Respondent(id=1, user_id=111), Respondent(id=2, user_id=222)])
+        await session.commit()
+    
+    return session_maker
+
+
+async def get_answers(session_maker, respondent_id):
+    async with session_maker() as session:
+        result = await session.execute(
+            select(Answer.question_code, Answer.answer).where(Answer.respondent_id == respondent_id)
+        )
+        return dict(result.all())
+
+
+@pytest.mark.asyncio
+async def test_group_commit(session_maker):
+    """Тест: операции, пришедшие вместе, пишутся одной транзакцией"""
+    writer = AnswerWriter(session_maker, max_batch=50, max_delay=0.05)
+    await writer.start()
+    
+    await asyncio.gather(*[
+        writer.save_answer(1 + i % 2, f"Q{i // 2 + 1}", f"Q{i // 2 + 1}_OP1")
+        for i in range(10)
+    ])
+    await writer.wait_for(1)
+    await writer.wait_for(2)
+    
+    assert writer.operations == 10
+    assert writer.batches == 1
+    assert len(await get_answers(session_maker, 1)) == 5
+    
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_complete_after_answers_and_drain(session_maker):
+    """Тест: завершение видит ответы из той же очереди, stop дописывает очередь"""
+    writer = AnswerWriter(session_maker, max_batch=2, max_delay=0.001)
+    await writer.start()
+    
+    await writer.save_answer(1, "Q1", json.dumps(["Q1_OP1", "Q1_OP2"]))
+    await writer.save_answer(1, "Q3", "Q3_OP2")
+    await writer.save_answer(1, "Q3", "Q3_OP4")
+    await writer.complete_respondent(1)
+    await writer.stop()
+    
+    assert not writer.running
+    assert await get_answers(session_maker, 1) == {
+        "Q1": json.dumps(["Q1_OP1", "Q1_OP2"]),
+        "Q3": "Q3_OP4",
+    }
+    
+    async with session_maker() as session:
+        respondent = await session.get(Respondent, 1)
+        total = await session.get(WaveTotal, respondent.wave_id)
+        assert respondent.completed
+        assert total.respondents == 1
+
+
+@pytest.mark.asyncio
+async def test_backpressure(session_maker):
+    """Тест: при заполненной очереди постановка ждёт писателя"""
+    writer = AnswerWriter(session_maker, max_batch=1, max_delay=0, max_backlog=1)
+    await writer.start()
+    
+    for i in range(1, 6):
+        await writer.save_answer(2, f"LQ{i}", f"LQ{i}_OP1")
+        assert writer.backlog <= 1
+    
+    await writer.wait_for(2)
+    assert len(await get_answers(session_maker, 2)) == 5
+    
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_not_started_writes_immediately(session_maker):
+    """Тест: без запущенного писателя запись выполняется сразу"""
+    writer = AnswerWriter(session_maker)
+    
+    await writer.save_answer(1, "Q5", "Q5_OP3")
+    
+    assert await get_answers(session_maker, 1) == {"Q5": "Q5_OP3"}
+
+
+@pytest.mark.asyncio
+async def test_failed_write_evicts_cache(session_maker):
+    """Тест: при ошибке фоновой записи респондент вытесняется из кэша ответов"""
+    writer = AnswerWriter(session_maker, max_batch=10, max_delay=0.001)
+    await writer.start()
+    answer_cache.put(1, {"Q1": "Q1_OP1"})
+    answer_cache.put(2, {"Q1": "Q1_OP2"})
+    
+    async def failing(session):
+        raise RuntimeError("диск полон")
+    
+    await writer._submit(1, failing)
+    await writer.save_answer(2, "Q3", "Q3_OP1")
+    await writer.wait_for(1)
+    await writer.wait_for(2)
+    
+    assert answer_cache.get(1) is None
+    assert answer_cache.get(2) == {"Q1": "Q1_OP2"}
+    assert await get_answers(session_maker, 2) == {"Q3": "Q3_OP1"}
+    
+    await writer.stop()
+    answer_cache.evict(2)
+
+
+@pytest.mark.asyncio
+async def test_wait_for_does_not_hang_when_writer_dies(session_maker):
+    """Тест: если задача писателя упала, wait_for не ждёт вечно"""
+    writer = AnswerWriter(session_maker, max_batch=1, max_delay=0)
+    
+    async def crash(batch):
+        raise RuntimeError("писатель упал")
+    
+    writer._apply = crash
+    await writer.start()
+    answer_cache.put(1, {"Q1": "Q1_OP1"})
+    
+    await writer.save_answer(1, "Q3", "Q3_OP1")
+    await writer.save_answer(2, "Q3", "Q3_OP1")
+    await asyncio.wait_for(writer.wait_for(1), 1)
+    await asyncio.wait_for(writer.wait_for(2), 1)
+    
+    assert not writer.running
+    assert answer_cache.get(1) is None
+    assert writer.backlog == 0
+
+
+@pytest.mark.asyncio
+async def test_cache_miss_reads_through_reader(session_maker, monkeypatch):
+    """Тест: при промахе кэша ответы читаются через читателя после записи очереди"""
+    os.environ.setdefault("BOT_TOKEN", "42:TEST")
+    from handlers import survey
+    
+    writer = AnswerWriter(session_maker, max_batch=50, max_delay=0.05)
+    await writer.start()
+    reads = []
+    
+    async def reader_session():
+        reads.append(writer.backlog)
+        async with session_maker() as session:
+            yield session
+    
+    monkeypatch.setattr(survey, "answer_writer", writer)
+    monkeypatch.setattr(survey, "get_reader_session", reader_session)
+    
+    await writer.save_answer(1, "Q1", '["Q1_OP1"]')
+    await writer.save_answer(1, "Q3", "Q3_OP2")
+    answer_cache.evict(1)
+    
+    assert await survey.get_answers_dict(1) == {"Q1": '["Q1_OP1"]', "Q3": "Q3_OP2"}
+    assert reads == [0]
+    
+    await writer.stop()
+    answer_cache.evict(1)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
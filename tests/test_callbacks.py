@@ -0,0 +1,48 @@
+"""Тесты для компактных callback_data опроса"""
+from keyboards import get_question_keyboard, get_navigation_keyboard
+from utils.callbacks import SurveyCallback, decode, answer_data, toggle_data, done_data
+from utils.questions import QUESTIONNAIRE
+
+
+def test_keyboard_callbacks_round_trip():
+    """Тест: каждая кнопка опроса разбирается в свой вопрос и опцию"""
+    for q in QUESTIONNAIRE.questions:
+        multi = q["type"] == "multi"
+        keyboard = get_question_keyboard(q["options"], q["code"], multi_select=multi, selected=[q["options"][0]["code"]])
+        
+        rows = keyboard.inline_keyboard
+        for option, row in zip(q["options"], rows):
+            data = row[0].callback_data
+            assert len(data) <= 4
+            assert decode(data) == SurveyCallback("t" if multi else "a", q["code"], option["code"])
+        
+        if multi:
+            assert decode(rows[-1][0].callback_data) == SurveyCallback("d", q["code"])
+
+
+def test_legacy_and_forged_data():
+    """Тест: прежний формат понимается, чужие и поддельные данные отбрасываются"""
+    assert decode("toggle_LQ10_LQ10_OP8") == decode(toggle_data("LQ10_OP8"))
+    assert decode("answer_Q3_Q3_OP2") == SurveyCallback("a", "Q3", "Q3_OP2")
+    assert decode("multi_done_Q2") == SurveyCallback("d", "Q2")
+    assert decode("nav_back_3") == SurveyCallback("b")
+    
+    for forged in ("answer_Q3_Q1_OP1", "t9999", "a-1", "toggle_", "consent_yes", "", None):
+        assert decode(forged) is None
+    
+    keyboard = get_navigation_keyboard(2, 10, can_skip=True)
+    assert [decode(button.callback_data).action for button in keyboard.inline_keyboard[0]] == ["b", "s"]
+
+
+def test_actions_match_question_type():
+    """Тест: тоггл и «Готово» одиночного вопроса и ответ на мультивыбор отбрасываются"""
+    assert QUESTIONNAIRE.question("Q3")["type"] == "single"
+    assert QUESTIONNAIRE.question("Q1")["type"] == "multi"
+    
+    for forged in (toggle_data("Q3_OP1"), done_data("Q3"), "toggle_Q3_Q3_OP1", "multi_done_Q3",
+                   answer_data("Q1_OP1"), "answer_Q1_Q1_OP1"):
+        assert decode(forged) is None, forged
+    
+    for q in QUESTIONNAIRE.questions:
+        actions = {decode(answer_data(o["code"])) is not None for o in q["options"]}
+        assert actions == {q["type"] == "single"}
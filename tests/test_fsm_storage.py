@@ -0,0 +1,118 @@
+"""Тесты для SQLite-хранилища FSM"""
+import asyncio
+import sqlite3
+import pytest
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+from services.fsm_storage import SQLiteStorage
+
+
+class SurveyFSM(StatesGroup):
+    Q1 = State()
+    LQ3 = State()
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def stored_keys(path) -> list:
+    with sqlite3.connect(path) as conn:
+        return [row[0] for row in conn.execute("SELECT key FROM fsm_records ORDER BY key")]
+
+
+@pytest.mark.asyncio
+async def test_survives_restart(tmp_path):
+    """Тест: состояние и данные опроса переживают перезапуск"""
+    path = str(tmp_path / "fsm.db")
+    storage = SQLiteStorage(path)
+    await storage.set_state(key(1), SurveyFSM.LQ3)
+    await storage.update_data(key(1), {"respondent_id": 7, "selected_options": ["LQ3_OP1"]})
+    await storage.close()
+    
+    storage = SQLiteStorage(path)
+    assert await storage.get_state(key(1)) == SurveyFSM.LQ3.state
+    assert await storage.get_data(key(1)) == {"respondent_id": 7, "selected_options": ["LQ3_OP1"]}
+    assert await storage.get_state(key(2)) is None
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_dirty_writes_are_batched(tmp_path):
+    """Тест: изменения за интервал сбрасываются одной транзакцией"""
+    path = str(tmp_path / "fsm.db")
+    storage = SQLiteStorage(path, flush_interval=0.02)
+    
+    for user_id in range(1, 6):
+        await storage.set_data(key(user_id), {"respondent_id": user_id})
+        await storage.set_state(key(user_id), SurveyFSM.Q1)
+    assert storage.flushes == 0
+    
+    await asyncio.sleep(0.1)
+    assert storage.flushes == 1
+    assert len(stored_keys(path)) == 5
+    
+    # Очищенное состояние удаляется из файла
+    await storage.set_state(key(1), None)
+    await storage.set_data(key(1), {})
+    await storage.close()
+    assert len(stored_keys(path)) == 4
+
+
+@pytest.mark.asyncio
+async def test_memory_is_bounded(tmp_path):
+    """Тест: в памяти не больше max_keys, вытесненные читаются без потерь"""
+    path = str(tmp_path / "fsm.db")
+    storage = SQLiteStorage(path, max_keys=3, flush_interval=60)
+    
+    for user_id in range(1, 11):
+        await storage.set_data(key(user_id), {"step": 1})
+    await storage.flush()
+    
+    # Изменение вытесненного ключа до сброса не откатывается чтением из файла
+    await storage.set_data(key(1), {"step": 2})
+    for user_id in range(2, 11):
+        await storage.get_data(key(user_id))
+    
+    assert len(storage._cache) == 3
+    assert await storage.get_data(key(1)) == {"step": 2}
+    assert await storage.get_data(key(5)) == {"step": 1}
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_evicted_key_readable_during_flush(tmp_path):
+    """Тест: ключ, вытесненный из LRU во время записи пачки, не откатывается к файлу"""
+    path = str(tmp_path / "fsm.db")
+    storage = SQLiteStorage(path, max_keys=1, flush_interval=60)
+    await storage.set_data(key(1), {"step": 1})
+    await storage.flush()
+    await storage.set_data(key(1), {"step": 2})
+    
+    db = await storage._connection()
+    commit = db.commit
+    released = asyncio.Event()
+    
+    async def slow_commit():
+        await released.wait()
+        await commit()
+    
+    db.commit = slow_commit
+    flush = asyncio.create_task(storage.flush())
+    try:
+        await asyncio.sleep(0.05)
+        assert not flush.done()
+        
+        # Ключ 1 вытеснен: его нет ни в LRU, ни в очереди грязных
+        await storage.get_data(key(2))
+        assert await storage.get_data(key(1)) == {"step": 2}
+        
+        released.set()
+        await flush
+        assert await storage.get_data(key(1)) == {"step": 2}
+        assert storage._flushing == []
+    finally:
+        released.set()
+        db.commit = commit
+        await storage.close()
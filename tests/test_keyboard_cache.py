@@ -0,0 +1,55 @@
+"""Тесты для кэша клавиатур"""
+import pytest
+from keyboards import get_question_keyboard, get_main_menu_keyboard
+from keyboards.cache import KeyboardCache, keyboard_cache
+from utils.callbacks import done_data
+from utils.questions import QUESTIONNAIRE
+
+
+def test_lru_eviction():
+    """Тест: при переполнении вытесняется давно не использованная клавиатура"""
+    cache = KeyboardCache(max_size=2)
+    built = []
+    
+    def build(key):
+        built.append(key)
+        return key
+    
+    cache.get_or_build("a", lambda: build("a"))
+    cache.get_or_build("b", lambda: build("b"))
+    cache.get_or_build("a", lambda: build("a"))
+    cache.get_or_build("c", lambda: build("c"))
+    cache.get_or_build("b", lambda: build("b"))
+    
+    assert built == ["a", "b", "c", "b"]
+    assert (cache.hits, cache.misses) == (1, 4)
+    assert len(cache) == 2
+
+
+def test_toggle_keyboards_are_reused():
+    """Тест: повторный набор выбранных опций не пересобирает клавиатуру"""
+    keyboard_cache.clear()
+    options = QUESTIONNAIRE.question("Q1")["options"]
+    
+    first = get_question_keyboard(options, "Q1", multi_select=True, selected=["Q1_OP1", "Q1_OP3"])
+    again = get_question_keyboard(options, "Q1", multi_select=True, selected=["Q1_OP3", "Q1_OP1"])
+    other = get_question_keyboard(options, "Q1", multi_select=True, selected=["Q1_OP1"])
+    
+    assert again is first
+    assert other is not first
+    assert first.inline_keyboard[0][0].text.startswith("✅ ")
+    assert first.inline_keyboard[-1][0].callback_data == done_data("Q1")
+    assert (keyboard_cache.hits, keyboard_cache.misses) == (1, 2)
+
+
+def test_static_keyboards_cached_per_language():
+    """Тест: статические клавиатуры кэшируются по языку"""
+    keyboard_cache.clear()
+    
+    assert get_main_menu_keyboard("ru") is get_main_menu_keyboard(lang="ru")
+    assert get_main_menu_keyboard().inline_keyboard[0][0].callback_data == "get_help"
+    assert keyboard_cache.misses == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,137 @@
+"""Тесты метрик задержек обработчиков"""
+import pytest
+from aiogram import Bot, Dispatcher, Router, F
+from aiogram.types import CallbackQuery
+from sqlalchemy import text
+
+from models.database import create_engines
+from middlewares import LatencyMiddleware, ApiTimer
+from middlewares.latency import HandlerStats, BUCKET_BOUNDS, _bucket
+from utils.callbacks import SurveyCallbackFilter, BACK, toggle_data
+from tests.fakes import FakeClock, RecordingSession, message_update, callback_update
+
+
+def test_bucket_bounds():
+    """Задержка попадает в первую корзину, чья граница не меньше неё"""
+    assert _bucket(0) == 0
+    assert _bucket(0.001) == 0
+    assert _bucket(0.00101) == 1
+    assert _bucket(1000) == len(BUCKET_BOUNDS) - 1
+    for i, bound in enumerate(BUCKET_BOUNDS[:-1]):
+        assert _bucket(bound) == i
+
+
+def test_percentiles_and_windows():
+    """Квантили считаются по корзинам, старые интервалы выпадают из окон"""
+    stats = HandlerStats()
+    now = 36000.0
+    # 90 быстрых вызовов 10 минут назад, 10 медленных сейчас
+    for _ in range(90):
+        stats.record(now - 600, 0.002, 0.001, 1, 0.0, False)
+    for _ in range(10):
+        stats.record(now, 0.5, 0.0, 0, 0.4, True)
+    
+    recent = stats.window(now, 1)
+    assert recent.count == 10 and recent.errors == 10
+    assert 0.5 <= recent.p50 < 0.5 * 1.25
+    assert recent.api == pytest.approx(0.4)
+    
+    hour = stats.window(now, 60)
+    assert hour.count == 100 and hour.errors == 10
+    assert 0.002 <= hour.p50 < 0.002 * 1.25
+    assert 0.5 <= hour.p95 < 0.5 * 1.25
+    assert hour.db == pytest.approx(0.0009)
+    assert hour.queries == pytest.approx(0.9)
+    
+    # Через час ничего не осталось, хотя память не освобождалась
+    assert stats.window(now + 3600, 60).count == 0
+
+
+def test_ring_reuses_slots():
+    """Интервал часовой давности перезаписывается, а не накапливается"""
+    stats = HandlerStats()
+    stats.record(0, 0.01, 0, 0, 0, False)
+    stats.record(3600, 0.01, 0, 0, 0, False)
+    assert stats.window(3600, 60).count == 1
+
+
+@pytest.mark.asyncio
+async def test_middleware_records_handler_and_api_time():
+    """Middleware видит выбранный обработчик и время его запросов к API; служебные пропускает"""
+    clock = FakeClock(1000.0)
+    tracker = LatencyMiddleware(clock=clock)
+    session = RecordingSession(clock, delay=0.25)
+    session.middleware(ApiTimer())
+    bot = Bot("42:TEST", session=session)
+    
+    router = Router()
+    
+    @router.message(F.text == "ping")
+    async def ping(message):
+        await message.answer("pong")
+    
+    @router.message(F.text == "fail")
+    async def fail(message):
+        raise RuntimeError("boom")
+    
+    @router.message(F.text == "profile", flags={"latency": False})
+    async def service(message):
+        await message.answer("ok")
+    
+    dp = Dispatcher()
+    dp.message.middleware(tracker)
+    dp.include_router(router)
+    
+    await dp.feed_update(bot, message_update(1, "ping"))
+    with pytest.raises(RuntimeError):
+        await dp.feed_update(bot, message_update(2, "fail"))
+    await dp.feed_update(bot, message_update(3, "profile"))
+    
+    report = tracker.report()
+    assert set(report) == {"ping", "fail"}
+    assert report["ping"][1].count == 1
+    assert 0.25 <= report["ping"][1].p50 < 0.25 * 1.25
+    assert report["fail"][5].errors == 1
+
+
+@pytest.mark.asyncio
+async def test_db_queries_are_attributed():
+    """Запросы к БД внутри обработчика попадают в его статистику"""
+    engine, reader = create_engines("sqlite+aiosqlite:///:memory:", profile="default")
+    tracker = LatencyMiddleware()
+    
+    async def handler(event, data):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await conn.execute(text("SELECT 2"))
+    
+    await tracker(handler, None, {})
+    stats = tracker.report()["unknown"][1]
+    assert stats.queries == 2
+    assert stats.db > 0
+    await engine.dispose()
+    await reader.dispose()
+
+
+@pytest.mark.asyncio
+async def test_survey_callbacks_are_split_by_action():
+    """Кнопки опроса через одну точку входа считаются по действиям"""
+    tracker = LatencyMiddleware()
+    router = Router()
+    
+    @router.callback_query(SurveyCallbackFilter())
+    async def handle_survey_callback(callback: CallbackQuery, survey_callback):
+        pass
+    
+    dp = Dispatcher()
+    dp.callback_query.middleware(tracker)
+    dp.include_router(router)
+    bot = Bot("42:TEST")
+    
+    await dp.feed_update(bot, callback_update(1, toggle_data("Q1_OP1")))
+    await dp.feed_update(bot, callback_update(2, toggle_data("Q1_OP2")))
+    await dp.feed_update(bot, callback_update(3, BACK))
+    
+    report = tracker.report()
+    assert report["handle_survey_callback:toggle"][1].count == 2
+    assert report["handle_survey_callback:back"][1].count == 1
@@ -0,0 +1,168 @@
+"""Тесты для склейки правок клавиатуры"""
+import asyncio
+import os
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import EditMessageReplyMarkup
+from aiogram.types import CallbackQuery
+
+from keyboards import get_question_keyboard
+from services.answer_cache import answer_cache
+from services.markup_debouncer import MarkupDebouncer, markup_debouncer
+from utils.callbacks import decode, toggle_data, BACK
+from utils.questions import QUESTIONNAIRE
+from tests.fakes import RecordingSession
+
+# handlers читает токен из окружения при импорте
+os.environ.setdefault("BOT_TOKEN", "42:TEST")
+
+from handlers.survey import handle_survey_callback
+
+OPTIONS = QUESTIONNAIRE.question("Q1")["options"]
+
+
+def keyboard(*selected):
+    return get_question_keyboard(OPTIONS, "Q1", multi_select=True, selected=list(selected))
+
+
+class FakeMessage:
+    """Сообщение, запоминающее отправленные правки"""
+    
+    def __init__(self, fail_with=None):
+        self.edits = []
+        self.fail_with = list(fail_with or [])
+    
+    async def edit(self, markup):
+        if self.fail_with:
+            raise self.fail_with.pop(0)
+        self.edits.append(markup)
+
+
+async def settle(debouncer):
+    while len(debouncer):
+        await asyncio.sleep(0.005)
+
+
+@pytest.mark.asyncio
+async def test_burst_sends_only_latest_state():
+    """Тест: серия кликов даёт одну правку с последним состоянием"""
+    debouncer = MarkupDebouncer(delay=0.02)
+    message = FakeMessage()
+    
+    debouncer.schedule(1, keyboard("Q1_OP1"), message.edit, shown=keyboard())
+    for selected in (["Q1_OP1", "Q1_OP2"], ["Q1_OP1", "Q1_OP2", "Q1_OP3"], ["Q1_OP2", "Q1_OP3"]):
+        await asyncio.sleep(0.005)
+        debouncer.schedule(1, keyboard(*selected), message.edit)
+    await settle(debouncer)
+    
+    assert message.edits == [keyboard("Q1_OP2", "Q1_OP3")]
+    assert (debouncer.scheduled, debouncer.coalesced, debouncer.sent) == (4, 3, 1)
+
+
+@pytest.mark.asyncio
+async def test_unchanged_markup_is_skipped():
+    """Тест: если клавиатура вернулась к показанной, правка не отправляется"""
+    debouncer = MarkupDebouncer(delay=0.01)
+    message = FakeMessage()
+    
+    debouncer.schedule(1, keyboard("Q1_OP1"), message.edit, shown=keyboard())
+    debouncer.schedule(1, keyboard(), message.edit)
+    await settle(debouncer)
+    
+    assert message.edits == []
+    assert debouncer.unchanged == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_after_resends_latest():
+    """Тест: после RetryAfter правка повторяется"""
+    debouncer = MarkupDebouncer(delay=0.01)
+    retry = TelegramRetryAfter(
+        method=EditMessageReplyMarkup(chat_id=1, message_id=1),
+        message="Flood control exceeded",
+        retry_after=0
+    )
+    message = FakeMessage(fail_with=[retry])
+    
+    debouncer.schedule(1, keyboard("Q1_OP4"), message.edit, shown=keyboard())
+    await settle(debouncer)
+    
+    assert message.edits == [keyboard("Q1_OP4")]
+
+
+@pytest.mark.asyncio
+async def test_cancel_drops_pending_edit():
+    """Тест: снятая правка не отправляется"""
+    debouncer = MarkupDebouncer(delay=0.01)
+    message = FakeMessage()
+    
+    debouncer.schedule(1, keyboard("Q1_OP1"), message.edit, shown=keyboard())
+    assert await debouncer.cancel(1)
+    assert not await debouncer.cancel(1)
+    await asyncio.sleep(0.03)
+    
+    assert message.edits == []
+    assert len(debouncer) == 0 and debouncer.cancelled == 1
+
+
+@pytest.mark.asyncio
+async def test_cancel_waits_for_edit_in_flight():
+    """Тест: cancel возвращается только после окончания уже начатой правки"""
+    debouncer = MarkupDebouncer(delay=0.01)
+    started, finished = asyncio.Event(), []
+    
+    async def slow_edit(markup):
+        started.set()
+        try:
+            await asyncio.sleep(1)
+        finally:
+            finished.append(markup)
+    
+    debouncer.schedule(1, keyboard("Q1_OP1"), slow_edit, shown=keyboard())
+    await started.wait()
+    await debouncer.cancel(1)
+    
+    assert finished == [keyboard("Q1_OP1")]
+
+
+def survey_callback_query(bot: Bot, data: str, markup) -> CallbackQuery:
+    return CallbackQuery.model_validate({
+        "id": "1",
+        "from": {"id": 1, "is_bot": False, "first_name": "U"},
+        "chat_instance": "1",
+        "data": data,
+        "message": {
+            "message_id": 10,
+            "chat": {"id": 1, "type": "private"},
+            "date": 1700000000,
+            "text": "Q2",
+            "reply_markup": markup.model_dump(),
+        },
+    }, context={"bot": bot})
+
+
+@pytest.mark.asyncio
+async def test_toggle_then_back_keeps_previous_question_keyboard(monkeypatch):
+    """Тест: после тоггла и «Назад» отложенная клавиатура Q2 не затирает Q1"""
+    monkeypatch.setattr(markup_debouncer, "delay", 0.02)
+    session = RecordingSession()
+    bot = Bot("42:TEST", session=session)
+    state = FSMContext(MemoryStorage(), StorageKey(bot_id=42, chat_id=1, user_id=1))
+    await state.update_data(respondent_id=-1, lang="ru", current_question="Q2", selected_options=[])
+    answer_cache.put(-1, {"Q1": '["Q1_OP1"]'})
+    
+    q2 = QUESTIONNAIRE.question("Q2")
+    shown = get_question_keyboard(q2["options"], "Q2", multi_select=True, selected=[])
+    
+    toggle = toggle_data(q2["options"][0]["code"])
+    await handle_survey_callback(survey_callback_query(bot, toggle, shown), state, decode(toggle))
+    await handle_survey_callback(survey_callback_query(bot, BACK, shown), state, decode(BACK))
+    await asyncio.sleep(0.06)
+    
+    assert session.names == ["AnswerCallbackQuery", "AnswerCallbackQuery", "EditMessageText"]
+    assert len(markup_debouncer) == 0
+    answer_cache.evict(-1)
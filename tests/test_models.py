@@ -0,0 +1,314 @@
+"""Тесты для моделей и миграций"""
+import asyncio
+import pytest
+import json
+from sqlalchemy import event, func, select, insert, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from models import database
+from models.database import Base, create_engines
+from models import Respondent, Answer, AnswerOption, AnswerCount, WaveTotal, upsert_answer
+from models.migrations import (
+    backfill_answer_options, dedupe_answers, add_abandoned_column, add_answer_updated_at_column,
+    add_option_question_code_column, reset_merged_option_counts
+)
+
+
+async def get_options(session, answer_id):
+    result = await session.execute(
+        select(AnswerOption.option_code, AnswerOption.input_text)
+        .where(AnswerOption.answer_id == answer_id)
+        .order_by(AnswerOption.id)
+    )
+    return result.all()
+
+
+@pytest.mark.asyncio
+async def test_answer_options_follow_answer(session_maker):
+    """Тест: answer_options пересобираются при записи ответа"""
+    async with session_maker() as session:
+        resp = Respondent(user_id=111, consented=True)
+        session.add(resp)
+        await session.commit()
+        
+        answer = Answer(
+            respondent_id=resp.id,
+            question_code="Q1",
+            answer=json.dumps(["Q1_OP1", "Q1_OP7:свой вариант"])
+        )
+        session.add(answer)
+        await session.commit()
+        
+        assert await get_options(session, answer.id) == [
+            ("Q1_OP1", None),
+            ("Q1_OP7", "свой вариант"),
+        ]
+        
+        answer.answer = "Q1_OP3"
+        await session.commit()
+        
+        assert await get_options(session, answer.id) == [("Q1_OP3", None)]
+
+
+@pytest.mark.asyncio
+async def test_backfill_answer_options(test_engine):
+    """Тест: миграция заполняет answer_options для старых ответов"""
+    async with test_engine.begin() as conn:
+        await conn.execute(insert(Respondent), [{"id": 1, "user_id": 111}])
+        # Core-вставка минует ORM, как строки, сохранённые до нормализации
+        await conn.execute(insert(Answer), [
+            {"respondent_id": 1, "question_code": "Q1", "answer": json.dumps(["Q1_OP2", "Q1_OP3"])},
+            {"respondent_id": 1, "question_code": "Q3", "answer": "Q3_OP4:не знаю"},
+        ])
+        
+        assert await backfill_answer_options(conn, chunk_size=1) == 2
+        # Повторный запуск ничего не делает
+        assert await backfill_answer_options(conn) == 0
+    
+    async_session_maker = async_sessionmaker(test_engine, class_=AsyncSession)
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(AnswerOption.question_code, AnswerOption.option_code, AnswerOption.input_text)
+            .order_by(AnswerOption.id)
+        )
+        assert result.all() == [
+            ("Q1", "Q1_OP2", None),
+            ("Q1", "Q1_OP3", None),
+            ("Q3", "Q3_OP4", "не знаю"),
+        ]
+
+
+@pytest.mark.asyncio
+async def test_add_option_question_code_column(test_engine):
+    """Тест: answer_options.question_code добавляется в старую таблицу и заполняется"""
+    async with test_engine.begin() as conn:
+        # Схема до миграции: опции без кода вопроса
+        await conn.execute(text("DROP TABLE answer_options"))
+        await conn.execute(text(
+            "CREATE TABLE answer_options (id INTEGER PRIMARY KEY, answer_id INTEGER NOT NULL, "
+            "option_code VARCHAR NOT NULL, input_text TEXT)"
+        ))
+        await conn.execute(insert(Respondent), [{"id": 1, "user_id": 111}])
+        await conn.execute(insert(Answer), [{"id": 5, "respondent_id": 1, "question_code": "Q2", "answer": "Q2_OP3"}])
+        await conn.execute(text("INSERT INTO answer_options (answer_id, option_code) VALUES (5, 'Q2_OP3')"))
+        
+        assert await add_option_question_code_column(conn)
+        assert not await add_option_question_code_column(conn)
+        assert await backfill_answer_options(conn) == 0
+        
+        result = await conn.execute(select(AnswerOption.question_code, AnswerOption.option_code))
+        assert result.all() == [("Q2", "Q2_OP3")]
+        result = await conn.execute(text("PRAGMA index_list('answer_options')"))
+        assert "idx_answer_option_question" in [row.name for row in result]
+
+
+@pytest.mark.asyncio
+async def test_upsert_answer(session_maker):
+    """Тест: повторный ответ обновляет строку, а не создаёт дубликат"""
+    async with session_maker() as session:
+        resp = Respondent(user_id=111, consented=True)
+        session.add(resp)
+        await session.commit()
+        
+        first_id = await upsert_answer(session, resp.id, "Q4", json.dumps(["Q4_OP1", "Q4_OP7:злость"]))
+        await session.commit()
+        second_id = await upsert_answer(session, resp.id, "Q4", json.dumps(["Q4_OP2"]))
+        await session.commit()
+        
+        assert first_id == second_id
+        
+        result = await session.execute(select(Answer.answer).where(Answer.respondent_id == resp.id))
+        assert result.scalars().all() == [json.dumps(["Q4_OP2"])]
+        assert await get_options(session, first_id) == [("Q4_OP2", None)]
+
+
+@pytest.mark.asyncio
+async def test_reset_merged_option_counts(session_maker):
+    """Тест: агрегаты, слившие опцию с текстом в её код, сбрасываются для пересчёта"""
+    async with session_maker() as session:
+        resp = Respondent(user_id=111, consented=True, completed=True, wave_id="w1")
+        session.add(resp)
+        await session.commit()
+        await upsert_answer(session, resp.id, "Q1", json.dumps(["Q1_OP1", "Q1_OP7:своё"]))
+        session.add_all([
+            AnswerCount(wave_id="w1", question_code="Q1", option_code="Q1_OP1", count=1),
+            AnswerCount(wave_id="w1", question_code="Q1", option_code="Q1_OP7", count=1),
+            WaveTotal(wave_id="w1", respondents=1),
+        ])
+        await session.commit()
+        
+        connection = await session.connection()
+        assert await reset_merged_option_counts(connection)
+        assert (await session.execute(select(func.count()).select_from(AnswerCount))).scalar() == 0
+        assert (await session.execute(select(func.count()).select_from(WaveTotal))).scalar() == 0
+        
+        session.add_all([
+            AnswerCount(wave_id="w1", question_code="Q1", option_code="Q1_OP1", count=1),
+            AnswerCount(wave_id="w1", question_code="Q1", option_code="Q1_OP7:своё", count=1),
+            WaveTotal(wave_id="w1", respondents=1),
+        ])
+        await session.flush()
+        assert not await reset_merged_option_counts(connection)
+
+
+@pytest.mark.asyncio
+async def test_dedupe_answers(test_engine):
+    """Тест: миграция удаляет дубликаты и делает индекс уникальным"""
+    async with test_engine.begin() as conn:
+        # Схема до миграции: обычный индекс
+        await conn.execute(text("DROP INDEX idx_respondent_question"))
+        await conn.execute(text("CREATE INDEX idx_respondent_question ON answers (respondent_id, question_code)"))
+        
+        await conn.execute(insert(Respondent), [{"id": 1, "user_id": 111}])
+        await conn.execute(insert(Answer), [
+            {"respondent_id": 1, "question_code": "Q3", "answer": "Q3_OP1"},
+            {"respondent_id": 1, "question_code": "Q3", "answer": "Q3_OP2"},
+            {"respondent_id": 1, "question_code": "Q5", "answer": "Q5_OP1"},
+        ])
+        await backfill_answer_options(conn)
+        
+        assert await dedupe_answers(conn) == 1
+        assert await dedupe_answers(conn) == 0
+        
+        result = await conn.execute(select(Answer.question_code, Answer.answer).order_by(Answer.id))
+        assert result.all() == [("Q3", "Q3_OP2"), ("Q5", "Q5_OP1")]
+        
+        result = await conn.execute(select(AnswerOption.option_code).order_by(AnswerOption.id))
+        assert result.scalars().all() == ["Q3_OP2", "Q5_OP1"]
+        
+        with pytest.raises(IntegrityError):
+            await conn.execute(insert(Answer), [{"respondent_id": 1, "question_code": "Q5", "answer": "Q5_OP2"}])
+
+
+@pytest.mark.asyncio
+async def test_add_abandoned_column():
+    """Тест: столбец abandoned добавляется в старую таблицу respondents"""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", echo=False)
+    
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE respondents (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL)"))
+        await conn.execute(text("INSERT INTO respondents (id, user_id) VALUES (1, 111)"))
+        
+        assert await add_abandoned_column(conn)
+        assert not await add_abandoned_column(conn)
+        
+        result = await conn.execute(text("SELECT abandoned FROM respondents"))
+        assert result.scalar() == 0
+    
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_add_answer_updated_at_column():
+    """Тест: answers.updated_at добавляется и заполняется временем создания"""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", echo=False)
+    
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "CREATE TABLE answers (id INTEGER PRIMARY KEY, respondent_id INTEGER NOT NULL, "
+            "question_code VARCHAR(10) NOT NULL, answer TEXT NOT NULL, created_at DATETIME)"
+        ))
+        await conn.execute(text(
+            "INSERT INTO answers (respondent_id, question_code, answer, created_at) "
+            "VALUES (1, 'Q1', 'Q1_OP1', '2024-01-01 10:00:00')"
+        ))
+        
+        assert await add_answer_updated_at_column(conn)
+        assert not await add_answer_updated_at_column(conn)
+        
+        result = await conn.execute(text("SELECT updated_at FROM answers"))
+        assert result.scalar() == "2024-01-01 10:00:00"
+    
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writers_share_one_connection(tmp_path):
+    """Тест: параллельные чтение-потом-запись не получают database is locked"""
+    writer, reader = create_engines(f"sqlite+aiosqlite:///{tmp_path / 'bot.db'}", profile="wal")
+    assert writer.pool.size() == 1
+    
+    async with writer.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(writer, class_=AsyncSession, expire_on_commit=False)
+    
+    async def consent(user_id):
+        async with sessions() as session:
+            result = await session.execute(select(Respondent).where(Respondent.user_id == user_id))
+            if result.scalar_one_or_none() is None:
+                session.add(Respondent(user_id=user_id, consented=True))
+                await session.commit()
+    
+    await asyncio.gather(*(consent(user_id) for user_id in range(100)))
+    
+    async with sessions() as session:
+        result = await session.execute(select(Respondent.id))
+        assert len(result.all()) == 100
+    
+    await writer.dispose()
+    await reader.dispose()
+
+
+@pytest.mark.asyncio
+async def test_init_db_collects_planner_statistics(tmp_path, monkeypatch):
+    """Тест: init_db оставляет статистику планировщика (sqlite_stat1)"""
+    writer, reader = create_engines(f"sqlite+aiosqlite:///{tmp_path / 'bot.db'}", profile="wal")
+    monkeypatch.setattr(database, "engine", writer)
+    async with writer.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Respondent), [{"id": 1, "user_id": 111, "completed": True}])
+        await conn.execute(insert(Answer), [{"respondent_id": 1, "question_code": "Q1", "answer": "Q1_OP1"}])
+    
+    await database.init_db()
+    
+    async with writer.connect() as conn:
+        result = await conn.execute(text("SELECT DISTINCT tbl FROM sqlite_stat1"))
+        assert {"respondents", "answers", "answer_options"} <= set(result.scalars().all())
+    
+    await writer.dispose()
+    await reader.dispose()
+
+
+@pytest.mark.asyncio
+async def test_begin_immediate_between_writer_engines(tmp_path):
+    """Тест: два писателя с BEGIN IMMEDIATE на одном файле не получают database is locked"""
+    url = f"sqlite+aiosqlite:///{tmp_path / 'bot.db'}"
+    engines = [create_engines(url, profile="wal", immediate=True) for _ in range(2)]
+    
+    async with engines[0][0].begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    makers = [async_sessionmaker(writer, class_=AsyncSession, expire_on_commit=False) for writer, _ in engines]
+    begins = []
+    
+    def record_begin(conn, cursor, statement, *args):
+        if statement.startswith("BEGIN"):
+            begins.append(statement)
+    
+    for writer, _ in engines:
+        event.listen(writer.sync_engine, "before_cursor_execute", record_begin)
+    
+    async def consent(sessions, user_id):
+        async with sessions() as session:
+            result = await session.execute(select(Respondent).where(Respondent.user_id == user_id))
+            # Пауза между чтением и записью, чтобы транзакции второго движка пересекались
+            await asyncio.sleep(0.01)
+            if result.scalar_one_or_none() is None:
+                session.add(Respondent(user_id=user_id, consented=True))
+                await session.commit()
+    
+    await asyncio.gather(*(consent(makers[user_id % 2], user_id) for user_id in range(20)))
+    
+    async with makers[1]() as session:
+        result = await session.execute(select(Respondent.id))
+        assert len(result.all()) == 20
+    # Каждая транзакция, включая начатые с чтения, сразу берёт блокировку записи
+    assert len(begins) >= 20
+    assert set(begins) == {"BEGIN IMMEDIATE"}
+    
+    for writer, reader in engines:
+        await writer.dispose()
+        await reader.dispose()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,72 @@
+"""Тесты профилировщика по команде"""
+import asyncio
+import sys
+
+import pytest
+
+from services.profiler import LoopProfiler
+
+
+def busy_work():
+    return sum(i * i for i in range(2000))
+
+
+async def background_load(stop: asyncio.Event):
+    while not stop.is_set():
+        busy_work()
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_profile_sees_other_tasks():
+    """В профиль попадают задачи цикла, а после окна хук снят"""
+    profiler = LoopProfiler(limit=20)
+    stop = asyncio.Event()
+    load = asyncio.create_task(background_load(stop))
+    
+    summary = await profiler.profile(0.2)
+    stop.set()
+    await load
+    
+    assert "busy_work" in summary
+    assert "Профиль цикла событий" in summary
+    assert not profiler.running and profiler.runs == 1
+    assert sys.getprofile() is None
+
+
+@pytest.mark.asyncio
+async def test_single_profile_at_a_time():
+    """Второй запуск во время окна отклоняется, окно ограничено max_seconds"""
+    profiler = LoopProfiler(max_seconds=0.1)
+    first = asyncio.create_task(profiler.profile(60))
+    await asyncio.sleep(0)
+    assert profiler.running
+    
+    with pytest.raises(RuntimeError):
+        await profiler.profile(1)
+    
+    await asyncio.wait_for(first, timeout=5)
+    assert not profiler.running
+
+
+@pytest.mark.asyncio
+async def test_start_profiles_in_background():
+    """start сразу возвращает управление, сводка приходит в deliver после окна"""
+    profiler = LoopProfiler(limit=5)
+    delivered = []
+    
+    async def deliver(summary):
+        delivered.append(summary)
+    
+    task = profiler.start(0.1, deliver)
+    assert profiler.running and not delivered
+    with pytest.raises(RuntimeError):
+        profiler.start(1, deliver)
+    
+    await asyncio.wait_for(task, timeout=5)
+    assert len(delivered) == 1 and "Профиль цикла событий" in delivered[0]
+    assert not profiler.running
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
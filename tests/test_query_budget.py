@@ -0,0 +1,76 @@
+"""Тесты счётчика запросов к БД на обновление"""
+import logging
+
+import pytest
+from aiogram import Bot, Dispatcher, Router, F
+from sqlalchemy import text
+
+from models.database import QueryLog, create_engines, current_query_log, fingerprint
+from middlewares import LatencyMiddleware, QueryBudgetMiddleware
+from tests.fakes import message_update
+
+
+@pytest.fixture
+async def engine():
+    writer, reader = create_engines("sqlite+aiosqlite:///:memory:", profile="default")
+    yield writer
+    await writer.dispose()
+    await reader.dispose()
+
+
+def test_fingerprint():
+    """Отпечаток не зависит от значений и длины списка IN"""
+    assert fingerprint("SELECT * FROM answers\n  WHERE respondent_id IN (?, ?, ?) LIMIT 10") == \
+        fingerprint("SELECT * FROM answers WHERE respondent_id IN (?, ?) LIMIT 500")
+    assert fingerprint("SELECT 'a''b', 42 FROM t_1") == "SELECT ?, ? FROM t_1"
+
+
+def test_query_log_merges_fingerprints():
+    """Одинаковые по отпечатку запросы суммируются, частые — первыми"""
+    log = QueryLog()
+    log.add("SELECT 1", 0.001)
+    for size in (2, 3, 4):
+        log.add("SELECT x FROM t WHERE id IN (" + ", ".join("?" * size) + ")", 0.002)
+    assert log.count == 4
+    assert log.fingerprints()[0][:2] == ("SELECT x FROM t WHERE id IN (...)", 3)
+
+
+@pytest.mark.asyncio
+async def test_over_budget_update_is_logged(engine, caplog):
+    """Обновление сверх бюджета логируется с отпечатками, по обработчику видны запросы"""
+    budget = QueryBudgetMiddleware(budget=3)
+    tracker = LatencyMiddleware()
+    router = Router()
+    
+    @router.message(F.text == "cheap")
+    async def cheap(message):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    
+    @router.message(F.text == "n_plus_one")
+    async def n_plus_one(message):
+        async with engine.connect() as conn:
+            for i in range(5):
+                await conn.execute(text("SELECT :i"), {"i": i})
+    
+    dp = Dispatcher()
+    dp.update.outer_middleware(budget)
+    dp.message.middleware(tracker)
+    dp.include_router(router)
+    bot = Bot("42:TEST")
+    
+    with caplog.at_level(logging.WARNING, logger="middlewares.query_budget"):
+        await dp.feed_update(bot, message_update(1, "cheap"))
+        await dp.feed_update(bot, message_update(2, "n_plus_one"))
+    
+    assert budget.updates == 2
+    assert budget.over_budget == 1
+    assert budget.max_queries == 5
+    assert len(caplog.records) == 1
+    assert "5 запросов" in caplog.text
+    assert "5 ×" in caplog.text and "SELECT ?" in caplog.text
+    
+    report = tracker.report()
+    assert report["cheap"][1].queries == 1
+    assert report["n_plus_one"][1].queries == 5
+    assert current_query_log.get() is None
@@ -0,0 +1,50 @@
+"""Тесты для скомпилированной анкеты"""
+from utils.questions import (
+    INITIAL_QUESTIONS,
+    LINGUISTIC_QUESTIONS,
+    QUESTIONS,
+    QUESTIONNAIRE,
+    get_question_by_code,
+    get_next_question,
+    get_previous_question,
+    get_question_number,
+)
+
+
+def test_lookup_matches_questions():
+    """Тест: индекс согласован со списками вопросов"""
+    for i, q in enumerate(QUESTIONS):
+        assert get_question_by_code(q["code"]) is q
+        assert get_question_number(q["code"]) == i + 1
+        assert get_previous_question(q["code"]) == (QUESTIONS[i - 1]["code"] if i else None)
+        for option in q.get("options", []):
+            assert QUESTIONNAIRE.option(q["code"], option["code"]) is option
+    
+    assert get_question_by_code("Q99") is None
+    assert get_question_number("Q99") == 0
+    assert QUESTIONNAIRE.option("Q1", "Q2_OP1") is None
+
+
+def test_stage_navigation():
+    """Тест: номер и следующий вопрос считаются внутри этапа"""
+    assert QUESTIONNAIRE.stage_totals == {
+        "initial": len(INITIAL_QUESTIONS),
+        "linguistic": len(LINGUISTIC_QUESTIONS),
+    }
+    
+    for stage, questions in (("initial", INITIAL_QUESTIONS), ("linguistic", LINGUISTIC_QUESTIONS)):
+        for i, q in enumerate(questions):
+            assert QUESTIONNAIRE.stage[q["code"]] == stage
+            assert QUESTIONNAIRE.progress(q["code"]) == (i + 1, len(questions))
+            expected = questions[i + 1]["code"] if i + 1 < len(questions) else None
+            assert QUESTIONNAIRE.next_in_stage[q["code"]] == expected
+    
+    assert QUESTIONNAIRE.progress("Q99") == (0, 0)
+
+
+def test_next_question_crosses_stages():
+    """Тест: следующий вопрос анкеты идёт через границу этапов"""
+    last_initial = INITIAL_QUESTIONS[-1]["code"]
+    assert get_next_question(last_initial, {}) == LINGUISTIC_QUESTIONS[0]["code"]
+    assert get_next_question(QUESTIONS[-1]["code"], {}) is None
+    assert get_next_question("Q99", {}) is None
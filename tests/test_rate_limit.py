@@ -0,0 +1,72 @@
+"""Тесты для ограничения частоты исходящих запросов"""
+import asyncio
+import pytest
+from aiogram import Bot
+from aiogram.methods import AnswerCallbackQuery
+
+from middlewares import RateLimitMiddleware
+from tests.fakes import FakeClock, RecordingSession
+
+
+def make_bot(limiter: RateLimitMiddleware, clock: FakeClock, **kwargs):
+    session = RecordingSession(clock, **kwargs)
+    session.middleware(limiter)
+    return Bot("42:TEST", session=session), session
+
+
+@pytest.mark.asyncio
+async def test_per_chat_limit():
+    """Тест: в один чат после всплеска — не чаще chat_rate"""
+    clock = FakeClock()
+    limiter = RateLimitMiddleware(chat_rate=1, chat_burst=2, clock=clock, sleep=clock.sleep)
+    bot, session = make_bot(limiter, clock)
+    
+    await asyncio.gather(*[bot.send_message(1, f"msg {i}") for i in range(4)])
+    
+    assert session.times == [0.0, 0.0, 1.0, 2.0]
+    assert limiter.delayed == 2
+    assert limiter.max_waiting == 2
+    assert limiter.stats()["max_wait"] == pytest.approx(2.0)
+
+
+@pytest.mark.asyncio
+async def test_global_limit_across_chats():
+    """Тест: разные чаты упираются в общий лимит"""
+    clock = FakeClock()
+    limiter = RateLimitMiddleware(global_rate=10, clock=clock, sleep=clock.sleep)
+    bot, session = make_bot(limiter, clock)
+    
+    await asyncio.gather(*[bot.send_message(chat_id, "hi") for chat_id in range(25)])
+    
+    times = sorted(session.times)
+    assert times[9] == 0.0
+    assert times[10] == pytest.approx(0.1)
+    assert times[-1] == pytest.approx(1.5)
+    assert limiter.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_retry_after_is_retried():
+    """Тест: RetryAfter выжидается и запрос повторяется"""
+    clock = FakeClock()
+    limiter = RateLimitMiddleware(clock=clock, sleep=clock.sleep)
+    bot, session = make_bot(limiter, clock, retry_after=5)
+    
+    assert await bot.send_message(7, "hello")
+    
+    assert session.requests == [(5.0, "SendMessage", 7)]
+    assert limiter.retries == 1
+
+
+@pytest.mark.asyncio
+async def test_methods_without_chat_are_not_limited():
+    """Тест: запросы без chat_id идут без очереди"""
+    clock = FakeClock()
+    limiter = RateLimitMiddleware(chat_rate=1, chat_burst=1, clock=clock, sleep=clock.sleep)
+    bot, session = make_bot(limiter, clock)
+    
+    for _ in range(3):
+        await bot(AnswerCallbackQuery(callback_query_id="1"))
+    
+    assert session.times == [0.0, 0.0, 0.0]
+    assert limiter.requests == 0
@@ -0,0 +1,55 @@
+"""Тесты для готовых сообщений с рекомендациями"""
+from utils.i18n import TEXTS, get_text
+from utils.recommendations import (
+    RECOMMENDATION_MESSAGES,
+    get_recommendation_by_type,
+    get_recommendation_messages,
+    split_message,
+)
+
+
+def legacy_messages(aggression_type: str, lang: str, max_length: int = 4000) -> list:
+    """Сообщения так, как их раньше собирал finish_survey"""
+    recommendations = get_recommendation_by_type('linguistic', aggression_type)
+    if not recommendations:
+        return []
+    
+    rec_text = get_text(lang, "recommendations_title") + recommendations
+    if len(rec_text) <= max_length:
+        return [rec_text]
+    
+    parts = []
+    current_part = ""
+    for line in rec_text.split('\n'):
+        if len(current_part) + len(line) + 1 < max_length:
+            current_part += line + '\n'
+        else:
+            parts.append(current_part)
+            current_part = line + '\n'
+    if current_part:
+        parts.append(current_part)
+    return parts
+
+
+def test_cached_messages_match_legacy_output():
+    """Тест: готовые сообщения совпадают с прежним выводом для всех вариантов"""
+    assert len(RECOMMENDATION_MESSAGES) == 2 * len(TEXTS)
+    
+    for aggression_type in ('subtle', 'open'):
+        for lang in TEXTS:
+            assert list(get_recommendation_messages(aggression_type, lang)) == legacy_messages(aggression_type, lang)
+    
+    # Неизвестный язык и тип агрессии считаются на лету так же, как раньше
+    assert list(get_recommendation_messages(None, "en")) == legacy_messages(None, "en")
+
+
+def test_split_matches_legacy_chunking():
+    """Тест: разбиение длинного текста совпадает с прежним"""
+    text = get_text("ru", "recommendations_title") + get_recommendation_by_type('linguistic', 'open')
+    
+    for max_length in (200, 500, 1000, len(text) - 1, len(text)):
+        assert split_message(text, max_length) == legacy_messages('open', "ru", max_length)
+    
+    parts = split_message(text, 500)
+    assert len(parts) > 1
+    assert all(len(part) < 500 for part in parts)
@@ -0,0 +1,98 @@
+"""Тесты для уборки брошенных сессий"""
+import time
+import pytest
+from datetime import datetime, timedelta
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import select
+
+from models import Respondent, Answer, upsert_answer
+from services.answer_cache import answer_cache
+from services.fsm_storage import SQLiteStorage
+from services.session_reaper import SessionReaper
+
+
+@pytest.fixture
+async def session_maker(session_maker):
+    """Фабрика сессий тестовой БД с респондентами на разных стадиях"""
+    now = datetime.utcnow()
+    old = now - timedelta(days=3)
+    async with session_maker() as session:
+        session.add_all([
+            # Бросил давно, ответов нет
+            Respondent(id=1, user_id=111, consented=True, created_at=old),
+            # Начал давно, но отвечал недавно
+            Respondent(id=2, user_id=222, consented=True, created_at=old),
+            # Завершил опрос
+            Respondent(id=3, user_id=333, consented=True, completed=True, created_at=old),
+            # Только начал
+            Respondent(id=4, user_id=444, consented=True, created_at=now),
+            # Бросил давно, последний ответ тоже давно
+            Respondent(id=5, user_id=555, consented=True, created_at=old),
+        ])
+        session.add_all([
+            Answer(respondent_id=2, question_code="Q1", answer="Q1_OP1", created_at=now, updated_at=now),
+            Answer(respondent_id=5, question_code="Q1", answer="Q1_OP1", created_at=old, updated_at=old),
+        ])
+        await session.commit()
+    
+    return session_maker
+
+
+@pytest.mark.asyncio
+async def test_marks_idle_respondents_abandoned(session_maker):
+    """Тест: брошенными помечаются только незавершённые без активности дольше TTL"""
+    reaper = SessionReaper(ttl=24 * 3600, session_maker=session_maker)
+    
+    report = await reaper.run_once()
+    assert report.respondents == 2
+    assert (await reaper.run_once()).respondents == 0
+    
+    async with session_maker() as session:
+        result = await session.execute(select(Respondent.id).where(Respondent.abandoned == True))
+        assert sorted(result.scalars().all()) == [1, 5]
+
+
+@pytest.mark.asyncio
+async def test_edited_answer_counts_as_activity(session_maker):
+    """Тест: правка давнего ответа — активность, респондент не брошен"""
+    async with session_maker() as session:
+        await upsert_answer(session, 5, "Q1", "Q1_OP2")
+        await session.commit()
+        answer = (await session.execute(select(Answer).where(Answer.respondent_id == 5))).scalar_one()
+        assert answer.updated_at > answer.created_at
+    
+    reaper = SessionReaper(ttl=24 * 3600, session_maker=session_maker)
+    assert (await reaper.run_once()).respondents == 1
+    
+    async with session_maker() as session:
+        result = await session.execute(select(Respondent.id).where(Respondent.abandoned == True))
+        assert result.scalars().all() == [1]
+
+
+@pytest.mark.asyncio
+async def test_reaps_idle_fsm_records(session_maker, tmp_path):
+    """Тест: FSM-записи простаивающих удаляются из файла и памяти вместе с кэшем ответов"""
+    storage = SQLiteStorage(str(tmp_path / "fsm.db"), flush_interval=60)
+    for user_id, respondent_id in ((111, 1), (444, 4)):
+        key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+        await storage.set_data(key, {"respondent_id": respondent_id, "selected_options": []})
+    answer_cache.put(1, {"Q1": "Q1_OP1"})
+    
+    reaper = SessionReaper(ttl=3600, session_maker=session_maker)
+    await reaper.start(storage)
+    await reaper.stop()
+    
+    # Час назад все записи ещё свежие
+    assert (await reaper.run_once(now=time.time())).fsm_records == 0
+    
+    report = await reaper.run_once(now=time.time() + 7200)
+    assert report.fsm_records == 2
+    assert report.fsm_bytes > 0
+    assert report.cached_answers == 1
+    assert answer_cache.get(1) is None
+    assert len(storage._cache) == 0
+    
+    key = StorageKey(bot_id=1, chat_id=111, user_id=111)
+    assert await storage.get_data(key) == {}
+    assert reaper.total.fsm_records == 2
+    await storage.close()
@@ -0,0 +1,216 @@
+"""Тесты разбиения обновлений по процессам"""
+import asyncio
+import multiprocessing
+import os
+
+import pytest
+
+from middlewares import RateLimitMiddleware
+from services.fsm_storage import SQLiteStorage
+from services import supervisor as supervisor_module
+from services.supervisor import Supervisor, consume, update_user_id, shard_of
+from aiogram.fsm.storage.base import StorageKey
+
+
+def message(update_id: int, user_id: int, text: str = "hi"):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "chat": {"id": user_id, "type": "private"},
+            "date": 0,
+            "text": text,
+        },
+    }
+
+
+def test_update_user_id():
+    """Пользователь берётся из from, user или чата"""
+    assert update_user_id(message(1, 77)) == 77
+    assert update_user_id({"update_id": 2, "callback_query": {"id": "x", "from": {"id": 78}}}) == 78
+    assert update_user_id({"update_id": 3, "poll_answer": {"poll_id": "p", "user": {"id": 79}}}) == 79
+    assert update_user_id({"update_id": 4, "channel_post": {"chat": {"id": -100}}}) == -100
+    assert update_user_id({"update_id": 5, "poll": {"id": "p"}}) == 0
+
+
+class FakeProcess:
+    def __init__(self, alive: bool = True, exitcode: int = None):
+        self.alive = alive
+        self.exitcode = exitcode
+    
+    def is_alive(self):
+        return self.alive
+
+
+class FakeSupervisor(Supervisor):
+    """Без настоящих процессов: _spawn подставляет живой FakeProcess"""
+    
+    def __init__(self, count: int, **kwargs):
+        super().__init__(target=None, count=count, **kwargs)
+        self.spawned = []
+        self.now = 0.0
+    
+    def _spawn(self, index: int):
+        self._processes[index] = FakeProcess()
+        self._started_at[index] = self.now
+        self.spawned.append(index)
+
+
+def test_dispatch_keeps_user_in_one_worker():
+    """Все обновления пользователя попадают в одну очередь в исходном порядке"""
+    supervisor = FakeSupervisor(3)
+    for update_id, user_id in enumerate([10, 11, 12, 10, 13, 10]):
+        supervisor.dispatch(message(update_id, user_id))
+    
+    received = [[] for _ in range(3)]
+    for index, outbox in enumerate(supervisor._outboxes):
+        while not outbox.empty():
+            received[index].append(outbox.get()["update_id"])
+    assert [u for u in received[shard_of(10, 3)] if u in (0, 3, 5)] == [0, 3, 5]
+    assert sum(supervisor.routed) == 6
+    assert sorted(sum(received, [])) == list(range(6))
+
+
+def test_full_outbox_rejects_updates():
+    """Полная очередь обработчика не растёт: dispatch возвращает False"""
+    supervisor = FakeSupervisor(2, max_backlog=2)
+    results = [supervisor.dispatch(message(update_id, 10)) for update_id in range(4)]
+    
+    assert results == [True, True, False, False]
+    assert supervisor.routed[shard_of(10, 2)] == 2
+    assert supervisor.rejected[shard_of(10, 2)] == 2
+    assert supervisor.dispatch(message(5, 11))
+
+
+def test_broadcast_reaches_every_worker():
+    """Обновление, отмеченное broadcast, получают все процессы"""
+    supervisor = FakeSupervisor(3, broadcast=lambda update: update["message"]["text"] == "/perf")
+    supervisor.dispatch(message(1, 10, "/perf"))
+    supervisor.dispatch(message(2, 10))
+    
+    assert [outbox.qsize() for outbox in supervisor._outboxes] == [
+        2 if index == shard_of(10, 3) else 1 for index in range(3)
+    ]
+
+
+def test_admin_commands_are_broadcast(monkeypatch):
+    """Админ-команды над состоянием процесса рассылаются, остальное — нет"""
+    os.environ.setdefault("BOT_TOKEN", "42:TEST")
+    from handlers import admin
+    monkeypatch.setattr(admin, "ADMIN_IDS", [10])
+    
+    assert admin.is_broadcast_update(message(1, 10, "/perf"))
+    assert admin.is_broadcast_update(message(2, 10, "/cache_stats@survey_bot"))
+    assert admin.is_broadcast_update(message(3, 10, "/rebuild_stats now"))
+    assert not admin.is_broadcast_update(message(4, 10, "/stats"))
+    assert not admin.is_broadcast_update(message(5, 11, "/perf"))
+    assert not admin.is_broadcast_update(message(6, 10, "/"))
+    assert not admin.is_broadcast_update({"update_id": 7, "callback_query": {"from": {"id": 10}}})
+
+
+def test_owns_user(monkeypatch):
+    """В одном процессе он владеет всеми, в обработчике — только своим шардом"""
+    assert supervisor_module.owns_user(7)
+    monkeypatch.setattr(supervisor_module, "current_worker", (1, 3))
+    assert supervisor_module.owns_user(7)
+    assert not supervisor_module.owns_user(8)
+
+
+def test_crashed_worker_is_restarted_with_backoff():
+    """Упавший процесс перезапускается; частые падения увеличивают паузу"""
+    supervisor = FakeSupervisor(2, restart_delay=1, max_restart_delay=4, stable_after=60)
+    for index in range(2):
+        supervisor._spawn(index)
+    supervisor.spawned.clear()
+    
+    supervisor._processes[1] = FakeProcess(alive=False, exitcode=1)
+    assert supervisor.check(10) == []          # пауза 1 с
+    assert supervisor.check(11) == [1]
+    assert supervisor.restarts == 1
+    
+    supervisor.now = 11
+    supervisor._processes[1] = FakeProcess(alive=False, exitcode=1)
+    assert supervisor.check(12) == []          # снова упал быстро: пауза 2 с
+    assert supervisor.check(13.5) == []
+    assert supervisor.check(14) == [1]
+    
+    supervisor.now = 14
+    supervisor._processes[1] = FakeProcess(alive=False, exitcode=-9)
+    assert supervisor.check(200) == []         # проработал дольше stable_after: снова 1 с
+    assert supervisor.check(201) == [1]
+    assert supervisor.spawned == [1, 1, 1]
+
+
+@pytest.mark.asyncio
+async def test_consume_orders_updates_per_user():
+    """Обновления одного пользователя обрабатываются по очереди, разных — параллельно"""
+    updates, writer = multiprocessing.Pipe(duplex=False)
+    for update_id, user_id in enumerate([1, 2, 1, 2, 1]):
+        writer.send(message(update_id, user_id))
+    writer.send(None)
+    
+    log = []
+    active = set()
+    overlap = []
+    
+    async def feed(update):
+        user_id = update_user_id(update)
+        assert user_id not in active
+        active.add(user_id)
+        overlap.append(len(active))
+        # первое обновление пользователя 1 — самое медленное
+        await asyncio.sleep(0.05 if update["update_id"] == 0 else 0.001)
+        log.append((user_id, update["update_id"]))
+        active.discard(user_id)
+    
+    await consume(updates, feed, max_concurrent=4)
+    
+    assert [u for user, u in log if user == 1] == [0, 2, 4]
+    assert [u for user, u in log if user == 2] == [1, 3]
+    assert max(overlap) == 2
+
+
+@pytest.mark.asyncio
+async def test_consume_survives_handler_errors():
+    """Ошибка в обработке не останавливает очередь пользователя"""
+    updates, writer = multiprocessing.Pipe(duplex=False)
+    for update_id in range(3):
+        writer.send(message(update_id, 5))
+    writer.send(None)
+    handled = []
+    
+    async def feed(update):
+        if update["update_id"] == 0:
+            raise RuntimeError("boom")
+        handled.append(update["update_id"])
+    
+    await consume(updates, feed)
+    assert handled == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_sharded_storage_reaps_only_own_users(tmp_path):
+    """Процесс убирает из общего FSM-файла только записи своих пользователей"""
+    path = str(tmp_path / "fsm.db")
+    storages = [SQLiteStorage(path, shard=(index, 2)) for index in range(2)]
+    for user_id in range(4):
+        storage = storages[shard_of(user_id, 2)]
+        await storage.set_data(StorageKey(bot_id=1, chat_id=user_id, user_id=user_id), {"respondent_id": user_id})
+    for storage in storages:
+        await storage.flush()
+    
+    reaped, _ = await storages[0].reap(idle_before=float("inf"))
+    assert sorted(data["respondent_id"] for data in reaped) == [0, 2]
+    reaped, _ = await storages[1].reap(idle_before=float("inf"))
+    assert sorted(data["respondent_id"] for data in reaped) == [1, 3]
+    
+    for storage in storages:
+        await storage.close()
+
+
+def test_rate_limit_share():
+    """Общий лимит бота делится между процессами"""
+    limiter = RateLimitMiddleware(global_rate=30)
+    limiter.share(4)
+    assert limiter.global_bucket.interval == pytest.approx(4 / 30)
@@ -0,0 +1,153 @@
+"""Тесты режима вебхука: записанные обновления отправляются POST-запросами на локальный сервер"""
+import asyncio
+import json
+import os
+from pathlib import Path
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher, Router, F
+from aiogram.types import Message
+
+# handlers читает токен из окружения при импорте
+os.environ.setdefault("BOT_TOKEN", "42:TEST")
+
+from handlers import common_router, survey_router, admin_router
+from services.webhook import create_webhook_app, create_forwarding_app, WEBHOOK_HANDLER
+from tests.fakes import RecordingSession
+
+UPDATES = json.loads((Path(__file__).parent / "data" / "webhook_updates.json").read_text(encoding="utf-8"))
+PATH = "/webhook"
+SECRET = "test-secret_42"
+
+
+def make_client(dp: Dispatcher, max_concurrent: int = 64):
+    session = RecordingSession()
+    bot = Bot("42:TEST", session=session)
+    app = create_webhook_app(dp, bot, PATH, secret_token=SECRET, max_concurrent=max_concurrent)
+    return TestClient(TestServer(app)), app[WEBHOOK_HANDLER], session
+
+
+# Роутеры бота подключаются к диспетчеру только один раз
+survey_dp = Dispatcher()
+survey_dp.include_routers(common_router, survey_router, admin_router)
+
+
+def post(client: TestClient, update, secret: str = SECRET):
+    return client.post(PATH, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret})
+
+
+@pytest.mark.asyncio
+async def test_recorded_updates_are_handled():
+    """Каждое записанное обновление принимается и доходит до своего обработчика"""
+    client, handler, session = make_client(survey_dp)
+    async with client:
+        for update in UPDATES:
+            response = await post(client, update)
+            assert response.status == 200
+            assert await response.json() == {}
+        await handler.drain()
+    
+    assert session.sent == [
+        ("SendMessage", 5001),           # /start
+        ("SendMessage", 5001),           # /help
+        ("AnswerCallbackQuery", None),   # about_bot
+        ("EditMessageText", 5002),
+    ]
+    assert handler.accepted == len(UPDATES)
+
+
+@pytest.mark.asyncio
+async def test_wrong_secret_is_rejected():
+    """Без верного секрета обновление не обрабатывается"""
+    client, handler, session = make_client(survey_dp)
+    async with client:
+        response = await post(client, UPDATES[0], secret="wrong")
+        assert response.status == 401
+        response = await client.post(PATH, json=UPDATES[0])
+        assert response.status == 401
+        await handler.drain()
+    
+    assert session.sent == []
+    assert handler.accepted == 0
+
+
+@pytest.mark.asyncio
+async def test_malformed_body_is_rejected():
+    """Тело, не являющееся JSON-объектом, получает 400"""
+    client, handler, session = make_client(survey_dp)
+    async with client:
+        response = await client.post(
+            PATH, data=b"{not json",
+            headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        )
+        assert response.status == 400
+        for body in ([1, 2], "update", None):
+            response = await post(client, body)
+            assert response.status == 400
+    
+    assert handler.rejected == 4
+    assert session.sent == []
+
+
+@pytest.mark.asyncio
+async def test_forwarding_app():
+    """Супервизорное приложение: не-объект — 400, полная очередь обработчика — 503"""
+    forwarded = []
+    full = False
+    
+    def forward(update):
+        if full:
+            return False
+        forwarded.append(update["update_id"])
+        return True
+    
+    client = TestClient(TestServer(create_forwarding_app(PATH, forward, SECRET)))
+    async with client:
+        assert (await post(client, UPDATES[0])).status == 200
+        assert (await post(client, [UPDATES[0]])).status == 400
+        assert (await post(client, UPDATES[1], secret="wrong")).status == 401
+        full = True
+        assert (await post(client, UPDATES[1])).status == 503
+    
+    assert forwarded == [UPDATES[0]["update_id"]]
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_bounded():
+    """Сверх max_concurrent обновлений ответ ждёт освобождения слота"""
+    release = asyncio.Event()
+    started = []
+    router = Router()
+    
+    @router.message(F.text)
+    async def slow(message: Message):
+        started.append(message.message_id)
+        await release.wait()
+    
+    dp = Dispatcher()
+    dp.include_router(router)
+    client, handler, session = make_client(dp, max_concurrent=2)
+    
+    async with client:
+        updates = [
+            {**UPDATES[1], "update_id": 920000000 + i, "message": {**UPDATES[1]["message"], "message_id": i}}
+            for i in range(3)
+        ]
+        requests = [asyncio.create_task(post(client, update)) for update in updates]
+        
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+        
+        assert sum(request.done() for request in requests) == 2
+        assert handler.in_flight == 2
+        assert len(started) == 2
+        
+        release.set()
+        responses = await asyncio.gather(*requests)
+        assert [response.status for response in responses] == [200, 200, 200]
+        await handler.drain()
+    
+    assert sorted(started) == [0, 1, 2]
+    assert handler.peak == 2
+    assert handler.in_flight == 0
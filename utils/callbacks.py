@@ -0,0 +1,93 @@
+"""Компактные callback_data опроса и их разбор одной таблицей"""
+from typing import Dict, NamedTuple, Optional, Union
+
+from aiogram.filters import Filter
+from aiogram.types import CallbackQuery
+
+from utils.questions import QUESTIONNAIRE
+
+
+class SurveyCallback(NamedTuple):
+    """Разобранный callback опроса"""
+    action: str
+    question_code: Optional[str] = None
+    option_code: Optional[str] = None
+
+
+# Формат: буква действия + сквозной номер опции или вопроса
+# ("t57" вместо "toggle_LQ10_LQ10_OP8")
+ANSWER = "a"
+TOGGLE = "t"
+DONE = "d"
+BACK = "b"
+SKIP = "s"
+
+# Читаемые имена действий (метрики, логи)
+ACTION_NAMES = {ANSWER: "answer", TOGGLE: "toggle", DONE: "done", BACK: "back", SKIP: "skip"}
+
+
+def answer_data(option_code: str) -> str:
+    return f"{ANSWER}{QUESTIONNAIRE.option_id[option_code]}"
+
+
+def toggle_data(option_code: str) -> str:
+    return f"{TOGGLE}{QUESTIONNAIRE.option_id[option_code]}"
+
+
+def done_data(question_code: str) -> str:
+    return f"{DONE}{QUESTIONNAIRE.position[question_code]}"
+
+
+def _build_callbacks() -> Dict[str, SurveyCallback]:
+    """
+    Все допустимые callback_data опроса → разобранный callback
+    
+    Кроме компактных кодов в таблице есть прежние строковые
+    ("toggle_Q1_Q1_OP1", "nav_back_3"): клавиатуры, отправленные до
+    перехода на новый формат, продолжают работать.
+    
+    Действия зависят от типа вопроса, как на его клавиатуре: у
+    одиночного выбора — только ответ, у мультивыбора — тогглы и «Готово».
+    Тоггл опции одиночного вопроса в таблицу не попадает.
+    """
+    callbacks = {BACK: SurveyCallback(BACK), SKIP: SurveyCallback(SKIP)}
+    
+    for q in QUESTIONNAIRE.questions:
+        question_code = q["code"]
+        multi = q["type"] == "multi"
+        for option in q.get("options", []):
+            option_code = option["code"]
+            if multi:
+                callbacks[toggle_data(option_code)] = SurveyCallback(TOGGLE, question_code, option_code)
+                callbacks[f"toggle_{question_code}_{option_code}"] = callbacks[toggle_data(option_code)]
+            else:
+                callbacks[answer_data(option_code)] = SurveyCallback(ANSWER, question_code, option_code)
+                callbacks[f"answer_{question_code}_{option_code}"] = callbacks[answer_data(option_code)]
+        
+        if multi:
+            callbacks[done_data(question_code)] = SurveyCallback(DONE, question_code)
+            callbacks[f"multi_done_{question_code}"] = callbacks[done_data(question_code)]
+    
+    for number in range(max(QUESTIONNAIRE.stage_totals.values()) + 1):
+        callbacks[f"nav_back_{number}"] = callbacks[BACK]
+        callbacks[f"nav_skip_{number}"] = callbacks[SKIP]
+    
+    return callbacks
+
+
+SURVEY_CALLBACKS = _build_callbacks()
+
+
+def decode(data: Optional[str]) -> Optional[SurveyCallback]:
+    """Разобрать callback_data; None для чужих и поддельных данных"""
+    return SURVEY_CALLBACKS.get(data)
+
+
+class SurveyCallbackFilter(Filter):
+    """Фильтр callback'ов опроса: передаёт в хендлер survey_callback"""
+    
+    async def __call__(self, callback: CallbackQuery) -> Union[bool, Dict[str, SurveyCallback]]:
+        survey_callback = SURVEY_CALLBACKS.get(callback.data)
+        if survey_callback is None:
+            return False
+        return {"survey_callback": survey_callback}
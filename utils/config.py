@@ -6,6 +6,21 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = [int(id.strip()) for id in os.getenv("ADMIN_IDS", "").split(",") if id.strip()]
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "fsm.db")
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "24"))
+
+# Режим вебхука (python bot.py --mode webhook)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONCURRENT = int(os.getenv("WEBHOOK_MAX_CONCURRENT", "64"))
+
+# Число процессов-обработчиков (python bot.py --workers N)
+WORKERS = int(os.getenv("WORKERS", "1"))
+# Сколько обновлений может ждать в очереди к одному обработчику
+WORKER_BACKLOG = int(os.getenv("WORKER_BACKLOG", "10000"))
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен в .env файле")
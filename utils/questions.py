@@ -1,4 +1,6 @@
 """Структура вопросов опроса - психолог-помощник при буллинге"""
+import json
+from typing import Dict, List, Optional, Tuple
 
 # Первый этап: определение типа буллинга
 INITIAL_QUESTIONS = [
@@ -229,6 +231,112 @@ LINGUISTIC_QUESTIONS = [
 QUESTIONS = INITIAL_QUESTIONS + LINGUISTIC_QUESTIONS
 
 
+class Questionnaire:
+    """
+    Скомпилированная анкета: все переходы и поиски — обращения к словарям
+    
+    Строится один раз при импорте. Этап вопроса — "initial" или
+    "linguistic"; номер и следующий вопрос считаются внутри этапа,
+    как их показывает опрос, позиция и предыдущий вопрос — по всей анкете.
+    """
+    
+    def __init__(self, stages: Dict[str, List[dict]]):
+        self.questions: List[dict] = [q for questions in stages.values() for q in questions]
+        self.by_code: Dict[str, dict] = {q["code"]: q for q in self.questions}
+        self.position: Dict[str, int] = {q["code"]: i for i, q in enumerate(self.questions)}
+        self.stage_totals: Dict[str, int] = {stage: len(questions) for stage, questions in stages.items()}
+        self.options: Dict[str, Dict[str, dict]] = {
+            q["code"]: {o["code"]: o for o in q.get("options", [])}
+            for q in self.questions
+        }
+        # Сквозная нумерация опций анкеты (для компактных callback_data)
+        self.option_codes: List[str] = [o["code"] for q in self.questions for o in q.get("options", [])]
+        self.option_id: Dict[str, int] = {code: i for i, code in enumerate(self.option_codes)}
+        
+        self.stage: Dict[str, str] = {}
+        self.stage_number: Dict[str, int] = {}
+        self.next_in_stage: Dict[str, Optional[str]] = {}
+        for stage, questions in stages.items():
+            codes = [q["code"] for q in questions]
+            for i, code in enumerate(codes):
+                self.stage[code] = stage
+                self.stage_number[code] = i + 1
+                self.next_in_stage[code] = codes[i + 1] if i + 1 < len(codes) else None
+        
+        codes = [q["code"] for q in self.questions]
+        self.previous: Dict[str, Optional[str]] = {
+            code: codes[i - 1] if i > 0 else None for i, code in enumerate(codes)
+        }
+    
+    def question(self, code: str) -> Optional[dict]:
+        """Вопрос по коду"""
+        return self.by_code.get(code)
+    
+    def option(self, question_code: str, option_code: str) -> Optional[dict]:
+        """Опция вопроса по коду"""
+        return self.options.get(question_code, {}).get(option_code)
+    
+    def progress(self, code: str) -> Tuple[int, int]:
+        """Номер вопроса внутри этапа и число вопросов этапа"""
+        stage = self.stage.get(code)
+        if stage is None:
+            return 0, 0
+        return self.stage_number[code], self.stage_totals[stage]
+    
+    def next_question(self, current_code: str, answers: dict) -> Optional[str]:
+        """Следующий вопрос анкеты с учётом условий показа"""
+        current_idx = self.position.get(current_code)
+        if current_idx is None:
+            return None
+        
+        for question in self.questions[current_idx + 1:]:
+            cond = question.get("condition")
+            if cond:
+                cond_answer = answers.get(cond["question"])
+                # Если условие не выполнено, пропускаем вопрос
+                if not cond_answer or cond_answer not in cond["values"]:
+                    continue
+            return question["code"]
+        
+        return None
+
+
+QUESTIONNAIRE = Questionnaire({
+    "initial": INITIAL_QUESTIONS,
+    "linguistic": LINGUISTIC_QUESTIONS,
+})
+
+
+def parse_answer(value: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    Разобрать сохранённый ответ на пары (код опции, пользовательский текст)
+    
+    Мультивыбор хранится JSON-массивом, одиночный ответ — строкой,
+    пользовательский ввод дописывается к коду опции: "Q1_OP7:текст".
+    """
+    if not value:
+        return []
+    
+    try:
+        items = json.loads(value)
+    except (TypeError, ValueError):
+        items = None
+    
+    if not isinstance(items, list):
+        items = [value]
+    
+    options = []
+    for item in items:
+        code, sep, text = str(item).partition(":")
+        options.append((code, text if sep else None))
+    return options
+
+
+def get_option_codes(answers: dict, question_code: str) -> set:
+    """Коды опций, выбранных в ответе на вопрос"""
+    return {code for code, _ in parse_answer(answers.get(question_code, ""))}
+
+
 def is_linguistic_bullying(answers: dict) -> bool:
     """
     Определить, является ли буллинг языковым на основе ответов
@@ -239,55 +347,18 @@ def is_linguistic_bullying(answers: dict) -> bool:
     Returns:
         True если это языковой буллинг, False иначе
     """
-    import json
-    
-    # Проверяем ответ на Q1 (как проявляется буллинг)
-    q1_answer = answers.get("Q1", "")
-    if q1_answer:
-        try:
-            q1_options = json.loads(q1_answer) if q1_answer.startswith('[') else [q1_answer]
-        except:
-            q1_options = [q1_answer]
-        
-        # Языковые варианты: Q1_OP1, Q1_OP2, Q1_OP3
-        linguistic_options = ['Q1_OP1', 'Q1_OP2', 'Q1_OP3']
-        for opt in q1_options:
-            if any(ling_opt in opt for ling_opt in linguistic_options):
-                # Найден языковой буллинг в Q1
-                pass
-            else:
-                # Если есть не языковые опции, то это не языковой буллинг
-                if any(other in opt for other in ['Q1_OP4', 'Q1_OP5', 'Q1_OP6']):
-                    return False
+    # Проверяем ответ на Q1 (как проявляется буллинг):
+    # не языковые варианты Q1_OP4, Q1_OP5, Q1_OP6 исключают языковой буллинг
+    q1_options = get_option_codes(answers, "Q1")
+    if q1_options & {'Q1_OP4', 'Q1_OP5', 'Q1_OP6'}:
+        return False
     
     # Проверяем ответ на Q2 (причины буллинга)
-    q2_answer = answers.get("Q2", "")
-    if q2_answer:
-        try:
-            q2_options = json.loads(q2_answer) if q2_answer.startswith('[') else [q2_answer]
-        except:
-            q2_options = [q2_answer]
-        
-        # Языковые причины: Q2_OP1, Q2_OP2, Q2_OP3
-        linguistic_reasons = ['Q2_OP1', 'Q2_OP2', 'Q2_OP3']
-        has_linguistic_reason = False
-        has_other_reason = False
-        
-        for opt in q2_options:
-            if any(ling_rea in opt for ling_rea in linguistic_reasons):
-                has_linguistic_reason = True
-            if any(other in opt for other in ['Q2_OP4', 'Q2_OP5', 'Q2_OP6']):
-                has_other_reason = True
-        
-        # Если есть языковая причина и нет других
-        if has_linguistic_reason and not has_other_reason:
-            return True
-        elif has_linguistic_reason:
-            # Если есть и языковая, и другая причина - все равно считаем языковым
-            return True
-        else:
-            # Только не языковые причины
-            return False
+    q2_options = get_option_codes(answers, "Q2")
+    if q2_options:
+        # Языковые причины: Q2_OP1, Q2_OP2, Q2_OP3.
+        # Если есть и языковая, и другая причина - все равно считаем языковым
+        return bool(q2_options & {'Q2_OP1', 'Q2_OP2', 'Q2_OP3'})
     
     return False
 
@@ -303,62 +374,32 @@ def determine_aggression_type(answers: dict) -> str:
         'open' для явной агрессии, 'subtle' для скрытой
     """
     # Проверяем LQ2 (прямые оскорбления)
-    lq2_answer = answers.get("LQ2", "")
+    lq2_options = get_option_codes(answers, "LQ2")
     
-    if "LQ2_OP1" in lq2_answer or "LQ2_OP2" in lq2_answer:
+    if lq2_options & {"LQ2_OP1", "LQ2_OP2"}:
         # Часто оскорбляют напрямую или иногда = явная агрессия
         return "open"
-    elif "LQ2_OP3" in lq2_answer:
-        # Намёки и скрытая агрессия
-        return "subtle"
-    else:
-        # По умолчанию считаем скрытой
-        return "subtle"
+    
+    # Намёки и скрытая агрессия (LQ2_OP3), по умолчанию тоже скрытая
+    return "subtle"
 
 
 def get_question_by_code(code: str):
     """Получить вопрос по коду"""
-    for q in QUESTIONS:
-        if q["code"] == code:
-            return q
-    return None
+    return QUESTIONNAIRE.question(code)
 
 
 def get_next_question(current_code: str, answers: dict) -> str:
     """Получить код следующего вопроса с учётом условий"""
-    current_idx = next((i for i, q in enumerate(QUESTIONS) if q["code"] == current_code), -1)
-    
-    if current_idx == -1 or current_idx == len(QUESTIONS) - 1:
-        return None
-    
-    # Проверяем следующие вопросы на условия
-    for i in range(current_idx + 1, len(QUESTIONS)):
-        question = QUESTIONS[i]
-        
-        # Проверяем условие
-        if "condition" in question:
-            cond = question["condition"]
-            cond_answer = answers.get(cond["question"])
-            
-            # Если условие не выполнено, пропускаем вопрос
-            if not cond_answer or cond_answer not in cond["values"]:
-                continue
-        
-        return question["code"]
-    
-    return None
+    return QUESTIONNAIRE.next_question(current_code, answers)
 
 
 def get_previous_question(current_code: str) -> str:
     """Получить код предыдущего вопроса"""
-    current_idx = next((i for i, q in enumerate(QUESTIONS) if q["code"] == current_code), -1)
-    
-    if current_idx <= 0:
-        return None
-    
-    return QUESTIONS[current_idx - 1]["code"]
+    return QUESTIONNAIRE.previous.get(current_code)
 
 
 def get_question_number(code: str) -> int:
     """Получить номер вопроса"""
-    return next((i + 1 for i, q in enumerate(QUESTIONS) if q["code"] == code), 0)
+    position = QUESTIONNAIRE.position.get(code)
+    return position + 1 if position is not None else 0
@@ -1,4 +1,10 @@
 """Рекомендации и алгоритмы действий при буллинге"""
+from typing import Dict, List, Optional, Tuple
+
+from utils.i18n import TEXTS, get_text
+
+# Telegram ограничивает сообщение 4096 символами, берём с запасом
+MAX_MESSAGE_LENGTH = 4000
 
 # Алгоритмы действий при различных типах языкового буллинга
 RECOMMENDATIONS = {
@@ -163,3 +169,44 @@ def get_rejection_message() -> str:
         "👨‍⚖️ Омбудсмен по правам ребёнка\n\n"
         "Мы надеемся, что вы получите помощь от специалистов, и всё у вас будет хорошо. Удачи вам! 💪"
     )
+
+
+def split_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Разбить длинный текст на сообщения по границам строк"""
+    if len(text) <= max_length:
+        return [text]
+    
+    parts = []
+    current_part = ""
+    for line in text.split('\n'):
+        if len(current_part) + len(line) + 1 < max_length:
+            current_part += line + '\n'
+        else:
+            parts.append(current_part)
+            current_part = line + '\n'
+    if current_part:
+        parts.append(current_part)
+    return parts
+
+
+def _build_recommendation_messages(aggression_type: Optional[str], lang: str) -> Tuple[str, ...]:
+    recommendations = get_recommendation_by_type('linguistic', aggression_type)
+    if not recommendations:
+        return ()
+    return tuple(split_message(get_text(lang, "recommendations_title") + recommendations))
+
+
+# Готовые сообщения с рекомендациями: текст зависит только от типа агрессии и языка
+RECOMMENDATION_MESSAGES: Dict[Tuple[str, str], Tuple[str, ...]] = {
+    (aggression_type, lang): _build_recommendation_messages(aggression_type, lang)
+    for aggression_type in ('subtle', 'open')
+    for lang in TEXTS
+}
+
+
+def get_recommendation_messages(aggression_type: str, lang: str = "ru") -> Tuple[str, ...]:
+    """Рекомендации для языкового буллинга, уже разбитые на сообщения"""
+    messages = RECOMMENDATION_MESSAGES.get((aggression_type, lang))
+    if messages is None:
+        messages = _build_recommendation_messages(aggression_type, lang)
+    return messages